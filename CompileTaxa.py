@@ -11,6 +11,9 @@ import os
 spec = importlib.util.spec_from_file_location("Common", "../../pipeline/Common.py")
 Common = importlib.util.module_from_spec(spec)
 spec.loader.exec_module(Common)
+spec = importlib.util.spec_from_file_location("Instrumentation", os.path.join(os.path.dirname(os.path.abspath(__file__)), "Instrumentation.py"))
+Instrumentation = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(Instrumentation)
 
 """Return list of experimental taxa and accessions from the fieldbook.
 
@@ -21,6 +24,7 @@ spec.loader.exec_module(Common)
     summarize -- if True, print information about the set
     enumerate -- if True, print the whole list of taxa in lexicographical order
 """
+@Instrumentation.instrumented()
 def getTaxaFromFieldbook(genotypeBarcodeKeyFilename, env, summarize=False, enumerate=False):
     taxa = []
     barcodeKeyfile = open(genotypeBarcodeKeyFilename)
@@ -29,6 +33,7 @@ def getTaxaFromFieldbook(genotypeBarcodeKeyFilename, env, summarize=False, enume
         if not vals[0] == "name" and not vals[0] == "B73" and not vals[0] == "Mo17":
             taxon = (vals[0],vals[1])
             taxa.append(taxon)
+    Instrumentation.currentStage().count(rowsIn=len(taxa), bytesIn=os.path.getsize(genotypeBarcodeKeyFilename))
     
     if summarize:
         print("Taxa according to the " + env + " fieldbook:")
@@ -54,6 +59,7 @@ def getTaxaFromFieldbook(genotypeBarcodeKeyFilename, env, summarize=False, enume
     Arguments:
     fieldbookNames -- a list of the taxa names according to the MLC fieldbooks
 """
+@Instrumentation.instrumented()
 def buildStandardFromFieldbookNames(fieldbookNames):
     standard = []
     for taxon in fieldbookNames:
@@ -64,6 +70,7 @@ def buildStandardFromFieldbookNames(fieldbookNames):
         standardName = standardName.replace(".","_")
         standardName = standardName.replace(":","_")
         standard.append(standardName)
+    Instrumentation.currentStage().count(rowsIn=len(fieldbookNames), rowsOut=len(standard))
     return standard
 
 """Return list of (taxa, accession) from Hirsch et al., 2014, supp. table 1.
@@ -74,6 +81,7 @@ def buildStandardFromFieldbookNames(fieldbookNames):
     summarize -- if True, print information about the set
     enumerate -- if True, print the whole list of taxa in lexicographical order
 """
+@Instrumentation.instrumented()
 def getHirsch_et_al_2014_Taxa_Supp1Table(suppTable1Filename, summarize=False,enumerate=False):
     taxa = []
     suppTableFile = open(suppTable1Filename)
@@ -87,6 +95,7 @@ def getHirsch_et_al_2014_Taxa_Supp1Table(suppTable1Filename, summarize=False,enu
         accessionNumber = vals[1].strip()
         taxon = (genotype,accessionNumber)
         taxa.append(taxon)
+    Instrumentation.currentStage().count(rowsIn=len(taxa), bytesIn=os.path.getsize(suppTable1Filename))
         
     if summarize:
         print("Taxa in Hirsch et al., 2014, Supplementary Table 1:")
@@ -109,6 +118,7 @@ def getHirsch_et_al_2014_Taxa_Supp1Table(suppTable1Filename, summarize=False,enu
     summarize -- if True, print information about the set
     enumerate -- if True, print the whole list of taxa in lexicographical order
 """
+@Instrumentation.instrumented()
 def getHirsch_et_al_2014_Taxa_RawSNPTable(rawInputFilename, summarize=False,enumerate=False):
     inputFile = open(rawInputFilename)
     lineNum = 0
@@ -120,6 +130,7 @@ def getHirsch_et_al_2014_Taxa_RawSNPTable(rawInputFilename, summarize=False,enum
             taxa = list(map(lambda x: x.strip(), taxa))
         else:
             break
+    Instrumentation.currentStage().count(rowsIn=len(taxa))
     if summarize:
         print("Taxa in Hirsch et al., 2014, raw SNP table:")
         print("    " + str(len(taxa)) + " taxa")
@@ -139,6 +150,7 @@ def getHirsch_et_al_2014_Taxa_RawSNPTable(rawInputFilename, summarize=False,enum
     summarize -- if True, print information about the set
     enumerate -- if True, print the whole list of taxa in lexicographical order
 """
+@Instrumentation.instrumented()
 def getHirsch_et_al_2014_Taxa_ImputedSNPTable(imputedInputFilename, summarize=False,enumerate=False):
     inputFile = open(imputedInputFilename)
     lineNum = 0
@@ -150,6 +162,7 @@ def getHirsch_et_al_2014_Taxa_ImputedSNPTable(imputedInputFilename, summarize=Fa
             taxa = list(map(lambda x: x.strip(), taxa))
         else:
             break
+    Instrumentation.currentStage().count(rowsIn=len(taxa))
     
     if summarize:
         print("Taxa in Hirsch et al., 2014, imputed SNP table:")
@@ -170,10 +183,11 @@ if __name__ == "__main__":
     Hirsch_rawInputFilename = Common.genotypeTopLevel + os.sep + "maize_503genotypes_485179SNPs_working_SNP_set.txt"
     Hirsch_imputedInputFilename = Common.genotypeTopLevel + os.sep + "GAPIT.RNAseq.hmp_438K_imputed2.csv"
     
-    AZ16_fieldbook_taxa = getTaxaFromFieldbook(AZ16_genotypeBarcodeKeyfilename, "AZ16")
-    SD16_fieldbook_taxa = getTaxaFromFieldbook(SD16_genotypeBarcodeKeyfilename, "SD16")
-    
-    """Consider differences between the sets from the two field designs"""
+    with Instrumentation.stage("CompileTaxa"):
+        AZ16_fieldbook_taxa = getTaxaFromFieldbook(AZ16_genotypeBarcodeKeyfilename, "AZ16")
+        SD16_fieldbook_taxa = getTaxaFromFieldbook(SD16_genotypeBarcodeKeyfilename, "SD16")
+        
+        """Consider differences between the sets from the two field designs"""
 #     missing = set(AZ16_fieldbook_taxa).difference(set(SD16_fieldbook_taxa))
 #     for taxon in missing:
 #         print(eltaxon)
@@ -181,30 +195,32 @@ if __name__ == "__main__":
 #     missing = set(SD16_fieldbook_taxa).difference(set(AZ16_fieldbook_taxa))
 #     for taxon in missing:
 #         print(taxon)
-    
-    """Create the master set of taxa as the union of the two sets, then apply
-    name standardization"""
+        
+        """Create the master set of taxa as the union of the two sets, then apply
+        name standardization"""
 #     all_MLC_fieldbook_taxa = list(set(AZ16_fieldbook_taxa).union(set(SD16_fieldbook_taxa)))
 #     standard_taxa = buildStandardFromFieldbookNames(list(map(lambda x: x[0], all_MLC_fieldbook_taxa)))
 #     print(len(standard_taxa))
 #     for taxon in sorted(standard_taxa):
 #         print(taxon)
-    
-    """I used the functions below to list all the taxa and accessions from the
-    different sources, then built a spreadsheet by hand matching them by hand.
-    The spreadsheet is used for all subsequent translation between name schema.
-    """
-    HirschSuppTable_taxa = getHirsch_et_al_2014_Taxa_Supp1Table(Hirsch_suppTable1Filename,False,False)
-    HirschRawSNP_taxa = getHirsch_et_al_2014_Taxa_RawSNPTable(Hirsch_rawInputFilename,False,False)
-    HirschImputedSNP_taxa = getHirsch_et_al_2014_Taxa_ImputedSNPTable(Hirsch_imputedInputFilename,False,False)
-    
-    """The table used for name conversion"""
-    masterTableFilename = Common.designPath + os.sep + "taxa" + os.sep + "taxa_&_accession_name_mappings.csv"
-    masterTaxaTable = Common.readTableFromFile(masterTableFilename, delimChar=',', header=True)
-    
-    #for i in range(0, len(masterTaxaTable)):
-    #    for j in range(0, len(masterTaxaTable[i])):
-    #        if (masterTaxaTable[i][j] != masterTaxaTable[i][j].strip()):
-    #            print(masterTaxaTable[i][j])
-    
+        
+        """I used the functions below to list all the taxa and accessions from the
+        different sources, then built a spreadsheet by hand matching them by hand.
+        The spreadsheet is used for all subsequent translation between name schema.
+        """
+        HirschSuppTable_taxa = getHirsch_et_al_2014_Taxa_Supp1Table(Hirsch_suppTable1Filename,False,False)
+        HirschRawSNP_taxa = getHirsch_et_al_2014_Taxa_RawSNPTable(Hirsch_rawInputFilename,False,False)
+        HirschImputedSNP_taxa = getHirsch_et_al_2014_Taxa_ImputedSNPTable(Hirsch_imputedInputFilename,False,False)
+        
+        """The table used for name conversion"""
+        masterTableFilename = Common.designPath + os.sep + "taxa" + os.sep + "taxa_&_accession_name_mappings.csv"
+        with Instrumentation.stage("masterTaxaTable") as step:
+            masterTaxaTable = Common.readTableFromFile(masterTableFilename, delimChar=',', header=True)
+            step.count(rowsIn=len(masterTaxaTable), bytesIn=os.path.getsize(masterTableFilename))
+        
+        #for i in range(0, len(masterTaxaTable)):
+        #    for j in range(0, len(masterTaxaTable[i])):
+        #        if (masterTaxaTable[i][j] != masterTaxaTable[i][j].strip()):
+        #            print(masterTaxaTable[i][j])
+        
     print("Done!")
\ No newline at end of file
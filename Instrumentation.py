@@ -0,0 +1,312 @@
+"""Shared instrumentation for the genotype and GWAS-prep stages.
+
+Any stage can be timed with the stage() context manager or the instrumented()
+decorator. Stages nest: a stage opened inside another becomes one of its
+sub-steps. When a stage ends, one JSON line is emitted with:
+
+    wall, cpu       -- wall clock and CPU time of this process, in seconds
+    childCpu        -- CPU time of child processes (e.g. TASSEL, sed)
+    rowsIn, rowsOut, bytesIn, bytesOut -- counters set by the stage
+    peakRssKB       -- peak resident set size of the process so far
+    heapPeakKB      -- peak Python heap of the stage (MLC_TRACEMALLOC only)
+
+Counters are plain attributes of the stage, or can be added with count().
+Inside hot loops, count into local variables and add the totals once at the
+end of the loop.
+
+Behavior is controlled through the environment:
+
+    MLC_INSTRUMENT_LOG -- file to append the JSON lines to ("-" for stderr).
+                          If unset, stages are still timed but nothing is
+                          emitted.
+    MLC_TRACEMALLOC    -- if set, track the peak Python heap of every stage
+    MLC_PROFILE        -- if set, attach a sampling profiler to the outermost
+                          stage, sampling every MLC_PROFILE milliseconds (any
+                          non-numeric value samples every 5 ms). Collapsed
+                          stacks are written next to the log, ready for
+                          flamegraph.pl, and the top stacks are added to the
+                          stage's JSON line.
+
+Example:
+
+    with Instrumentation.stage("subset", input=inputFilename) as st:
+        with Instrumentation.stage("loadSiteNames"):
+            ...
+        st.count(rowsIn=nRows, bytesIn=os.path.getsize(inputFilename))
+        Instrumentation.call(["sed","-i","-e",'1,1s/#//g',path])
+"""
+
+"""Dependencies"""
+import collections
+import functools
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+
+LOG_ENV = "MLC_INSTRUMENT_LOG"
+TRACEMALLOC_ENV = "MLC_TRACEMALLOC"
+PROFILE_ENV = "MLC_PROFILE"
+DEFAULT_PROFILE_INTERVAL = 0.005
+PROFILE_TOP_STACKS = 10
+
+_local = threading.local()
+_emitLock = threading.Lock()
+_logStream = None
+
+"""Return the stack of open stages for the calling thread."""
+def _stageStack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+"""Return the innermost open stage of the calling thread, or None."""
+def currentStage():
+    stack = _stageStack()
+    if len(stack) == 0:
+        return None
+    return stack[-1]
+
+"""Return the peak RSS of this process in kB."""
+def peakRssKB():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak = peak // 1024 # reported in bytes rather than kB
+    return peak
+
+"""Write one record as a JSON line to the configured log, if any.
+
+    Arguments:
+    record -- a JSON-serializable dict
+"""
+def emit(record):
+    global _logStream
+    logFilename = os.environ.get(LOG_ENV)
+    if not logFilename:
+        return
+    line = json.dumps(record, sort_keys=True) + "\n"
+    with _emitLock:
+        if _logStream is None:
+            if logFilename == "-":
+                _logStream = sys.stderr
+            else:
+                _logStream = open(logFilename, 'a')
+        _logStream.write(line)
+        _logStream.flush()
+
+"""Samples the stack of one thread at a fixed interval, on a daemon thread.
+
+    Arguments:
+    interval -- seconds between samples
+"""
+class SamplingProfiler(object):
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.samples = 0
+        self.stacks = collections.Counter()
+        self._targetThread = threading.get_ident()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="SamplingProfiler")
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self._targetThread)
+            frames = []
+            if frame is not None:
+                # the innermost frame carries its line number, to tell apart
+                # e.g. parsing from string building within one function
+                code = frame.f_code
+                frames.append(os.path.basename(code.co_filename) + ":" + code.co_name + ":" + str(frame.f_lineno))
+                frame = frame.f_back
+            while frame is not None:
+                code = frame.f_code
+                frames.append(os.path.basename(code.co_filename) + ":" + code.co_name)
+                frame = frame.f_back
+            frames.reverse()
+            self.stacks[";".join(frames)] += 1
+            self.samples += 1
+
+    """Write the samples as collapsed stacks ("a;b;c count" per line).
+
+        Arguments:
+        filename -- the file to write to
+    """
+    def writeFolded(self, filename):
+        out = open(filename, 'w')
+        for stack, count in self.stacks.most_common():
+            out.write(stack + " " + str(count) + "\n")
+        out.close()
+
+"""Return the sampling interval requested through MLC_PROFILE, or None."""
+def _profileInterval():
+    value = os.environ.get(PROFILE_ENV)
+    if not value:
+        return None
+    try:
+        return float(value) / 1000.0
+    except ValueError:
+        return DEFAULT_PROFILE_INTERVAL
+
+"""A timed stage (or sub-step) of a pipeline script. See the module docstring.
+
+    Arguments:
+    name -- name of the stage, e.g. the script or function name
+    fields -- extra JSON-serializable values to include in the record
+"""
+class Stage(object):
+
+    def __init__(self, name, **fields):
+        self.name = name
+        self.fields = fields
+        self.rowsIn = 0
+        self.rowsOut = 0
+        self.bytesIn = 0
+        self.bytesOut = 0
+        self.parent = None
+        self.path = name
+        self._childHeapPeak = 0
+        self._profiler = None
+
+    """Add to the stage's counters."""
+    def count(self, rowsIn=0, rowsOut=0, bytesIn=0, bytesOut=0):
+        self.rowsIn += rowsIn
+        self.rowsOut += rowsOut
+        self.bytesIn += bytesIn
+        self.bytesOut += bytesOut
+
+    def __enter__(self):
+        stack = _stageStack()
+        if len(stack) > 0:
+            self.parent = stack[-1]
+            self.path = self.parent.path + "/" + self.name
+        stack.append(self)
+
+        if os.environ.get(TRACEMALLOC_ENV):
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            if self.parent is not None:
+                self.parent._childHeapPeak = max(self.parent._childHeapPeak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        if self.parent is None:
+            interval = _profileInterval()
+            if interval is not None:
+                self._profiler = SamplingProfiler(interval)
+                self._profiler.start()
+
+        self._start = time.time()
+        times = os.times()
+        self._childCpuStart = times.children_user + times.children_system
+        self._cpuStart = time.process_time()
+        self._wallStart = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        wall = time.perf_counter() - self._wallStart
+        cpu = time.process_time() - self._cpuStart
+        times = os.times()
+        childCpu = times.children_user + times.children_system - self._childCpuStart
+        _stageStack().pop()
+
+        record = {
+            "stage": self.name,
+            "path": self.path,
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "start": self._start,
+            "wall": wall,
+            "cpu": cpu,
+            "childCpu": childCpu,
+            "rowsIn": self.rowsIn,
+            "rowsOut": self.rowsOut,
+            "bytesIn": self.bytesIn,
+            "bytesOut": self.bytesOut,
+            "peakRssKB": peakRssKB()
+        }
+        if tracemalloc.is_tracing():
+            heapPeak = max(tracemalloc.get_traced_memory()[1], self._childHeapPeak)
+            record["heapPeakKB"] = heapPeak // 1024
+            if self.parent is not None:
+                self.parent._childHeapPeak = max(self.parent._childHeapPeak, heapPeak)
+        if self._profiler is not None:
+            self._profiler.stop()
+            record["profile"] = self._writeProfile()
+        if excType is not None:
+            record["error"] = excType.__name__ + ": " + str(excValue)
+        record.update(self.fields)
+        emit(record)
+        return False
+
+    """Write the collapsed stacks next to the log and return their summary."""
+    def _writeProfile(self):
+        profiler = self._profiler
+        logFilename = os.environ.get(LOG_ENV)
+        if logFilename and logFilename != "-":
+            directory = os.path.dirname(os.path.abspath(logFilename))
+        else:
+            directory = os.getcwd()
+        foldedFilename = os.path.join(directory, self.name + "." + str(os.getpid()) + ".folded")
+        profiler.writeFolded(foldedFilename)
+        return {
+            "interval": profiler.interval,
+            "samples": profiler.samples,
+            "folded": foldedFilename,
+            "top": profiler.stacks.most_common(PROFILE_TOP_STACKS)
+        }
+
+"""Return a new stage, for use as a context manager.
+
+    Arguments:
+    name -- name of the stage
+    fields -- extra JSON-serializable values to include in the record
+"""
+def stage(name, **fields):
+    return Stage(name, **fields)
+
+"""Decorator running the wrapped function as a stage.
+
+    The stage can be reached from within the function through currentStage().
+
+    Arguments:
+    name -- name of the stage; defaults to the function name
+"""
+def instrumented(name=None):
+    def decorator(function):
+        stageName = name
+        if stageName is None:
+            stageName = function.__name__
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with Stage(stageName):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+"""Run a command through subprocess.call() as a sub-step and return its exit code.
+
+    The command's CPU time appears as childCpu in the step's record.
+
+    Arguments:
+    commandList -- the command and its arguments
+    name -- name of the step; defaults to the command's basename
+"""
+def call(commandList, name=None, **kwargs):
+    if name is None:
+        name = os.path.basename(commandList[0])
+    with Stage(name, command=" ".join(commandList)) as step:
+        returnCode = subprocess.call(commandList, **kwargs)
+        step.fields["returnCode"] = returnCode
+    return returnCode
@@ -0,0 +1,265 @@
+"""Time the genotype and GWAS-prep scripts against synthetic data.
+
+Generates a synthetic dataset (see SyntheticGenotypes.py), then runs each stage
+in a fresh interpreter so that the peak RSS reported is that of the stage alone.
+For every stage the wall and CPU time, throughput (rows/s, i.e. sites/s for the
+HapMap stages, and MB/s of input) and peak RSS are recorded. Results are written
+as JSON, tagged with the current git commit, so that runs from two commits can
+be compared:
+
+    python GenotypeBenchmarks.py --preset medium --output before.json
+    (check out the other commit)
+    python GenotypeBenchmarks.py --preset medium --output after.json
+    python GenotypeBenchmarks.py --compare before.json after.json
+
+Stages:
+convert -- HapMap_VCF_Converter.convertHapMapToVCF
+subset -- SubsetHapMapBySiteNames.subsetHapMapBySiteNames
+stitch -- BuildBaseHapMap.stitchHapMap
+patch -- PatchTaxaNames.patchFile
+"""
+
+"""Dependencies"""
+import argparse
+import datetime
+import importlib.util
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+
+spec = importlib.util.spec_from_file_location("SyntheticGenotypes", os.path.join(BENCHMARK_DIR, "SyntheticGenotypes.py"))
+SyntheticGenotypes = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(SyntheticGenotypes)
+
+PRESETS = {
+    "small": (10000, 100),
+    "medium": (100000, 500),
+    "production": (500000, 1000)
+}
+
+STAGES = ["convert", "subset", "stitch", "patch"]
+
+"""Load one of the pipeline scripts as a module, without running its main block.
+
+    Arguments:
+    relativePath -- path of the script, relative to the repository root
+"""
+def loadScript(relativePath):
+    name = os.path.splitext(os.path.basename(relativePath))[0]
+    spec = importlib.util.spec_from_file_location(name, os.path.join(REPO_DIR, relativePath))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+"""Return the paths of the dataset files within a working directory.
+
+    Arguments:
+    workDir -- directory holding the generated dataset
+"""
+def datasetPaths(workDir):
+    return {
+        "hapmap": os.path.join(workDir, "synthetic.hmp.txt"),
+        "header": os.path.join(workDir, "synthetic_header.csv"),
+        "noHeader": os.path.join(workDir, "synthetic_noHeader.csv"),
+        "siteList": os.path.join(workDir, "synthetic.prune.in"),
+        "kinship": os.path.join(workDir, "synthetic_kinship.csv"),
+        "config": os.path.join(workDir, "synthetic.json")
+    }
+
+"""Generate the dataset, unless one with an identical configuration exists.
+
+    Arguments:
+    config -- generator configuration
+    workDir -- directory to write the dataset to
+"""
+def prepareDataset(config, workDir):
+    paths = datasetPaths(workDir)
+    if os.path.exists(paths["config"]):
+        if json.load(open(paths["config"])) == config:
+            return paths
+    if not os.path.isdir(workDir):
+        os.makedirs(workDir)
+    print("Generating " + str(config["sites"]) + " sites x " + str(config["taxa"]) + " taxa in " + workDir + "...")
+    SyntheticGenotypes.writeHapMap(config, paths["hapmap"])
+    SyntheticGenotypes.writeSplitHapMap(config, paths["header"], paths["noHeader"])
+    SyntheticGenotypes.writeSiteList(config, paths["siteList"])
+    SyntheticGenotypes.writeKinshipMatrix(config, paths["kinship"])
+    json.dump(config, open(paths["config"], 'w'), indent=1)
+    return paths
+
+"""Run a single stage in this process and return its measurements.
+
+    Called in a child interpreter by runStage(); peak RSS is that of the child.
+
+    Arguments:
+    stage -- name of the stage, one of STAGES
+    workDir -- directory holding the generated dataset
+"""
+def measureStage(stage, workDir):
+    paths = datasetPaths(workDir)
+    config = json.load(open(paths["config"]))
+    if stage == "convert":
+        module = loadScript("genotypes/HapMap_VCF_Converter.py")
+        inputs = [paths["hapmap"]]
+        output = os.path.join(workDir, "out_convert.vcf")
+        run = lambda: module.convertHapMapToVCF(paths["hapmap"], output)
+    elif stage == "subset":
+        module = loadScript("genotypes/SubsetHapMapBySiteNames.py")
+        inputs = [paths["hapmap"], paths["siteList"]]
+        output = os.path.join(workDir, "out_subset.hmp.txt")
+        run = lambda: module.subsetHapMapBySiteNames(paths["siteList"], paths["hapmap"], output)
+    elif stage == "stitch":
+        module = loadScript("genotypes/BuildBaseHapMap.py")
+        inputs = [paths["header"], paths["noHeader"]]
+        output = os.path.join(workDir, "out_stitch.hmp.txt")
+        run = lambda: module.stitchHapMap(paths["header"], paths["noHeader"], output)
+    elif stage == "patch":
+        module = loadScript("gwas/PatchTaxaNames.py")
+        inputs = [paths["kinship"]]
+        output = os.path.join(workDir, "out_patch.csv")
+        run = lambda: module.patchFile(paths["kinship"], output)
+    else:
+        raise ValueError("Unknown stage: " + stage)
+
+    wallStart = time.perf_counter()
+    cpuStart = time.process_time()
+    run()
+    cpu = time.process_time() - cpuStart
+    wall = time.perf_counter() - wallStart
+
+    if stage == "patch":
+        rows = config["taxa"]
+    else:
+        rows = config["sites"]
+    bytesIn = sum(map(os.path.getsize, inputs))
+    peakRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peakRss = peakRss // 1024 # reported in bytes rather than kB
+    return {
+        "stage": stage,
+        "wall": wall,
+        "cpu": cpu,
+        "rows": rows,
+        "bytesIn": bytesIn,
+        "bytesOut": os.path.getsize(output),
+        "rowsPerSec": rows / wall,
+        "mbPerSec": bytesIn / wall / 1e6,
+        "peakRssKB": peakRss
+    }
+
+"""Run a stage in a fresh interpreter and return its measurements.
+
+    Arguments:
+    stage -- name of the stage, one of STAGES
+    workDir -- directory holding the generated dataset
+"""
+def runStage(stage, workDir):
+    commandList = [sys.executable, os.path.abspath(__file__), "--worker", stage, "--workdir", workDir]
+    output = subprocess.check_output(commandList)
+    return json.loads(output.decode().strip().split("\n")[-1])
+
+"""Return the current git commit of the repository, or None if unavailable."""
+def gitCommit():
+    try:
+        output = subprocess.check_output(["git","rev-parse","HEAD"], cwd=REPO_DIR, stderr=subprocess.DEVNULL)
+        return output.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+"""Print a per-stage comparison of the median wall times of two result files.
+
+    Arguments:
+    baselineFilename -- results of the reference run
+    candidateFilename -- results of the run to compare against the reference
+"""
+def compareResults(baselineFilename, candidateFilename):
+    baseline = json.load(open(baselineFilename))
+    candidate = json.load(open(candidateFilename))
+    if baseline["config"] != candidate["config"]:
+        print("WARNING: the two runs used different dataset configurations")
+    print("stage\tbaseline_s\tcandidate_s\tratio\tbaseline_rss_kB\tcandidate_rss_kB")
+    for stage in STAGES:
+        if stage not in baseline["summary"] or stage not in candidate["summary"]:
+            continue
+        b = baseline["summary"][stage]
+        c = candidate["summary"][stage]
+        ratio = c["medianWall"] / b["medianWall"]
+        print(stage + "\t" + "%.3f" % b["medianWall"] + "\t" + "%.3f" % c["medianWall"] + "\t" + "%.2f" % ratio
+              + "\t" + str(b["peakRssKB"]) + "\t" + str(c["peakRssKB"]))
+
+"""Executable"""
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark the genotype scripts on synthetic data.")
+    parser.add_argument("--preset", choices=sorted(PRESETS.keys()), default="small")
+    parser.add_argument("--sites", type=int, help="override the number of sites of the preset")
+    parser.add_argument("--taxa", type=int, help="override the number of taxa of the preset")
+    parser.add_argument("--config", help="JSON file overriding any generator settings")
+    parser.add_argument("--stages", default=",".join(STAGES), help="comma-separated stages to run")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workdir", default=os.path.join(BENCHMARK_DIR, "data"))
+    parser.add_argument("--output", help="JSON file to write the results to")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE","CANDIDATE"))
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        print(json.dumps(measureStage(args.worker, args.workdir)))
+        sys.exit(0)
+
+    if args.compare is not None:
+        compareResults(args.compare[0], args.compare[1])
+        sys.exit(0)
+
+    sites, taxa = PRESETS[args.preset]
+    if args.sites is not None:
+        sites = args.sites
+    if args.taxa is not None:
+        taxa = args.taxa
+    config = SyntheticGenotypes.defaultConfig(sites, taxa)
+    if args.config is not None:
+        config.update(json.load(open(args.config)))
+    workDir = os.path.join(args.workdir, str(sites) + "x" + str(taxa) + "_seed" + str(config["seed"]))
+    prepareDataset(config, workDir)
+
+    runs = []
+    summary = {}
+    for stage in args.stages.split(","):
+        stageRuns = []
+        for i in range(0, args.repeat):
+            result = runStage(stage, workDir)
+            result["repeat"] = i
+            stageRuns.append(result)
+            print(stage + " #" + str(i) + ": " + "%.3f" % result["wall"] + " s, "
+                  + "%.0f" % result["rowsPerSec"] + " rows/s, " + "%.1f" % result["mbPerSec"] + " MB/s, "
+                  + str(result["peakRssKB"]) + " kB peak RSS")
+        runs.extend(stageRuns)
+        summary[stage] = {
+            "medianWall": statistics.median(map(lambda x: x["wall"], stageRuns)),
+            "medianRowsPerSec": statistics.median(map(lambda x: x["rowsPerSec"], stageRuns)),
+            "medianMBPerSec": statistics.median(map(lambda x: x["mbPerSec"], stageRuns)),
+            "peakRssKB": max(map(lambda x: x["peakRssKB"], stageRuns))
+        }
+
+    results = {
+        "commit": gitCommit(),
+        "date": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": config,
+        "runs": runs,
+        "summary": summary
+    }
+    outputFilename = args.output
+    if outputFilename is None:
+        outputFilename = os.path.join(BENCHMARK_DIR, "results_" + str(results["commit"])[:10] + ".json")
+    json.dump(results, open(outputFilename, 'w'), indent=1)
+    print("Results written to " + outputFilename)
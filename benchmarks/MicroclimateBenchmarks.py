@@ -0,0 +1,512 @@
+"""Time the microclimate logger and sync scripts offline, on stand-ins.
+
+ProbeLogger.py and SyncProbeDBs.py run against the stand-ins of
+MicroclimateStandIns.py: a simulated DHT22, sqlite databases behind the
+MySQLdb/pymysql interfaces, and an accelerated clock. As in
+GenotypeBenchmarks.py, each stage runs in a fresh interpreter, so that the peak
+RSS reported is that of the stage alone, and results are written as JSON,
+tagged with the current git commit, to compare two commits:
+
+    python MicroclimateBenchmarks.py --preset medium --output before.json
+    (check out the other commit)
+    python MicroclimateBenchmarks.py --preset medium --output after.json
+    python MicroclimateBenchmarks.py --compare before.json after.json
+
+Stages:
+cadence -- ProbeLogger._loggerRoutine with two sensors, the database writer and
+           the live feed and rollups, for a number of sampling ticks on the
+           accelerated clock; the jitter is how late each reading started
+           against its tick, in simulated seconds
+sync -- SyncProbeDBs.update of a backlog of rows to a new text table (rows/s)
+syncColumnar -- the same, to a new columnar archive
+syncBundle -- the same, to a new text table, from bundles of the Pi's local
+              archive served by ProbeServer on localhost instead of MySQL
+startup -- opening a ProbeArchive of a number of readings, and loading the
+           live window and rollups from it, as ProbeLogger does at startup
+recovery -- the same opening, after a simulated power cut: the active segment
+            ends with a torn frame and zeroed bytes, and the previous segment's
+            compression did not complete
+
+Monitor.py needs jinja2 and the Pi's web folder, and is not benchmarked.
+"""
+
+"""Dependencies"""
+import argparse
+import asyncio
+import datetime
+import gzip
+import importlib.util
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+PI_DIR = os.path.join(REPO_DIR, "microclimateMonitors", "pi")
+LOCAL_DIR = os.path.join(REPO_DIR, "microclimateMonitors", "local")
+
+spec = importlib.util.spec_from_file_location("MicroclimateStandIns", os.path.join(BENCHMARK_DIR, "MicroclimateStandIns.py"))
+MicroclimateStandIns = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(MicroclimateStandIns)
+
+# backlog sizes of the sync stages, readings of the startup and recovery
+# archives (a year at 30 s is about a million), and ticks of the cadence stage
+PRESETS = {
+    "small": {"rows": [1000, 10000], "readings": [10000], "ticks": 60},
+    "medium": {"rows": [1000, 10000, 100000, 1000000], "readings": [100000], "ticks": 120},
+    "production": {"rows": [1000, 10000, 100000, 1000000, 10000000], "readings": [1000000], "ticks": 240}
+}
+
+STAGES = ["cadence", "sync", "syncColumnar", "syncBundle", "startup", "recovery"]
+
+START_TIME = 1496275200 # 2017-06-01 UTC, timestamp of the first synthetic reading
+READING_INTERVAL = 30 # seconds between synthetic readings, as on the Pis
+SAMPLE_INTERVAL = 30 # sampling interval of the cadence stage, in simulated seconds
+
+"""Load one of the scripts as a module, without running its main block.
+
+    Arguments:
+    relativePath -- path of the script, relative to the repository root
+"""
+def loadScript(relativePath):
+    name = os.path.splitext(os.path.basename(relativePath))[0]
+    spec = importlib.util.spec_from_file_location(name, os.path.join(REPO_DIR, relativePath))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+"""Stop a script's logger from logging to the console (its log file is kept),
+and return the script.
+
+    Arguments:
+    module -- the script, as loaded by loadScript()
+"""
+def quiet(module):
+    for handler in list(module.logger.handlers):
+        if type(handler) is logging.StreamHandler:
+            module.logger.removeHandler(handler)
+    return module
+
+"""Return the sqlite stand-in of the probe databases within a working directory.
+
+    Arguments:
+    workDir -- the working directory
+"""
+def sqlServer(workDir):
+    return MicroclimateStandIns.SQLServer(os.path.join(workDir, "sql"))
+
+"""Create the probe database of a sync backlog, unless it exists.
+
+    Arguments:
+    workDir -- the working directory
+    rows -- number of readings in the database
+"""
+def prepareDatabase(workDir, rows):
+    server = sqlServer(workDir)
+    db = "backlog_" + str(rows)
+    if os.path.isfile(server.databasePath(db)):
+        return db
+    print("Generating a probe database of " + str(rows) + " rows in " + server.directory + "...")
+    server.createProbeTable(db + ".tmp", "probe")
+    server.fillProbeTable(db + ".tmp", "probe", rows, START_TIME, READING_INTERVAL)
+    os.replace(server.databasePath(db + ".tmp"), server.databasePath(db))
+    return db
+
+"""Create a local archive of synthetic readings, unless it exists.
+
+    Arguments:
+    workDir -- the working directory
+    readings -- number of readings in the archive, besides the null entry
+"""
+def prepareArchive(workDir, readings):
+    archiveDirectory = os.path.join(workDir, "archive_" + str(readings))
+    if os.path.isdir(archiveDirectory):
+        return archiveDirectory
+    print("Generating a local archive of " + str(readings) + " readings in " + archiveDirectory + "...")
+    ProbeArchive = loadScript("microclimateMonitors/pi/ProbeArchive.py")
+    tmpDirectory = archiveDirectory + ".tmp"
+    shutil.rmtree(tmpDirectory, ignore_errors=True)
+    archive = ProbeArchive.ProbeArchive(tmpDirectory)
+    archive.append(0, 0, 0, 0)
+    for i in range(1, readings + 1):
+        archive.append(i, START_TIME + i * READING_INTERVAL, 24.0 + (i % 100) / 100.0, 60.0 - (i % 100) / 10.0)
+    archive.close()
+    os.replace(tmpDirectory, archiveDirectory)
+    return archiveDirectory
+
+"""Return a fresh directory for a stage run, emptied of any previous run.
+
+    Arguments:
+    workDir -- the working directory
+    name -- name of the directory
+"""
+def scratchDirectory(workDir, name):
+    directory = os.path.join(workDir, "scratch", name)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    return directory
+
+"""Run ProbeLogger's logging routine on the stand-ins for a number of ticks.
+
+    Returns the measurements of the cadence stage.
+
+    Arguments:
+    workDir -- the working directory
+    ticks -- sampling ticks to run
+    factor -- speed of the accelerated clock
+    failureRate -- probability that a sensor read attempt fails
+"""
+def measureCadence(workDir, ticks, factor, failureRate):
+    directory = scratchDirectory(workDir, "cadence")
+    os.chdir(directory) # ProbeLogger.log is opened in the working directory
+    clock = MicroclimateStandIns.AcceleratedClock(factor)
+    dhts = [MicroclimateStandIns.SimulatedDHT(clock, failureRate, seed=seed) for seed in (1, 2)]
+    server = sqlServer(workDir)
+    server.createProbeTable("cadence", "probe")
+    server.createProbeTable("cadence", "probe_extra")
+    MicroclimateStandIns.installStandIns(dhts[0], server, clock)
+    # each pin reads its own simulated sensor
+    sys.modules["Adafruit_DHT"].read_retry = lambda sensor, pin, **kwargs: dhts[pin].read_retry(sensor, pin, **kwargs)
+    sys.path.insert(0, PI_DIR)
+    ProbeLogger = quiet(loadScript("microclimateMonitors/pi/ProbeLogger.py"))
+    writeStatus = ProbeLogger.ProbeStatus.writeStatus
+    ProbeLogger.ProbeStatus.writeStatus = lambda status: writeStatus(status, os.path.join(directory, "ProbeLogger.status"))
+
+    sensors = []
+    for pin, table in enumerate(["probe", "probe_extra"]):
+        archive = ProbeLogger.ProbeArchive.ProbeArchive(os.path.join(directory, "ProbeArchive_" + table))
+        archive.append(0, 0, 0, 0)
+        dbWriter = ProbeLogger.DBWriter(archive.directory, "localhost", "pi", "", "cadence", table,
+                                        stateFilepath=os.path.join(directory, "ProbeResync_" + table + ".state"))
+        dbWriter.start()
+        liveFeed = ProbeLogger.LiveFeed(None)
+        rollups = ProbeLogger.ProbeRollups.Rollups(os.path.join(directory, "ProbeRollups_" + table))
+        sensors.append(ProbeLogger.Sensor(table, pin, archive, liveFeed, dbWriter, rollups))
+
+    started = time.time()
+    wallStart = time.perf_counter()
+    cpuStart = time.process_time()
+    try:
+        # the first read starts at once, the last one at (ticks - 1) * interval
+        asyncio.run(asyncio.wait_for(ProbeLogger._loggerRoutine(sensors, SAMPLE_INTERVAL, started, None),
+                                     (ticks - 0.5) * SAMPLE_INTERVAL))
+    except asyncio.TimeoutError:
+        pass
+    cpu = time.process_time() - cpuStart
+    wall = time.perf_counter() - wallStart
+    for sensor in sensors:
+        sensor.close()
+    clock.uninstall()
+
+    lateness = []
+    for dht in dhts:
+        for k in range(0, len(dht.readTimes)):
+            lateness.append(dht.readTimes[k] - (dht.readTimes[0] + k * SAMPLE_INTERVAL))
+    lateness.sort()
+    archived = sum(map(lambda x: x.archive.latest()[0], sensors))
+    return {
+        "wall": wall,
+        "cpu": cpu,
+        "factor": factor,
+        "ticks": ticks,
+        "reads": sum(map(lambda x: len(x.readTimes), dhts)),
+        "archived": archived,
+        "failures": sum(map(lambda x: x.failures, sensors)),
+        "overruns": sum(map(lambda x: x.overruns, sensors)),
+        "dbRows": sum(map(lambda x: x.dbWriter.latestID or 0, sensors)),
+        "meanJitter": statistics.mean(lateness),
+        "p99Jitter": lateness[int(0.99 * (len(lateness) - 1))],
+        "maxJitter": lateness[-1]
+    }
+
+"""Sync a probe database backlog into a new local table.
+
+    Returns the measurements of the sync stage.
+
+    Arguments:
+    workDir -- the working directory
+    rows -- number of readings in the backlog
+    columnar -- sync to a columnar archive instead of a text table
+    bundles -- fetch bundles of a local archive from the Pi's HTTP server
+               instead of querying the database
+"""
+def measureSync(workDir, rows, columnar, bundles=False):
+    db = prepareDatabase(workDir, rows)
+    MicroclimateStandIns.installStandIns(server=sqlServer(workDir))
+    bundleServer = None
+    if bundles:
+        bundleServer = MicroclimateStandIns.bundleServer(prepareArchive(workDir, rows), "probe")
+    # SyncProbeDBs loads ../../../pipeline/Common.py (the server's paths) and
+    # reads its auth file from the working directory
+    fixture = scratchDirectory(workDir, "sync")
+    directory = os.path.join(fixture, "server", "microclimate", "sync")
+    os.makedirs(directory)
+    os.makedirs(os.path.join(fixture, "pipeline"))
+    with open(os.path.join(fixture, "pipeline", "Common.py"), 'w') as f:
+        f.write("microclimateArchivePath = " + repr(directory) + "\n")
+    os.chdir(directory)
+    with open(os.path.join(directory, "ProbeDB_auth.conf"), 'w') as f:
+        f.write("probeName = backlog\nunitNumber = 1\nhost = 127.0.0.1\nuser = pi\npasswd = pi\ndb = " + db + "\ntable = probe\n")
+    sys.path.insert(0, LOCAL_DIR)
+    SyncProbeDBs = quiet(loadScript("microclimateMonitors/local/SyncProbeDBs.py"))
+    registry = SyncProbeDBs.ProbeRegistry(bundlePort=None if bundleServer is None else bundleServer.port)
+
+    wallStart = time.perf_counter()
+    cpuStart = time.process_time()
+    synced = SyncProbeDBs.update("backlog", directory, columnar, registry)
+    cpu = time.process_time() - cpuStart
+    wall = time.perf_counter() - wallStart
+    registry.close()
+    if bundleServer is not None:
+        bundleServer.stop()
+
+    tablePath = SyncProbeDBs.localTablePath("backlog", directory, registry)
+    return {
+        "wall": wall,
+        "cpu": cpu,
+        "rows": synced,
+        "bytesOut": SyncProbeDBs._storedBytes(tablePath, columnar),
+        "rowsPerSec": synced / wall
+    }
+
+"""Open a copy of a local archive and restore the live window and rollups
+from it, as ProbeLogger does at startup, optionally after a simulated power
+cut.
+
+    Returns the measurements of the startup or recovery stage.
+
+    Arguments:
+    workDir -- the working directory
+    readings -- number of readings in the archive
+    powerCut -- damage the copy as a power cut would before opening it
+"""
+def measureStartup(workDir, readings, powerCut):
+    source = prepareArchive(workDir, readings)
+    directory = scratchDirectory(workDir, "startup")
+    archiveDirectory = os.path.join(directory, "ProbeArchive")
+    shutil.copytree(source, archiveDirectory)
+    os.chdir(directory)
+    sys.path.insert(0, PI_DIR)
+    MicroclimateStandIns.installStandIns(MicroclimateStandIns.SimulatedDHT(), sqlServer(workDir))
+    ProbeLogger = quiet(loadScript("microclimateMonitors/pi/ProbeLogger.py"))
+    ProbeArchive = ProbeLogger.ProbeArchive
+    segments = ProbeArchive.ProbeArchive(archiveDirectory, readOnly=True)._listSegments()
+    if powerCut:
+        with open(segments[-1][1], 'ab') as f:
+            torn = (readings + 1, START_TIME + (readings + 1) * READING_INTERVAL, 24.5, 60.5)
+            f.write(ProbeArchive.packFrame(torn)[:ProbeArchive.FRAME_SIZE // 2])
+            f.write(b"\0" * 512)
+        if len(segments) > 1:
+            firstID, path, compressed = segments[-2]
+            with open(path[:-len(".gz")], 'wb') as f:
+                f.write(gzip.decompress(open(path, 'rb').read()))
+            os.remove(path)
+
+    wallStart = time.perf_counter()
+    cpuStart = time.process_time()
+    archive = ProbeArchive.ProbeArchive(archiveDirectory)
+    latest = archive.latest()
+    opened = time.perf_counter() - wallStart
+    liveFeed = ProbeLogger.LiveFeed(None)
+    liveFeed.load(archive.tail(ProbeLogger.LIVE_WINDOW))
+    replayed = ProbeLogger.ProbeRollups.Rollups(os.path.join(directory, "ProbeRollups")).replay(archive)
+    cpu = time.process_time() - cpuStart
+    wall = time.perf_counter() - wallStart
+    archive.close()
+
+    if latest[0] != readings:
+        raise RuntimeError("latest reading " + str(latest[0]) + " after opening, expected " + str(readings))
+    return {
+        "wall": wall,
+        "cpu": cpu,
+        "open": opened,
+        "rows": readings,
+        "segments": len(segments),
+        "bytesIn": sum(map(lambda x: os.path.getsize(x[1]), segments)),
+        "replayed": replayed
+    }
+
+"""Run a single stage in this process and return its measurements.
+
+    Called in a child interpreter by runStage(); peak RSS is that of the child.
+
+    Arguments:
+    stage -- name of the stage, one of STAGES
+    size -- rows of the sync stages, readings of the startup and recovery
+            stages, or ticks of the cadence stage
+    workDir -- the working directory
+    factor -- speed of the accelerated clock of the cadence stage
+    failureRate -- sensor read failure rate of the cadence stage
+"""
+def measureStage(stage, size, workDir, factor, failureRate):
+    if stage == "cadence":
+        result = measureCadence(workDir, size, factor, failureRate)
+    elif stage == "sync":
+        result = measureSync(workDir, size, False)
+    elif stage == "syncColumnar":
+        result = measureSync(workDir, size, True)
+    elif stage == "syncBundle":
+        result = measureSync(workDir, size, False, True)
+    elif stage == "startup":
+        result = measureStartup(workDir, size, False)
+    elif stage == "recovery":
+        result = measureStartup(workDir, size, True)
+    else:
+        raise ValueError("Unknown stage: " + stage)
+    peakRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peakRss = peakRss // 1024 # reported in bytes rather than kB
+    result["stage"] = stage
+    result["size"] = size
+    result["peakRssKB"] = peakRss
+    return result
+
+"""Run a stage in a fresh interpreter and return its measurements.
+
+    Arguments:
+    stage -- name of the stage, one of STAGES
+    size -- size of the stage (see measureStage)
+    args -- parsed command-line arguments
+"""
+def runStage(stage, size, args):
+    commandList = [sys.executable, os.path.abspath(__file__), "--worker", stage, "--size", str(size),
+                   "--workdir", os.path.abspath(args.workdir), "--clock-factor", str(args.clock_factor),
+                   "--failure-rate", str(args.failure_rate)]
+    output = subprocess.check_output(commandList)
+    return json.loads(output.decode().strip().split("\n")[-1])
+
+"""Return the sizes a stage runs at, for a preset.
+
+    Arguments:
+    stage -- name of the stage, one of STAGES
+    preset -- the preset (see PRESETS)
+"""
+def stageSizes(stage, preset):
+    if stage == "cadence":
+        return [preset["ticks"]]
+    if stage in ("sync", "syncColumnar", "syncBundle"):
+        return preset["rows"]
+    return preset["readings"]
+
+"""Return a one-line description of a stage run.
+
+    Arguments:
+    result -- measurements of the run
+"""
+def describeRun(result):
+    text = "%.3f" % result["wall"] + " s, "
+    if result["stage"] == "cadence":
+        text += (str(result["archived"]) + " readings, jitter mean " + "%.3f" % result["meanJitter"] + " s, p99 "
+                 + "%.3f" % result["p99Jitter"] + " s, max " + "%.3f" % result["maxJitter"] + " s, "
+                 + str(result["overruns"]) + " overruns")
+    elif "rowsPerSec" in result:
+        text += "%.0f" % result["rowsPerSec"] + " rows/s"
+    else:
+        text += "open " + "%.3f" % result["open"] + " s, " + str(result["segments"]) + " segments"
+    return text + ", " + str(result["peakRssKB"]) + " kB peak RSS"
+
+"""Return the current git commit of the repository, or None if unavailable."""
+def gitCommit():
+    try:
+        output = subprocess.check_output(["git","rev-parse","HEAD"], cwd=REPO_DIR, stderr=subprocess.DEVNULL)
+        return output.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+"""Print a per-stage comparison of the median wall times of two result files.
+
+    Arguments:
+    baselineFilename -- results of the reference run
+    candidateFilename -- results of the run to compare against the reference
+"""
+def compareResults(baselineFilename, candidateFilename):
+    baseline = json.load(open(baselineFilename))
+    candidate = json.load(open(candidateFilename))
+    if baseline["config"] != candidate["config"]:
+        print("WARNING: the two runs used different configurations")
+    print("stage\tbaseline_s\tcandidate_s\tratio\tbaseline_rss_kB\tcandidate_rss_kB")
+    for key in sorted(baseline["summary"].keys()):
+        if key not in candidate["summary"]:
+            continue
+        b = baseline["summary"][key]
+        c = candidate["summary"][key]
+        ratio = c["medianWall"] / b["medianWall"]
+        print(key + "\t" + "%.3f" % b["medianWall"] + "\t" + "%.3f" % c["medianWall"] + "\t" + "%.2f" % ratio
+              + "\t" + str(b["peakRssKB"]) + "\t" + str(c["peakRssKB"]))
+
+"""Executable"""
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark the microclimate scripts on stand-ins for the sensors and databases.")
+    parser.add_argument("--preset", choices=sorted(PRESETS.keys()), default="small")
+    parser.add_argument("--stages", default=",".join(STAGES), help="comma-separated stages to run")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--clock-factor", type=float, default=100, help="simulated seconds per second in the cadence stage")
+    parser.add_argument("--failure-rate", type=float, default=0.1, help="sensor read failure rate in the cadence stage")
+    parser.add_argument("--workdir", default=os.path.join(BENCHMARK_DIR, "data", "microclimate"))
+    parser.add_argument("--output", help="JSON file to write the results to")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE","CANDIDATE"))
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        print(json.dumps(measureStage(args.worker, args.size, args.workdir, args.clock_factor, args.failure_rate)))
+        sys.exit(0)
+
+    if args.compare is not None:
+        compareResults(args.compare[0], args.compare[1])
+        sys.exit(0)
+
+    preset = PRESETS[args.preset]
+    stages = args.stages.split(",")
+    for stage in stages:
+        for size in stageSizes(stage, preset):
+            if stage in ("sync", "syncColumnar", "syncBundle"):
+                prepareDatabase(args.workdir, size)
+            if stage in ("syncBundle", "startup", "recovery"):
+                prepareArchive(args.workdir, size)
+
+    runs = []
+    summary = {}
+    for stage in stages:
+        for size in stageSizes(stage, preset):
+            stageRuns = []
+            for i in range(0, args.repeat):
+                result = runStage(stage, size, args)
+                result["repeat"] = i
+                stageRuns.append(result)
+                print(stage + " " + str(size) + " #" + str(i) + ": " + describeRun(result))
+            runs.extend(stageRuns)
+            summary[stage + "_" + str(size)] = {
+                "medianWall": statistics.median(map(lambda x: x["wall"], stageRuns)),
+                "peakRssKB": max(map(lambda x: x["peakRssKB"], stageRuns))
+            }
+            if "rowsPerSec" in result:
+                summary[stage + "_" + str(size)]["medianRowsPerSec"] = statistics.median(map(lambda x: x["rowsPerSec"], stageRuns))
+            if stage == "cadence":
+                summary[stage + "_" + str(size)]["medianP99Jitter"] = statistics.median(map(lambda x: x["p99Jitter"], stageRuns))
+            elif stage in ("startup", "recovery"):
+                summary[stage + "_" + str(size)]["medianOpen"] = statistics.median(map(lambda x: x["open"], stageRuns))
+
+    results = {
+        "commit": gitCommit(),
+        "date": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {"preset": preset, "clockFactor": args.clock_factor, "failureRate": args.failure_rate},
+        "runs": runs,
+        "summary": summary
+    }
+    outputFilename = args.output
+    if outputFilename is None:
+        outputFilename = os.path.join(BENCHMARK_DIR, "results_" + str(results["commit"])[:10] + ".json")
+    json.dump(results, open(outputFilename, 'w'), indent=1)
+    print("Results written to " + outputFilename)
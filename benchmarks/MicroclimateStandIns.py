@@ -0,0 +1,357 @@
+"""Offline stand-ins for the hardware and services the microclimate scripts use.
+
+With these, ProbeLogger.py and SyncProbeDBs.py run on any machine, without a Pi,
+a DHT22 sensor or a MySQL server:
+
+SimulatedDHT -- an Adafruit_DHT module whose readings fail at a given rate and
+                take a given time
+SQLServer -- databases as sqlite files in a directory, behind the parts of the
+             MySQLdb and pymysql interfaces the scripts use (connect, cursors,
+             execute/executemany/fetch*, commit, ping), with the MySQL
+             "%s" placeholders and INSERT IGNORE translated for sqlite; hosts
+             can be marked down
+AcceleratedClock -- time.time/monotonic/sleep and an asyncio event loop running
+                    factor times faster than real time, so hours of sampling
+                    take seconds
+bundleServer() -- a Pi's HTTP server (ProbeServer.py) on localhost, serving the
+                  bundles of a local archive to SyncProbeDBs.py
+
+installStandIns() puts the modules in sys.modules, so they must be installed
+before the scripts are imported:
+
+    clock = AcceleratedClock(100)
+    dht = SimulatedDHT(clock, failureRate=0.1)
+    server = SQLServer("/tmp/sql")
+    installStandIns(dht, server, clock)
+    import ProbeLogger
+"""
+
+"""Dependencies"""
+import asyncio
+import importlib.util
+import math
+import os
+import random
+import selectors
+import sqlite3
+import sys
+import threading
+import time
+import types
+
+PI_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "microclimateMonitors", "pi")
+
+_realTime = time.time
+_realMonotonic = time.monotonic
+_realSleep = time.sleep
+
+"""A clock running factor times faster than real time, from a given start.
+
+    Arguments:
+    factor -- simulated seconds per real second
+    start -- simulated UNIX time at creation; defaults to now
+"""
+class AcceleratedClock(object):
+
+    def __init__(self, factor, start=None):
+        self.factor = float(factor)
+        self._realStart = _realMonotonic()
+        self._start = _realTime() if start is None else start
+
+    def monotonic(self):
+        return (_realMonotonic() - self._realStart) * self.factor
+
+    def time(self):
+        return self._start + self.monotonic()
+
+    def sleep(self, seconds):
+        _realSleep(seconds / self.factor)
+
+    """Return an asyncio event loop running on this clock."""
+    def newEventLoop(self):
+        selector = _ScaledSelector()
+        selector.factor = self.factor
+        loop = asyncio.SelectorEventLoop(selector)
+        loop.time = self.monotonic
+        return loop
+
+    """Replace time.time, time.monotonic, time.sleep and the asyncio event loop
+    with this clock's, until uninstall()."""
+    def install(self):
+        time.time = self.time
+        time.monotonic = self.monotonic
+        time.sleep = self.sleep
+        clock = self
+        class AcceleratedPolicy(asyncio.DefaultEventLoopPolicy):
+            def new_event_loop(self):
+                return clock.newEventLoop()
+        asyncio.set_event_loop_policy(AcceleratedPolicy())
+
+    def uninstall(self):
+        time.time = _realTime
+        time.monotonic = _realMonotonic
+        time.sleep = _realSleep
+        asyncio.set_event_loop_policy(None)
+
+# The event loop computes how long to wait for its next timer in simulated
+# seconds; the selector waits that long divided by the clock factor.
+class _ScaledSelector(selectors.DefaultSelector):
+
+    def select(self, timeout=None):
+        if timeout is not None:
+            timeout = timeout / self.factor
+        return super().select(timeout)
+
+"""A simulated DHT22 sensor, as the Adafruit_DHT module.
+
+    Readings follow a slow daily cycle plus noise. Each attempt takes latency
+    seconds (on the clock, if given) and fails with probability failureRate.
+    The time of the first attempt of every read_retry() call is recorded in
+    readTimes, to measure the sampling cadence.
+
+    Arguments:
+    clock -- an AcceleratedClock, or None for real time
+    failureRate -- probability that an attempt returns (None, None)
+    latency -- seconds per attempt
+    seed -- random seed
+"""
+class SimulatedDHT(object):
+
+    DHT22 = 22
+
+    def __init__(self, clock=None, failureRate=0.0, latency=0.5, seed=0):
+        self.clock = clock
+        self.failureRate = failureRate
+        self.latency = latency
+        self.readTimes = []
+        self.attempts = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _now(self):
+        return _realTime() if self.clock is None else self.clock.time()
+
+    def _sleep(self, seconds):
+        if self.clock is None:
+            _realSleep(seconds)
+        else:
+            self.clock.sleep(seconds)
+
+    def read(self, sensor, pin):
+        self._sleep(self.latency)
+        with self._lock:
+            self.attempts += 1
+            if self._random.random() < self.failureRate:
+                return (None, None)
+            noise = self._random.gauss(0, 0.2)
+        phase = 2 * math.pi * (self._now() % 86400) / 86400
+        temperature = 24 + 4 * math.sin(phase) + noise
+        humidity = 60 - 15 * math.sin(phase) + 5 * noise
+        return (humidity, temperature)
+
+    def read_retry(self, sensor, pin, retries=15, delay_seconds=2):
+        self.readTimes.append(self._now())
+        for i in range(0, retries):
+            humidity, temperature = self.read(sensor, pin)
+            if humidity is not None and temperature is not None:
+                return (humidity, temperature)
+            self._sleep(delay_seconds)
+        return (None, None)
+
+    """Return this sensor as an Adafruit_DHT module."""
+    def module(self):
+        module = types.ModuleType("Adafruit_DHT")
+        module.DHT22 = self.DHT22
+        module.read = self.read
+        module.read_retry = self.read_retry
+        return module
+
+class SQLError(Exception):
+    pass
+
+"""MySQL databases stood in for by sqlite files, one per database name.
+
+    Arguments:
+    directory -- directory of the sqlite files; created if needed
+    downHosts -- hosts whose connections fail, as if unreachable
+"""
+class SQLServer(object):
+
+    def __init__(self, directory, downHosts=()):
+        self.directory = directory
+        self.downHosts = set(downHosts)
+        self.connections = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def databasePath(self, db):
+        return os.path.join(self.directory, db + ".sqlite")
+
+    def connect(self, host, user, passwd, db):
+        if host in self.downHosts:
+            raise SQLError("Can't connect to MySQL server on '" + host + "'")
+        self.connections += 1
+        return SQLConnection(sqlite3.connect(self.databasePath(db), check_same_thread=False))
+
+    """Create a probe table (ID, Time, Temperature, Humidity) holding the null
+    entry, replacing any previous one.
+
+        Arguments:
+        db -- database name
+        table -- table name
+    """
+    def createProbeTable(self, db, table):
+        connection = sqlite3.connect(self.databasePath(db))
+        connection.execute("DROP TABLE IF EXISTS " + table)
+        connection.execute("CREATE TABLE " + table + " (ID INTEGER PRIMARY KEY, Time INTEGER, Temperature REAL, Humidity REAL)")
+        connection.execute("INSERT INTO " + table + " VALUES (0, 0, 0, 0)")
+        connection.commit()
+        connection.close()
+
+    """Append synthetic readings to a probe table, every interval seconds.
+
+        Arguments:
+        db -- database name
+        table -- table name
+        count -- number of readings
+        start -- timestamp of the first reading
+        interval -- seconds between readings
+        firstID -- ID of the first reading
+    """
+    def fillProbeTable(self, db, table, count, start, interval=30, firstID=1):
+        connection = sqlite3.connect(self.databasePath(db))
+        chunk = 100000
+        for offset in range(0, count, chunk):
+            rows = ((firstID + i, start + i * interval, round(24 + 4 * math.sin(i / 2880.0), 2), round(60 - 15 * math.sin(i / 2880.0), 2))
+                    for i in range(offset, min(offset + chunk, count)))
+            connection.executemany("INSERT INTO " + table + " VALUES (?, ?, ?, ?)", rows)
+            connection.commit()
+        connection.close()
+
+def _translate(query):
+    return query.replace("%s", "?").replace("INSERT IGNORE", "INSERT OR IGNORE")
+
+class SQLConnection(object):
+
+    def __init__(self, connection):
+        self._connection = connection
+        self.open = True
+
+    def cursor(self, cursorclass=None):
+        if not self.open:
+            raise SQLError("connection closed")
+        return SQLCursor(self._connection.cursor())
+
+    def commit(self):
+        self._connection.commit()
+
+    def ping(self, reconnect=False):
+        if not self.open:
+            raise SQLError("connection closed")
+
+    def close(self):
+        if self.open:
+            self._connection.close()
+            self.open = False
+
+class SQLCursor(object):
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, query, args=()):
+        try:
+            self._cursor.execute(_translate(query), args)
+        except sqlite3.Error as e:
+            raise SQLError(str(e))
+        return self._cursor.rowcount
+
+    def executemany(self, query, args):
+        try:
+            self._cursor.executemany(_translate(query), args)
+        except sqlite3.Error as e:
+            raise SQLError(str(e))
+        return self._cursor.rowcount
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchmany(self, size=1):
+        return self._cursor.fetchmany(size)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def close(self):
+        self._cursor.close()
+
+"""Return a MySQLdb module connecting to a SQLServer.
+
+    Arguments:
+    server -- the SQLServer
+"""
+def mysqldbModule(server):
+    module = types.ModuleType("MySQLdb")
+    module.Error = SQLError
+    module.OperationalError = SQLError
+    module.connect = lambda host, user, passwd, db, **kwargs: server.connect(host, user, passwd, db)
+    return module
+
+"""Return a pymysql module (and its cursors submodule) connecting to a
+SQLServer.
+
+    Arguments:
+    server -- the SQLServer
+"""
+def pymysqlModules(server):
+    module = types.ModuleType("pymysql")
+    cursors = types.ModuleType("pymysql.cursors")
+    cursors.Cursor = SQLCursor
+    cursors.SSCursor = SQLCursor
+    module.cursors = cursors
+    module.Error = SQLError
+    module.OperationalError = SQLError
+    module.connect = lambda host, user, passwd, db, **kwargs: server.connect(host, user, passwd, db)
+    return (module, cursors)
+
+"""Start a Pi's HTTP server (see ProbeServer.py) on localhost, serving the
+bundles of a local archive as those of a MySQL table, and return it. Its port is
+server.port; stop it with server.stop().
+
+    Arguments:
+    archiveDirectory -- the local archive (see ProbeArchive.py)
+    table -- MySQL table the archive stands for
+    port -- port to listen on; any free port by default
+"""
+def bundleServer(archiveDirectory, table, port=0):
+    if PI_DIR not in sys.path:
+        sys.path.append(PI_DIR) # for ProbeServer's own imports
+    spec = importlib.util.spec_from_file_location("ProbeServer", os.path.join(PI_DIR, "ProbeServer.py"))
+    ProbeServer = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(ProbeServer)
+    sensor = types.SimpleNamespace(name=table, liveFeed=None, rollups=None,
+                                   archive=types.SimpleNamespace(directory=archiveDirectory),
+                                   dbWriter=types.SimpleNamespace(table=table))
+    server = ProbeServer.ProbeServer([sensor], port, "127.0.0.1")
+    server.port = server._httpd.server_address[1]
+    server.start()
+    return server
+
+"""Install the stand-ins: the Adafruit_DHT, MySQLdb and pymysql modules in
+sys.modules, and the clock.
+
+    Arguments:
+    dht -- a SimulatedDHT, or None
+    server -- a SQLServer, or None
+    clock -- an AcceleratedClock, or None
+"""
+def installStandIns(dht=None, server=None, clock=None):
+    if dht is not None:
+        sys.modules["Adafruit_DHT"] = dht.module()
+    if server is not None:
+        sys.modules["MySQLdb"] = mysqldbModule(server)
+        sys.modules["pymysql"], sys.modules["pymysql.cursors"] = pymysqlModules(server)
+    if clock is not None:
+        clock.install()
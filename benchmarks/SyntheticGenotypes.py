@@ -0,0 +1,238 @@
+"""Generate deterministic synthetic genotype files for benchmarking.
+
+The HapMaps written here follow the layout of the files TASSEL exports for the
+pipeline (11 metadata columns followed by one single-character call per taxon),
+so every genotype script can be run against them unchanged. Output depends only
+on the configuration and the seed.
+
+Calls are coded as in the real data:
+A,C,T,G -- homozygous
+N -- missing
+other IUPAC letters -- heterozygous
++ / - -- homozygous insertion / deletion
+0 -- heterozygous indel
+
+To keep generation of production-scale files (500K sites x 1000 taxa) fast, a
+pool of call templates is drawn once and each site takes a template, rotates it
+by a random number of taxa and translates it to its own alleles.
+"""
+
+"""Dependencies"""
+import argparse
+import json
+import random
+
+HAPMAP_META_HEADER = ["rs#","alleles","chrom","pos","strand","assembly#","center","protLSID","assayLSID","panelLSID","QCcode"]
+IUPAC_HETS = {"AC":"M", "AG":"R", "AT":"W", "CG":"S", "CT":"Y", "GT":"K"}
+TEMPLATE_POOL_SIZE = 257
+
+"""Return the default generator configuration.
+
+    Arguments:
+    sites -- number of sites (rows)
+    taxa -- number of taxa (genotype columns)
+"""
+def defaultConfig(sites=10000, taxa=100):
+    return {
+        "sites": sites,
+        "taxa": taxa,
+        "missingRate": 0.05,     # fraction of N calls
+        "hetRate": 0.02,         # fraction of heterozygous calls
+        "indelRate": 0.01,       # fraction of sites that are indels (+/-)
+        "chromosomes": 10,
+        "chromosomeLength": 300000000,
+        "chromFormat": "%02d",   # e.g. "01", or "chr%d"
+        "poundHeader": True,     # TASSEL-style "rs#" and "assembly#" header fields
+        "seed": 1
+    }
+
+"""Return the list of synthetic taxa names.
+
+    Names mimic the mix found in the real panel: most are plain alphanumeric,
+    some begin with a digit, and a few contain characters that R rewrites.
+
+    Arguments:
+    n -- number of taxa
+"""
+def buildTaxaNames(n):
+    names = []
+    specials = ["LH143_(MAINTAINER)", "NY_159_(NEVEH_YAAR)"]
+    for i in range(0, n):
+        if i < len(specials):
+            names.append(specials[i])
+        elif i % 7 == 0:
+            names.append(str(1000 + i) + "_MLC")
+        else:
+            names.append("MLC_" + str(i).zfill(4))
+    return names
+
+"""Return the pool of call templates.
+
+    Each template is a string of per-taxon codes, each followed by a tab:
+    "0" homozygous first allele, "2" homozygous second allele, "1" heterozygous,
+    "N" missing.
+
+    Arguments:
+    config -- generator configuration
+    rng -- the random.Random instance to draw from
+"""
+def _buildTemplates(config, rng):
+    templates = []
+    missingRate = config["missingRate"]
+    hetRate = config["hetRate"]
+    for k in range(0, TEMPLATE_POOL_SIZE):
+        maf = rng.uniform(0.01, 0.5)
+        pMissing = missingRate
+        pHet = hetRate
+        pAlt = (1.0 - pMissing - pHet) * maf
+        cumWeights = [pMissing, pMissing + pHet, pMissing + pHet + pAlt, 1.0]
+        codes = rng.choices(["N","1","2","0"], cum_weights=cumWeights, k=config["taxa"])
+        templates.append("\t".join(codes) + "\t")
+    return templates
+
+"""Return a str.translate table mapping template codes to the calls of a site.
+
+    Arguments:
+    first -- first allele (a nucleotide, or "+" for indels)
+    second -- second allele (a nucleotide, or "-" for indels)
+"""
+def _buildCallTable(first, second):
+    if first == "+":
+        het = "0"
+    else:
+        het = IUPAC_HETS["".join(sorted(first + second))]
+    return str.maketrans({"0":first, "2":second, "1":het})
+
+"""Yield the synthetic HapMap lines (header first), each ending with a newline.
+
+    Arguments:
+    config -- generator configuration, see defaultConfig()
+"""
+def iterHapMapLines(config):
+    rng = random.Random(config["seed"])
+    taxa = buildTaxaNames(config["taxa"])
+    metaHeader = HAPMAP_META_HEADER
+    if not config["poundHeader"]:
+        metaHeader = list(map(lambda x: x.replace("#",""), metaHeader))
+    yield "\t".join(metaHeader + taxa) + "\n"
+
+    templates = _buildTemplates(config, rng)
+    nucleotides = ["A","C","G","T"]
+    callTables = {}
+    for first in nucleotides:
+        for second in nucleotides:
+            if first != second:
+                callTables[first + "/" + second] = _buildCallTable(first, second)
+    callTables["+/-"] = _buildCallTable("+", "-")
+    snpAlleles = sorted(k for k in callTables.keys() if k != "+/-")
+
+    nTaxa = config["taxa"]
+    nChrom = config["chromosomes"]
+    sitesLeft = config["sites"]
+    for c in range(1, nChrom + 1):
+        nSites = sitesLeft // (nChrom - c + 1)
+        sitesLeft -= nSites
+        if nSites == 0:
+            continue
+        chrom = config["chromFormat"] % c
+        step = max(1, config["chromosomeLength"] // nSites)
+        for i in range(0, nSites):
+            pos = i * step + rng.randrange(0, step) + 1
+            if rng.random() < config["indelRate"]:
+                alleles = "+/-"
+            else:
+                alleles = snpAlleles[rng.randrange(0, len(snpAlleles))]
+            template = templates[rng.randrange(0, TEMPLATE_POOL_SIZE)]
+            shift = 2 * rng.randrange(0, nTaxa)
+            calls = (template[shift:] + template[:shift]).translate(callTables[alleles])
+            name = "S" + str(c).zfill(2) + "_" + str(pos)
+            yield (name + "\t" + alleles + "\t" + chrom + "\t" + str(pos)
+                   + "\t+\tNA\tNA\tNA\tNA\tNA\tNA\t" + calls[:-1] + "\n")
+
+"""Write a synthetic HapMap file and return the number of bytes written.
+
+    Arguments:
+    config -- generator configuration, see defaultConfig()
+    filename -- the HapMap file to write
+"""
+def writeHapMap(config, filename):
+    nBytes = 0
+    out = open(filename, 'w')
+    for line in iterHapMapLines(config):
+        out.write(line)
+        nBytes += len(line)
+    out.close()
+    return nBytes
+
+"""Write the synthetic HapMap split into a one-line header file and a table
+without header, as consumed by the BuildBaseHapMap stitching step.
+
+    Arguments:
+    config -- generator configuration, see defaultConfig()
+    headerFilename -- file to write the header line to
+    noHeaderFilename -- file to write the remaining rows to
+"""
+def writeSplitHapMap(config, headerFilename, noHeaderFilename):
+    lines = iterHapMapLines(config)
+    with open(headerFilename, 'w') as out:
+        out.write(next(lines))
+    with open(noHeaderFilename, 'w') as out:
+        for line in lines:
+            out.write(line)
+
+"""Write a synthetic list of site names (one per line), as written by plink.
+
+    Every site is kept with probability keepFraction, drawn with its own seed so
+    the list is reproducible.
+
+    Arguments:
+    config -- generator configuration, see defaultConfig()
+    filename -- the file to write the site names to
+    keepFraction -- fraction of the sites to list
+"""
+def writeSiteList(config, filename, keepFraction=0.1):
+    rng = random.Random(config["seed"] + 1)
+    lines = iterHapMapLines(config)
+    next(lines)
+    out = open(filename, 'w')
+    for line in lines:
+        if rng.random() < keepFraction:
+            out.write(line[:line.find("\t")] + "\n")
+    out.close()
+
+"""Write a synthetic kinship matrix with genotype names mangled the way R does
+when reading them as a header, for PatchTaxaNames.patchFile().
+
+    Arguments:
+    config -- generator configuration, see defaultConfig()
+    filename -- the file to write the matrix to
+"""
+def writeKinshipMatrix(config, filename):
+    rng = random.Random(config["seed"] + 2)
+    taxa = buildTaxaNames(config["taxa"])
+    out = open(filename, 'w')
+    for taxon in taxa:
+        name = taxon.replace("(",".").replace(")",".")
+        if name[0].isdigit():
+            name = "X" + name
+        values = map(lambda x: "%.6f" % rng.random(), taxa)
+        out.write(name + "\t" + "\t".join(values) + "\n")
+    out.close()
+
+"""Executable"""
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Write a deterministic synthetic HapMap.")
+    parser.add_argument("output", help="HapMap file to write")
+    parser.add_argument("--sites", type=int, default=10000)
+    parser.add_argument("--taxa", type=int, default=100)
+    parser.add_argument("--config", help="JSON file overriding any generator settings")
+    args = parser.parse_args()
+
+    config = defaultConfig(args.sites, args.taxa)
+    if args.config is not None:
+        config.update(json.load(open(args.config)))
+    nBytes = writeHapMap(config, args.output)
+    print(args.output + ": " + str(config["sites"]) + " sites x " + str(config["taxa"]) + " taxa, " + str(nBytes) + " bytes")
+
+    print("Done!")
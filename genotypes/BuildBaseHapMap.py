@@ -5,7 +5,40 @@ Last Modified:  12/06/2016
 """
 
 """Dependencies"""
+import importlib.util
 import os
+spec = importlib.util.spec_from_file_location("Instrumentation", os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "Instrumentation.py"))
+Instrumentation = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(Instrumentation)
+
+"""Stitch a one-line HapMap header file onto a headerless HapMap table.
+
+    Arguments:
+    headerFilename -- file whose (last) line holds the tab-delimited header
+    noHeaderFilename -- the HapMap table without its header line
+    outputFilename -- the stitched HapMap file to write
+"""
+def stitchHapMap(headerFilename, noHeaderFilename, outputFilename):
+    with Instrumentation.stage("BuildBaseHapMap", output=outputFilename) as st:
+        header = []
+        for line in open(headerFilename):
+            header = line.strip().split("\t")
+            #print(line)
+            #header.append(line.strip())
+        out = open(outputFilename, 'w')
+        for i in range(0, len(header)-1):
+            colHeader = header[i]
+            #out.write(colHeader.replace(" ","_") + "\t")
+            out.write(colHeader + "\t")
+        out.write(header[-1] + "\n")
+        rows = 0
+        input = open(noHeaderFilename)
+        for line in input:
+            out.write(line)
+            rows += 1
+            
+        out.close()
+        st.count(rowsIn=rows, rowsOut=rows, bytesIn=os.path.getsize(headerFilename) + os.path.getsize(noHeaderFilename), bytesOut=os.path.getsize(outputFilename))
 
 """Executable"""
 if __name__ == "__main__":
@@ -15,42 +48,13 @@ if __name__ == "__main__":
     """Stitch together the header and data table into a single file for the imputed genotypes"""
     imputedInputTableNoHeaderFilename = "MLC_taxa_imputed_438K_genotypes_noHeader.csv"
     imputedInputTableHeaderFilename = "MLC_taxa_imputed_438K_genotypes_header.csv"
-    imputedInputTableHeader = []
-    for line in open(imputedInputTableHeaderFilename):
-        imputedInputTableHeader = line.strip().split("\t")
-        #print(line)
-        #imputedInputTableHeader.append(line.strip())
     imputedOutputTableFilename = "MLC_taxa_imputed_438K_genotypes.hmp.txt"
-    out = open(imputedOutputTableFilename, 'w')
-    for i in range(0, len(imputedInputTableHeader)-1):
-        colHeader = imputedInputTableHeader[i]
-        #out.write(colHeader.replace(" ","_") + "\t")
-        out.write(colHeader + "\t")
-    out.write(imputedInputTableHeader[-1] + "\n")
-    input = open(imputedInputTableNoHeaderFilename)
-    for line in input:
-        out.write(line)
-        
-    out.close()
+    stitchHapMap(imputedInputTableHeaderFilename, imputedInputTableNoHeaderFilename, imputedOutputTableFilename)
     
 #     """Stitch together the header and data table into a single file for the raw genotypes"""
 #     rawInputTableNoHeaderFilename = "MLC_taxa_raw_485K_genotypes_noHeader.csv"
 #     rawInputTableHeaderFilename = "MLC_taxa_raw_485K_genotypes_header.csv"
-#     rawInputTableHeader = []
-#     for line in open(rawInputTableHeaderFilename):
-#         rawInputTableHeader = line.strip().split("\t")
-#         #print(line)
-#         #rawInputTableHeader.append(line.strip())
 #     rawOutputTableFilename = "MLC_taxa_raw_485K_genotypes.hmp.txt"
-#     out = open(rawOutputTableFilename, 'w')
-#     for i in range(0, len(rawInputTableHeader)-1):
-#         colHeader = rawInputTableHeader[i]
-#         #out.write(colHeader.replace(" ","_") + "\t")
-#         out.write(colHeader + "\t")
-#     out.write(rawInputTableHeader[-1] + "\n")
-#     input = open(rawInputTableNoHeaderFilename)
-#     for line in input:
-#         out.write(line)
-#     out.close()
+#     stitchHapMap(rawInputTableHeaderFilename, rawInputTableNoHeaderFilename, rawOutputTableFilename)
     
     print("Done!")
\ No newline at end of file
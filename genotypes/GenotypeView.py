@@ -0,0 +1,322 @@
+"""Lazy filtered views over a base HapMap file.
+
+Instead of writing a full copy of the genotypes for every filtered stage (408K
+filtered, 46K LD-pruned, the per-phenotype subsets...), a view keeps only the
+filter definition and a mask of the selected sites. Reading through a view
+streams the selected rows, restricted to the selected taxa, straight from the
+base file; a HapMap is only written out when an external tool (TASSEL, GAPIT)
+needs one.
+
+A view is defined by any combination of:
+minMAF -- minimum minor allele frequency over the selected taxa
+minCallRate -- minimum fraction of non-missing calls over the selected taxa
+sites -- names of the sites to keep (e.g. the plink.prune.in list)
+taxa -- names of the taxa to keep, in base file order
+regions -- [chrom, start, end] ranges to keep; start/end may be None
+
+The mask (one byte per base site) is computed with a single pass over the base
+file the first time it is needed. For a saved view it is cached next to the
+view definition, and recomputed only if the base file or the filters change.
+
+Usage:
+    python GenotypeView.py create <base.hmp.txt> <name.view.json> [filters]
+    python GenotypeView.py info <name.view.json>
+    python GenotypeView.py write <name.view.json> <output.hmp.txt>
+    python GenotypeView.py vcf <name.view.json> <output.vcf>
+"""
+
+"""Dependencies"""
+import argparse
+import collections
+import hashlib
+import importlib.util
+import json
+import os
+spec = importlib.util.spec_from_file_location("HapMapReader", os.path.join(os.path.dirname(os.path.abspath(__file__)), "HapMapReader.py"))
+HapMapReader = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(HapMapReader)
+spec = importlib.util.spec_from_file_location("Instrumentation", os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "Instrumentation.py"))
+Instrumentation = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(Instrumentation)
+
+FILTER_KEYS = ["minMAF", "minCallRate", "sites", "taxa", "regions"]
+
+"""Return (minor allele frequency, call rate) for one site.
+
+    Calls equal to one of the two alleles count as homozygous, N as missing
+    and anything else as heterozygous (as in HapMap_VCF_Converter). Sites that
+    are not biallelic have a MAF of 0.
+
+    Arguments:
+    alleles -- the alleles column, e.g. "C/T"
+    calls -- the site's calls for the taxa of interest
+"""
+def siteStats(alleles, calls):
+    total = len(calls)
+    if total == 0:
+        return (0.0, 0.0)
+    counts = collections.Counter(calls)
+    called = total - counts["N"]
+    if len(alleles) != 3 or called == 0:
+        return (0.0, called / total)
+    homFirst = counts[alleles[0]]
+    homSecond = counts[alleles[2]]
+    het = called - homFirst - homSecond
+    first = 2 * homFirst + het
+    second = 2 * homSecond + het
+    return (min(first, second) / (first + second), called / total)
+
+"""Read a list of names, one per line, skipping empty lines.
+
+    Arguments:
+    filename -- the file to read
+"""
+def readNameList(filename):
+    names = []
+    for line in open(filename):
+        if not line.strip() == "":
+            names.append(line.strip())
+    return names
+
+"""A filtered view over a base HapMap file. See the module docstring.
+
+    Arguments:
+    baseFilename -- the HapMap the view reads from
+    filters -- any of minMAF, minCallRate, sites, taxa, regions
+"""
+class GenotypeView(object):
+
+    def __init__(self, baseFilename, **filters):
+        for key in filters.keys():
+            if key not in FILTER_KEYS:
+                raise ValueError("Unknown filter: " + key)
+        self.baseFilename = os.path.abspath(baseFilename)
+        self.filters = dict((key, value) for key, value in filters.items() if value is not None)
+        self.viewFilename = None
+        self._mask = None
+        metaHeader, baseTaxa = HapMapReader.readHeader(self.baseFilename)
+        self.metaHeader = metaHeader
+        self.baseTaxa = baseTaxa
+        if "taxa" in self.filters:
+            keep = set(self.filters["taxa"])
+            self.taxaColumns = [i for i in range(0, len(baseTaxa)) if baseTaxa[i] in keep]
+        else:
+            self.taxaColumns = list(range(0, len(baseTaxa)))
+        self.taxa = list(map(lambda x: baseTaxa[x], self.taxaColumns))
+        self._pickTaxa = HapMapReader.columnPicker(self.taxaColumns)
+
+    """Save the view definition as JSON; the mask is cached alongside it.
+
+        Arguments:
+        viewFilename -- the file to write, e.g. MLC_46K_LDPruned.view.json
+    """
+    def save(self, viewFilename):
+        self.viewFilename = viewFilename
+        definition = {"base": self.baseFilename, "filters": self.filters}
+        json.dump(definition, open(viewFilename, 'w'), indent=1)
+        if self._mask is not None:
+            self._writeMaskCache()
+
+    """Return a key identifying the base file contents and the filters."""
+    def _cacheKey(self):
+        status = os.stat(self.baseFilename)
+        filterHash = hashlib.sha1(json.dumps(self.filters, sort_keys=True).encode()).hexdigest()
+        return {"baseSize": status.st_size, "baseMtime": status.st_mtime_ns, "filters": filterHash}
+
+    """Return the cached mask if present and still valid, else None."""
+    def _readMaskCache(self):
+        if self.viewFilename is None:
+            return None
+        cacheFilename = self.viewFilename + ".mask"
+        if not os.path.exists(cacheFilename):
+            return None
+        with open(cacheFilename, 'rb') as f:
+            key = json.loads(f.readline().decode())
+            if key != self._cacheKey():
+                return None
+            return bytearray(f.read())
+
+    def _writeMaskCache(self):
+        with open(self.viewFilename + ".mask", 'wb') as f:
+            f.write((json.dumps(self._cacheKey(), sort_keys=True) + "\n").encode())
+            f.write(self._mask)
+
+    """Return the mask of selected base sites, computing it if needed."""
+    def mask(self):
+        if self._mask is not None:
+            return self._mask
+        self._mask = self._readMaskCache()
+        if self._mask is not None:
+            return self._mask
+
+        with Instrumentation.stage("GenotypeView.mask", base=self.baseFilename) as st:
+            sites = None
+            if "sites" in self.filters:
+                sites = set(self.filters["sites"])
+            regions = None
+            if "regions" in self.filters:
+                regions = list(map(lambda x: (HapMapReader.chromosomeKey(str(x[0])), x[1], x[2]), self.filters["regions"]))
+            minMAF = self.filters.get("minMAF")
+            minCallRate = self.filters.get("minCallRate")
+            needStats = minMAF is not None or minCallRate is not None
+
+            mask = bytearray()
+            lineNum = 0
+            for line in open(self.baseFilename):
+                lineNum += 1
+                if lineNum == 1 or len(line) <= 1:
+                    continue
+                fields = line.split("\t", HapMapReader.POS_COLUMN + 1)
+                keep = True
+                if sites is not None and fields[0] not in sites:
+                    keep = False
+                if keep and regions is not None:
+                    chrom = HapMapReader.chromosomeKey(fields[HapMapReader.CHROM_COLUMN])
+                    pos = int(fields[HapMapReader.POS_COLUMN])
+                    keep = False
+                    for regionChrom, start, end in regions:
+                        if chrom == regionChrom and (start is None or pos >= start) and (end is None or pos <= end):
+                            keep = True
+                            break
+                if keep and needStats:
+                    calls = line.rstrip("\r\n").split("\t")[HapMapReader.META_COLUMNS:]
+                    maf, callRate = siteStats(fields[1], self._pickTaxa(calls))
+                    if minMAF is not None and maf < minMAF:
+                        keep = False
+                    if minCallRate is not None and callRate < minCallRate:
+                        keep = False
+                mask.append(1 if keep else 0)
+            self._mask = mask
+            st.count(rowsIn=len(mask), rowsOut=self.nSites(), bytesIn=os.path.getsize(self.baseFilename))
+
+        if self.viewFilename is not None:
+            self._writeMaskCache()
+        return self._mask
+
+    """Return the number of selected sites."""
+    def nSites(self):
+        return self.mask().count(1)
+
+    """Return the header fields of the view: metadata columns then taxa."""
+    def header(self):
+        return self.metaHeader + self.taxa
+
+    """Yield (key, fields) for every selected site, as HapMapReader.iterSites().
+
+        fields holds the metadata columns followed by the selected taxa's calls.
+    """
+    def iterSites(self):
+        pickTaxa = self._pickTaxa
+        for line in self.iterBaseLines():
+            fields = line.rstrip("\r\n").split("\t")
+            key = (HapMapReader.chromosomeKey(fields[HapMapReader.CHROM_COLUMN]), int(fields[HapMapReader.POS_COLUMN]))
+            yield (key, fields[:HapMapReader.META_COLUMNS] + list(pickTaxa(fields[HapMapReader.META_COLUMNS:])))
+
+    """Yield the base file's lines for the selected sites, with all base taxa.
+
+        For consumers that pick the taxa columns themselves (see taxaColumns).
+    """
+    def iterBaseLines(self):
+        mask = self.mask()
+        i = -1
+        lineNum = 0
+        for line in open(self.baseFilename):
+            lineNum += 1
+            if lineNum == 1 or len(line) <= 1:
+                continue
+            i += 1
+            if mask[i]:
+                yield line
+
+    """Yield the view as HapMap lines, header first, each ending with a newline."""
+    def iterLines(self):
+        yield "\t".join(self.header()) + "\n"
+        if len(self.taxaColumns) == len(self.baseTaxa):
+            # no taxa filter: selected lines pass through untouched
+            for line in self.iterBaseLines():
+                yield line
+        else:
+            for key, fields in self.iterSites():
+                yield "\t".join(fields) + "\n"
+
+    """Materialize the view as a HapMap file, for tools that need one.
+
+        Arguments:
+        outputFilename -- the HapMap file to write
+    """
+    def writeHapMap(self, outputFilename):
+        with Instrumentation.stage("GenotypeView.writeHapMap", base=self.baseFilename, output=outputFilename) as st:
+            out = open(outputFilename, 'w')
+            for line in self.iterLines():
+                out.write(line)
+            out.close()
+            st.count(rowsOut=self.nSites(), bytesIn=os.path.getsize(self.baseFilename), bytesOut=os.path.getsize(outputFilename))
+
+"""Load a view saved with GenotypeView.save().
+
+    Arguments:
+    viewFilename -- the view definition file
+"""
+def loadView(viewFilename):
+    definition = json.load(open(viewFilename))
+    view = GenotypeView(definition["base"], **definition["filters"])
+    view.viewFilename = viewFilename
+    return view
+
+"""Executable"""
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Create, inspect and materialize filtered genotype views.")
+    subparsers = parser.add_subparsers(dest="command")
+    create = subparsers.add_parser("create", help="define a view over a base HapMap")
+    create.add_argument("base")
+    create.add_argument("view")
+    create.add_argument("--min-maf", type=float)
+    create.add_argument("--min-call-rate", type=float)
+    create.add_argument("--sites", help="file listing the site names to keep")
+    create.add_argument("--taxa", help="file listing the taxa to keep")
+    create.add_argument("--region", action="append", help="chrom[:start-end], may be repeated")
+    info = subparsers.add_parser("info", help="print the size of a view")
+    info.add_argument("view")
+    write = subparsers.add_parser("write", help="write a view out as a HapMap file")
+    write.add_argument("view")
+    write.add_argument("output")
+    vcf = subparsers.add_parser("vcf", help="convert a view to vcf")
+    vcf.add_argument("view")
+    vcf.add_argument("output")
+    args = parser.parse_args()
+
+    if args.command == "create":
+        regions = None
+        if args.region is not None:
+            regions = []
+            for region in args.region:
+                if ":" in region:
+                    chrom, span = region.split(":")
+                    start, end = span.split("-")
+                    regions.append([chrom, int(start), int(end)])
+                else:
+                    regions.append([region, None, None])
+        sites = None
+        if args.sites is not None:
+            sites = readNameList(args.sites)
+        taxa = None
+        if args.taxa is not None:
+            taxa = readNameList(args.taxa)
+        view = GenotypeView(args.base, minMAF=args.min_maf, minCallRate=args.min_call_rate, sites=sites, taxa=taxa, regions=regions)
+        view.save(args.view)
+        view.mask()
+        print(args.view + ": " + str(view.nSites()) + " sites x " + str(len(view.taxa)) + " taxa")
+    elif args.command == "info":
+        view = loadView(args.view)
+        print(args.view + ": " + str(view.nSites()) + " of " + str(len(view.mask())) + " sites, "
+              + str(len(view.taxa)) + " of " + str(len(view.baseTaxa)) + " taxa over " + view.baseFilename)
+    elif args.command == "write":
+        loadView(args.view).writeHapMap(args.output)
+    elif args.command == "vcf":
+        spec = importlib.util.spec_from_file_location("HapMap_VCF_Converter", os.path.join(os.path.dirname(os.path.abspath(__file__)), "HapMap_VCF_Converter.py"))
+        HapMap_VCF_Converter = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(HapMap_VCF_Converter)
+        HapMap_VCF_Converter.convertViewToVCF(loadView(args.view), args.output)
+    else:
+        parser.print_help()
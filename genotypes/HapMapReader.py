@@ -0,0 +1,78 @@
+"""Streaming access to HapMap files, one site at a time.
+
+The HapMaps used in the pipeline have 11 metadata columns (rs, alleles, chrom,
+pos, strand, assembly, center, protLSID, assayLSID, panelLSID, QCcode)
+followed by one call per taxon. Nothing here holds more than one row of a file
+in memory.
+"""
+
+"""Dependencies"""
+import operator
+import re
+
+META_COLUMNS = 11
+CHROM_COLUMN = 2
+POS_COLUMN = 3
+
+"""Return (metaHeader, taxa) from the first line of a HapMap file.
+
+    Arguments:
+    filename -- the HapMap file
+"""
+def readHeader(filename):
+    with open(filename) as f:
+        header = f.readline().rstrip("\r\n").split("\t")
+    return (header[:META_COLUMNS], header[META_COLUMNS:])
+
+"""Return a sort key for a chromosome label, so "chr01", "Chr 1", "01" and "1"
+all compare equal, and numbered chromosomes sort numerically before any
+unnumbered ones (e.g. "UNKNOWN").
+
+    Arguments:
+    chrom -- chromosome label as found in the HapMap
+"""
+def chromosomeKey(chrom):
+    match = re.search(r"(\d+)$", chrom.strip())
+    if match is None:
+        return (1, chrom.strip().upper())
+    return (0, int(match.group(1)))
+
+"""Yield (key, fields) for every site of a HapMap, in file order.
+
+    key is (chromosomeKey(chrom), pos) and fields is the full list of columns.
+    If requireSorted is set, a ValueError is raised as soon as a site is found
+    out of (chrom, pos) order.
+
+    Arguments:
+    filename -- the HapMap file
+    requireSorted -- check that sites are sorted by (chrom, pos)
+"""
+def iterSites(filename, requireSorted=False):
+    previousKey = None
+    lineNum = 0
+    for line in open(filename):
+        lineNum += 1
+        if lineNum == 1 or len(line) <= 1:
+            continue
+        fields = line.rstrip("\r\n").split("\t")
+        key = (chromosomeKey(fields[CHROM_COLUMN]), int(fields[POS_COLUMN]))
+        if requireSorted:
+            if previousKey is not None and key < previousKey:
+                raise ValueError(filename + ", line " + str(lineNum) + ": site " + fields[0] + " is out of (chrom, pos) order")
+            previousKey = key
+        yield (key, fields)
+
+"""Return a function picking the given columns out of a list of calls.
+
+    The returned function always returns a tuple, even for one column.
+
+    Arguments:
+    indices -- indices of the columns to pick, in order
+"""
+def columnPicker(indices):
+    if len(indices) == 0:
+        return lambda calls: ()
+    if len(indices) == 1:
+        index = indices[0]
+        return lambda calls: (calls[index],)
+    return operator.itemgetter(*indices)
@@ -18,7 +18,11 @@ Last Modified:  12/21/2016
 """
 
 """Dependencies"""
+import importlib.util
 import os, sys
+spec = importlib.util.spec_from_file_location("Instrumentation", os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "Instrumentation.py"))
+Instrumentation = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(Instrumentation)
 
 # The input file format is
 
@@ -57,55 +61,95 @@ import os, sys
 # 01    23664    S01_23664    C    T    .    PASS    AR2=0.99;DR2=0.99;AF=0.10    GT:DS:GP    0/0:0:1,0,0   0/0:0:1,0,0
 
 
-filename = sys.argv[1] # input vcf, here sorghum_first72WGS.hmp.txt
-outname = sys.argv[2] # name of the output, here sorghum_first72WGS_noImput.vcf
+"""Write the vcf for the given HapMap lines and return (rows read, rows written).
 
-output = open(outname,'w')
-output.write('##fileformat=VCFv4.2\n')
-output.write('##filedate=20161220\n')
-output.write('##source="beagle.27Jun16.b16.jar (version 4.1)"\n')
-output.write('##INFO=<ID=AF,Number=A,Type=Float,Description="Estimated ALT Allele Frequencies">\n')
-output.write('##INFO=<ID=AR2,Number=1,Type=Float,Description="Allelic R-Squared: estimated squared correlation between most probable REF dose and true REF dose">\n')
-output.write('##INFO=<ID=DR2,Number=1,Type=Float,Description="Dosage R-Squared: estimated squared correlation between estimated REF dose [P(RA) + 2*P(RR)] and true REF dose">\n')
-output.write('##INFO=<ID=IMP,Number=0,Type=Flag,Description="Imputed marker">\n')
-output.write('##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n')
-output.write('##FORMAT=<ID=DS,Number=A,Type=Float,Description="estimated ALT dose [P(RA) + P(AA)]">\n')
-output.write('##FORMAT=<ID=GP,Number=G,Type=Float,Description="Estimated Genotype Probability">\n')
+    Arguments:
+    lines -- iterable over the HapMap lines, header first
+    outname -- name of the output vcf
+"""
+def _writeVCF(lines, outname):
+    output = open(outname,'w')
+    output.write('##fileformat=VCFv4.2\n')
+    output.write('##filedate=20161220\n')
+    output.write('##source="beagle.27Jun16.b16.jar (version 4.1)"\n')
+    output.write('##INFO=<ID=AF,Number=A,Type=Float,Description="Estimated ALT Allele Frequencies">\n')
+    output.write('##INFO=<ID=AR2,Number=1,Type=Float,Description="Allelic R-Squared: estimated squared correlation between most probable REF dose and true REF dose">\n')
+    output.write('##INFO=<ID=DR2,Number=1,Type=Float,Description="Dosage R-Squared: estimated squared correlation between estimated REF dose [P(RA) + 2*P(RR)] and true REF dose">\n')
+    output.write('##INFO=<ID=IMP,Number=0,Type=Flag,Description="Imputed marker">\n')
+    output.write('##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n')
+    output.write('##FORMAT=<ID=DS,Number=A,Type=Float,Description="estimated ALT dose [P(RA) + P(AA)]">\n')
+    output.write('##FORMAT=<ID=GP,Number=G,Type=Float,Description="Estimated Genotype Probability">\n')
+    
+    rowsIn = 0
+    rowsOut = 0
+    headerlast = '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t' # and add sample names to that
+    
+    for line in lines:
+        if len(line) <= 1:
+            continue
+        if line.startswith('rs#'):
+            a = line.strip().split('\t')
+            indvlist = a[11:]
+            indvstr = '\t'.join(map(str,indvlist))+'\n'
+            headerlast = headerlast + indvstr
+            output.write(headerlast)
+            continue
+    
+        rowsIn += 1
+        a = line.strip().split('\t')
+        alleles = a[1]
+        if len(alleles) == 3: # exclude fixed, 'NA', triallelic
+            if '-' in alleles or '0' in alleles:
+                continue
+            ## There are also cases like that:
+            ## S10_58283280    A/-    10    58283280    +    NA    NA    NA    NA    NA    NA    A    -    N    A    A
+            ## filter out lines with 0 or -, we are going to exclude indels for now
+            all1 = alleles.split('/')[0]
+            all2 = alleles.split('/')[1]
+            new_line_beginning = 'Chr'+ str(a[2]) +'\t'+ str(a[3]) + '\t.\t' + all1 + '\t' + all2 + '\t.\tPASS\tAR2=0;DR2=0;AF=0\tGT:DS:GP\t'
+    
+            for g in a[11:]:
+                if g == all1:
+                    new_line_beginning = new_line_beginning + '0/0:1:1,0,0'+ '\t'
+                elif g == all2:
+                    new_line_beginning = new_line_beginning + '1/1:1:0,0,1' + '\t'
+                elif g == 'N':
+                    new_line_beginning = new_line_beginning + './.' + '\t'
+                else:
+                    new_line_beginning = new_line_beginning + '0/1:1:0,1,0' + '\t'
+            new_line_beginning = new_line_beginning + '\n'
+            output.write(new_line_beginning)
+            rowsOut += 1
+    output.close()
+    return (rowsIn, rowsOut)
+
+"""Convert the given HapMap file to vcf, writing to the given output file.
+
+    Arguments:
+    filename -- input HapMap, e.g. sorghum_first72WGS.hmp.txt
+    outname -- name of the output vcf, e.g. sorghum_first72WGS_noImput.vcf
+"""
+def convertHapMapToVCF(filename, outname):
+    with Instrumentation.stage("HapMap_VCF_Converter", input=filename, output=outname) as st:
+        rowsIn, rowsOut = _writeVCF(open(filename), outname)
+        st.count(rowsIn=rowsIn, rowsOut=rowsOut, bytesIn=os.path.getsize(filename), bytesOut=os.path.getsize(outname))
 
-headerlast = '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t' # and add sample names to that
+"""Convert a filtered genotype view (see GenotypeView.py) to vcf, streaming the
+selected sites and taxa from its base file without materializing a HapMap.
 
-for line in open(filename):
-    if len(line) <= 1:
-        continue
-    if line.startswith('rs#'):
-        a = line.strip().split('\t')
-        indvlist = a[11:]
-        indvstr = '\t'.join(map(str,indvlist))+'\n'
-        headerlast = headerlast + indvstr
-        output.write(headerlast)
-        continue
-
-    a = line.strip().split('\t')
-    alleles = a[1]
-    if len(alleles) == 3: # exclude fixed, 'NA', triallelic
-        if '-' in alleles or '0' in alleles:
-            continue
-        ## There are also cases like that:
-        ## S10_58283280    A/-    10    58283280    +    NA    NA    NA    NA    NA    NA    A    -    N    A    A
-        ## filter out lines with 0 or -, we are going to exclude indels for now
-        all1 = alleles.split('/')[0]
-        all2 = alleles.split('/')[1]
-        new_line_beginning = 'Chr'+ str(a[2]) +'\t'+ str(a[3]) + '\t.\t' + all1 + '\t' + all2 + '\t.\tPASS\tAR2=0;DR2=0;AF=0\tGT:DS:GP\t'
-
-        for g in a[11:]:
-            if g == all1:
-                new_line_beginning = new_line_beginning + '0/0:1:1,0,0'+ '\t'
-            elif g == all2:
-                new_line_beginning = new_line_beginning + '1/1:1:0,0,1' + '\t'
-            elif g == 'N':
-                new_line_beginning = new_line_beginning + './.' + '\t'
-            else:
-                new_line_beginning = new_line_beginning + '0/1:1:0,1,0' + '\t'
-        new_line_beginning = new_line_beginning + '\n'
-        output.write(new_line_beginning)
-output.close()
+    Arguments:
+    view -- a GenotypeView
+    outname -- name of the output vcf
+"""
+def convertViewToVCF(view, outname):
+    with Instrumentation.stage("HapMap_VCF_Converter", input=view.baseFilename, view=view.viewFilename, output=outname) as st:
+        rowsIn, rowsOut = _writeVCF(view.iterLines(), outname)
+        st.count(rowsIn=rowsIn, rowsOut=rowsOut, bytesIn=os.path.getsize(view.baseFilename), bytesOut=os.path.getsize(outname))
+
+"""Executable"""
+if __name__ == "__main__":
+    
+    filename = sys.argv[1] # input vcf, here sorghum_first72WGS.hmp.txt
+    outname = sys.argv[2] # name of the output, here sorghum_first72WGS_noImput.vcf
+    
+    convertHapMapToVCF(filename, outname)
@@ -0,0 +1,279 @@
+"""Join two HapMaps by site and taxon with a streaming sorted-merge join.
+
+Written for the raw 485K and imputed 438K genotype sets, but works for any two
+HapMaps sorted by (chrom, pos). Both files are read one row at a time, so
+memory use depends on the number of taxa only, never on the number of sites.
+
+Taxa columns are aligned through the standard-name mapping: each file's taxa
+names are translated to the MLC standard before matching.
+
+Two modes:
+merge -- union of sites and taxa. Where both files have a call for a taxon at
+         a site, the primary file's call wins unless it is missing (N), in
+         which case the secondary's is used.
+overlay -- the primary file's sites and taxa only. The secondary's non-missing
+         calls replace the primary's.
+
+Sites are matched on chromosome number, so the files may code chromosomes
+differently ("chr1" vs "1"). Sites found only in the secondary file are written
+in the primary's coding, so the merged HapMap uses one coding throughout.
+
+For every site and taxon found in both files, calls that are non-missing in
+both are compared. Per-site and per-taxon concordance counts are written to
+separate tables.
+"""
+
+"""Dependencies"""
+import importlib.util
+import logging
+import os
+import re
+spec = importlib.util.spec_from_file_location("HapMapReader", os.path.join(os.path.dirname(os.path.abspath(__file__)), "HapMapReader.py"))
+HapMapReader = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(HapMapReader)
+spec = importlib.util.spec_from_file_location("Instrumentation", os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "Instrumentation.py"))
+Instrumentation = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(Instrumentation)
+
+logger = logging.getLogger(__name__)
+
+MISSING = "N"
+
+"""Translate a list of taxa names to the standard, and return them.
+
+    Names the translator rejects (ValueError) are kept as they are. If two
+    names translate to the same standard name, only the first is kept; the
+    duplicate is returned as None so its column is ignored.
+
+    Arguments:
+    taxa -- taxa names as found in a HapMap header
+    translate -- function from a name to its standard name, or None if the
+                 names are already standard
+"""
+def standardizeTaxa(taxa, translate):
+    standard = []
+    seen = set()
+    for taxon in taxa:
+        name = taxon
+        if translate is not None:
+            try:
+                name = translate(taxon)
+            except ValueError:
+                logger.warning("No standard name for " + taxon + "; keeping it as is")
+        if name in seen:
+            logger.warning("Duplicate standard name " + name + " (from " + taxon + "); column ignored")
+            standard.append(None)
+            continue
+        seen.add(name)
+        standard.append(name)
+    return standard
+
+"""Return the coding of a numbered chromosome name as (prefix, digits):
+("chr", 1) for "chr1", ("", 1) for "1", ("chr", 2) for the zero-padded "chr01".
+Returns None if the name has no number (e.g. "Pt").
+
+    Arguments:
+    chrom -- chromosome name as found in a HapMap
+"""
+def chromosomeCoding(chrom):
+    match = re.match(r"^(.*?)(\d+)$", chrom.strip())
+    if match is None:
+        return None
+    number = match.group(2)
+    return (match.group(1), len(number) if number.startswith("0") else 1)
+
+"""Rewrite a site's chromosome in another coding, and return its meta columns.
+
+    The rs name is rewritten too if it starts with the chromosome name
+    (e.g. "chr1_12345").
+
+    Arguments:
+    meta -- the site's meta columns
+    coding -- chromosome coding to use (see chromosomeCoding), or None to keep
+              the site as it is
+"""
+def recodeChromosome(meta, coding):
+    chrom = meta[HapMapReader.CHROM_COLUMN]
+    key = HapMapReader.chromosomeKey(chrom)
+    if coding is None or key[0] != 0:
+        return meta
+    recoded = coding[0] + str(key[1]).zfill(coding[1])
+    if recoded == chrom:
+        return meta
+    meta = list(meta)
+    meta[HapMapReader.CHROM_COLUMN] = recoded
+    if meta[0].startswith(chrom + "_"):
+        meta[0] = recoded + meta[0][len(chrom):]
+    return meta
+
+"""Merge two HapMaps and write the result plus concordance tables.
+
+    Returns a dict with the number of sites written, shared, and found only in
+    each file.
+
+    Arguments:
+    primaryFilename -- the HapMap whose calls win in merge mode
+    secondaryFilename -- the other HapMap
+    outputFilename -- the merged HapMap to write
+    primaryTranslate -- name translator for the primary's taxa (None if standard)
+    secondaryTranslate -- name translator for the secondary's taxa (None if standard)
+    mode -- "merge" or "overlay", see the module docstring
+    siteConcordanceFilename -- if given, per-site concordance table to write
+    taxonConcordanceFilename -- if given, per-taxon concordance table to write
+"""
+def mergeHapMaps(primaryFilename, secondaryFilename, outputFilename, primaryTranslate=None, secondaryTranslate=None,
+                 mode="merge", siteConcordanceFilename=None, taxonConcordanceFilename=None):
+    if mode not in ("merge", "overlay"):
+        raise ValueError("Unknown merge mode: " + mode)
+
+    with Instrumentation.stage("MergeHapMaps", primary=primaryFilename, secondary=secondaryFilename, mode=mode) as st:
+        metaHeader, primaryTaxa = HapMapReader.readHeader(primaryFilename)
+        secondaryTaxa = HapMapReader.readHeader(secondaryFilename)[1]
+        primaryStandard = standardizeTaxa(primaryTaxa, primaryTranslate)
+        secondaryStandard = standardizeTaxa(secondaryTaxa, secondaryTranslate)
+
+        """Lay out the output columns. Index len(taxa) of a file points at the
+        MISSING sentinel appended to each of its rows."""
+        outputTaxa = list(filter(lambda x: x is not None, primaryStandard))
+        if mode == "merge":
+            primaryNames = set(outputTaxa)
+            outputTaxa += list(filter(lambda x: x is not None and x not in primaryNames, secondaryStandard))
+        primaryIndex = dict((name, i) for i, name in enumerate(primaryStandard) if name is not None)
+        secondaryIndex = dict((name, i) for i, name in enumerate(secondaryStandard) if name is not None)
+        primaryColumns = list(map(lambda x: primaryIndex.get(x, len(primaryTaxa)), outputTaxa))
+        secondaryColumns = list(map(lambda x: secondaryIndex.get(x, len(secondaryTaxa)), outputTaxa))
+        sharedTaxa = list(filter(lambda x: x in primaryIndex and x in secondaryIndex, outputTaxa))
+        pickPrimary = HapMapReader.columnPicker(primaryColumns)
+        pickSecondary = HapMapReader.columnPicker(secondaryColumns)
+        pickSharedPrimary = HapMapReader.columnPicker(list(map(lambda x: primaryIndex[x], sharedTaxa)))
+        pickSharedSecondary = HapMapReader.columnPicker(list(map(lambda x: secondaryIndex[x], sharedTaxa)))
+        taxonCompared = [0] * len(sharedTaxa)
+        taxonConcordant = [0] * len(sharedTaxa)
+
+        out = open(outputFilename, 'w')
+        out.write("\t".join(metaHeader + outputTaxa) + "\n")
+        siteOut = None
+        if siteConcordanceFilename is not None:
+            siteOut = open(siteConcordanceFilename, 'w')
+            siteOut.write("rs\tchrom\tpos\tcompared\tconcordant\tdiscordant\tconcordance\n")
+
+        counts = {"written": 0, "shared": 0, "primaryOnly": 0, "secondaryOnly": 0}
+        primarySites = HapMapReader.iterSites(primaryFilename, requireSorted=True)
+        secondarySites = HapMapReader.iterSites(secondaryFilename, requireSorted=True)
+        primary = next(primarySites, None)
+        secondary = next(secondarySites, None)
+        # secondary-only sites are written in the primary's chromosome coding
+        primaryCoding = None
+        if primary is not None:
+            primaryCoding = chromosomeCoding(primary[1][HapMapReader.CHROM_COLUMN])
+        while primary is not None or secondary is not None:
+            if secondary is None or (primary is not None and primary[0] < secondary[0]):
+                meta = primary[1][:HapMapReader.META_COLUMNS]
+                calls = pickPrimary(primary[1][HapMapReader.META_COLUMNS:] + [MISSING])
+                counts["primaryOnly"] += 1
+                primary = next(primarySites, None)
+            elif primary is None or secondary[0] < primary[0]:
+                counts["secondaryOnly"] += 1
+                if mode == "overlay":
+                    secondary = next(secondarySites, None)
+                    continue
+                meta = recodeChromosome(secondary[1][:HapMapReader.META_COLUMNS], primaryCoding)
+                calls = pickSecondary(secondary[1][HapMapReader.META_COLUMNS:] + [MISSING])
+                secondary = next(secondarySites, None)
+            else:
+                meta = primary[1][:HapMapReader.META_COLUMNS]
+                primaryCalls = primary[1][HapMapReader.META_COLUMNS:] + [MISSING]
+                secondaryCalls = secondary[1][HapMapReader.META_COLUMNS:] + [MISSING]
+                if mode == "merge":
+                    calls = [p if p != MISSING else s for p, s in zip(pickPrimary(primaryCalls), pickSecondary(secondaryCalls))]
+                else:
+                    calls = [s if s != MISSING else p for p, s in zip(pickPrimary(primaryCalls), pickSecondary(secondaryCalls))]
+
+                compared = 0
+                concordant = 0
+                j = 0
+                for p, s in zip(pickSharedPrimary(primaryCalls), pickSharedSecondary(secondaryCalls)):
+                    if p != MISSING and s != MISSING:
+                        compared += 1
+                        taxonCompared[j] += 1
+                        if p == s:
+                            concordant += 1
+                            taxonConcordant[j] += 1
+                    j += 1
+                if siteOut is not None:
+                    rate = "NA"
+                    if compared > 0:
+                        rate = "%.4f" % (concordant / compared)
+                    siteOut.write(meta[0] + "\t" + meta[HapMapReader.CHROM_COLUMN] + "\t" + meta[HapMapReader.POS_COLUMN]
+                                  + "\t" + str(compared) + "\t" + str(concordant) + "\t" + str(compared - concordant) + "\t" + rate + "\n")
+                counts["shared"] += 1
+                primary = next(primarySites, None)
+                secondary = next(secondarySites, None)
+
+            out.write("\t".join(meta) + "\t" + "\t".join(calls) + "\n")
+            counts["written"] += 1
+        out.close()
+        if siteOut is not None:
+            siteOut.close()
+
+        if taxonConcordanceFilename is not None:
+            taxonOut = open(taxonConcordanceFilename, 'w')
+            taxonOut.write("taxon\tcompared\tconcordant\tdiscordant\tconcordance\n")
+            for j in range(0, len(sharedTaxa)):
+                rate = "NA"
+                if taxonCompared[j] > 0:
+                    rate = "%.4f" % (taxonConcordant[j] / taxonCompared[j])
+                taxonOut.write(sharedTaxa[j] + "\t" + str(taxonCompared[j]) + "\t" + str(taxonConcordant[j])
+                               + "\t" + str(taxonCompared[j] - taxonConcordant[j]) + "\t" + rate + "\n")
+            taxonOut.close()
+
+        st.count(rowsIn=counts["shared"] * 2 + counts["primaryOnly"] + counts["secondaryOnly"], rowsOut=counts["written"],
+                 bytesIn=os.path.getsize(primaryFilename) + os.path.getsize(secondaryFilename), bytesOut=os.path.getsize(outputFilename))
+        st.fields.update(counts)
+    return counts
+
+"""Executable"""
+if __name__ == "__main__":
+
+    spec = importlib.util.spec_from_file_location("Common", "../../pipeline/Common.py")
+    Common = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(Common)
+    logging.basicConfig(level=logging.INFO)
+
+    """
+    ============================================================================
+    ==== CONFIGURATION
+    ============================================================================
+    """
+    rawFilename = Common.genotypeTopLevel + os.sep + "MLC_taxa_raw_485K_genotypes.hmp.txt"
+    imputedFilename = Common.genotypeTopLevel + os.sep + "MLC_taxa_imputed_438K_genotypes.hmp.txt"
+    mode = "merge"
+    #mode = "overlay"
+    # Column of the taxa name mapping table holding each file's names, as
+    # passed to Common.translateNameToStandard(). None if the file's header
+    # already uses the standard names.
+    rawNameColumn = None
+    imputedNameColumn = None
+
+    outputFilename = Common.genotypeTopLevel + os.sep + "MLC_taxa_imputed_438K_raw_485K_" + mode + ".hmp.txt"
+    siteConcordanceFilename = Common.genotypeTopLevel + os.sep + "MLC_taxa_imputed_438K_raw_485K_site_concordance.txt"
+    taxonConcordanceFilename = Common.genotypeTopLevel + os.sep + "MLC_taxa_imputed_438K_raw_485K_taxon_concordance.txt"
+
+    """
+    ============================================================================
+    ==== MERGE
+    ============================================================================
+    """
+    imputedTranslate = None
+    if imputedNameColumn is not None:
+        imputedTranslate = lambda x: Common.translateNameToStandard(x, imputedNameColumn)
+    rawTranslate = None
+    if rawNameColumn is not None:
+        rawTranslate = lambda x: Common.translateNameToStandard(x, rawNameColumn)
+
+    counts = mergeHapMaps(imputedFilename, rawFilename, outputFilename, imputedTranslate, rawTranslate, mode,
+                          siteConcordanceFilename, taxonConcordanceFilename)
+    print(str(counts["written"]) + " sites written: " + str(counts["shared"]) + " shared, "
+          + str(counts["primaryOnly"]) + " imputed only, " + str(counts["secondaryOnly"]) + " raw only")
+
+    print("Done!")
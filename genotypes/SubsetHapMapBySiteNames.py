@@ -1,31 +1,71 @@
-"""Load list of SNP names to keep""" 
-snpNameFile = "/home/james/GoreLab/MaizeLeafCuticle/genotypes/popStructure/plink.prune.in"
-snpNames = []
-for line in open(snpNameFile):
-    if not line.strip() == "":
-        snpNames.append(line.strip())
-
-"""Open a file to write the pruned output to"""
-outputHapMapFile = "/home/james/GoreLab/MaizeLeafCuticle/genotypes/MLC_taxa_imputed_46K_filtered_LDPruned.hmp.txt"
-out = open(outputHapMapFile,'w')
-
-"""Load unpruned HapMap file"""
-inputHapMapFile = "/home/james/GoreLab/MaizeLeafCuticle/genotypes/MLC_taxa_imputed_408K_filtered.hmp.txt"
-lineNum = 1
-
-for line in open(inputHapMapFile):
-    if line.strip() == "":
-        continue
-    if lineNum == 1:
-        #pass
-        out.write(line)
-    else:
-        snp = line[:line.find("\t")]
-        if not snp in snpNames:
-            continue
-        else:
-            out.write(line)
-            snpNames.remove(snp) # for speed
-    lineNum += 1
-    
-print("Done!")
\ No newline at end of file
+"""Subset a HapMap file to the sites named in a list, e.g. the LD-pruned set
+written by plink.
+"""
+
+"""Dependencies"""
+import importlib.util
+import os
+spec = importlib.util.spec_from_file_location("Instrumentation", os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "Instrumentation.py"))
+Instrumentation = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(Instrumentation)
+
+"""Write the rows of a HapMap whose site names appear in a given list.
+
+    The header line is always kept. Rows are written in the order of the input
+    HapMap.
+
+    Arguments:
+    snpNameFile -- file listing the site names to keep, one per line
+    inputHapMapFile -- the HapMap to subset
+    outputHapMapFile -- the file to write the subset HapMap to
+"""
+def subsetHapMapBySiteNames(snpNameFile, inputHapMapFile, outputHapMapFile):
+    with Instrumentation.stage("SubsetHapMapBySiteNames", input=inputHapMapFile, output=outputHapMapFile) as st:
+
+        """Load list of SNP names to keep"""
+        with Instrumentation.stage("loadSiteNames") as step:
+            snpNames = []
+            for line in open(snpNameFile):
+                if not line.strip() == "":
+                    snpNames.append(line.strip())
+            step.count(rowsIn=len(snpNames), bytesIn=os.path.getsize(snpNameFile))
+
+        """Open a file to write the pruned output to"""
+        out = open(outputHapMapFile,'w')
+
+        """Load unpruned HapMap file"""
+        lineNum = 1
+        rowsIn = 0
+        rowsOut = 0
+
+        with Instrumentation.stage("subset") as step:
+            for line in open(inputHapMapFile):
+                if line.strip() == "":
+                    continue
+                if lineNum == 1:
+                    #pass
+                    out.write(line)
+                else:
+                    rowsIn += 1
+                    snp = line[:line.find("\t")]
+                    if not snp in snpNames:
+                        continue
+                    else:
+                        out.write(line)
+                        rowsOut += 1
+                        snpNames.remove(snp) # for speed
+                lineNum += 1
+            out.close()
+            step.count(rowsIn=rowsIn, rowsOut=rowsOut, bytesIn=os.path.getsize(inputHapMapFile), bytesOut=os.path.getsize(outputHapMapFile))
+        st.count(rowsIn=rowsIn, rowsOut=rowsOut, bytesIn=os.path.getsize(inputHapMapFile), bytesOut=os.path.getsize(outputHapMapFile))
+
+"""Executable"""
+if __name__ == "__main__":
+
+    snpNameFile = "/home/james/GoreLab/MaizeLeafCuticle/genotypes/popStructure/plink.prune.in"
+    outputHapMapFile = "/home/james/GoreLab/MaizeLeafCuticle/genotypes/MLC_taxa_imputed_46K_filtered_LDPruned.hmp.txt"
+    inputHapMapFile = "/home/james/GoreLab/MaizeLeafCuticle/genotypes/MLC_taxa_imputed_408K_filtered.hmp.txt"
+
+    subsetHapMapBySiteNames(snpNameFile, inputHapMapFile, outputHapMapFile)
+
+    print("Done!")
@@ -8,11 +8,13 @@ Last Modified:  12/22/2016
 
 """Dependencies"""
 import importlib.util
-import subprocess
 import os
 spec = importlib.util.spec_from_file_location("Common", "../../pipeline/Common.py")
 Common = importlib.util.module_from_spec(spec)
 spec.loader.exec_module(Common)
+spec = importlib.util.spec_from_file_location("Instrumentation", os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "Instrumentation.py"))
+Instrumentation = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(Instrumentation)
 
 """Determine literal phenotype designation from parameters.
 
@@ -48,6 +50,20 @@ def getPhenotypeDesignation(scaleByLeafSize,blupsNotBlues, transformed, checkFix
     
     return phenoDesignation
 
+"""Return the taxa with phenotype values for a phenotype designation.
+
+    These are the taxa the phenotype-specific genotype files are built for,
+    read from the first column of the designation's BLUX table.
+
+    Arguments:
+    phenoDesignation -- as returned by getPhenotypeDesignation()
+"""
+def getPhenotypeTaxa(phenoDesignation):
+    bluxTableDir = Common.projectTopLevel + os.sep + "phenotypes" + os.sep + "BLUPs" + os.sep + "BLUXTables"
+    bluxTablePath = bluxTableDir + os.sep + phenoDesignation + ".csv"
+    bluxTable = Common.readTableFromFile(bluxTablePath,header=True)
+    return list(map(lambda x: x[0], bluxTable))
+
 if __name__ == "__main__":
     
     """
@@ -73,51 +89,53 @@ if __name__ == "__main__":
     ============================================================================
     ============================================================================
     """
-    """
-    1) Generate a file listing taxa names based on phenotype specification.
-    """
-    bluxTableDir = Common.projectTopLevel + os.sep + "phenotypes" + os.sep + "BLUPs" + os.sep + "BLUXTables"
-    bluxTableFilename = getPhenotypeDesignation(scaleByLeafSize, blupsNotBlues, transformed, checkFixed, checkRandom, envs) + ".csv"
-    bluxTablePath = bluxTableDir + os.sep + bluxTableFilename
-    bluxTable = Common.readTableFromFile(bluxTablePath,header=True)
-    tempFilename = Common.projectTopLevel + os.sep + "GWAS/pipeline/tempTaxaList"
-    Common.writeTableToFile(list(map(lambda x: [x[0]],bluxTable)), tempFilename)
-    
-    """
-    2) Make a system call to TASSEL to filter the base genotype files for
-    those taxa.
-    """
-    baseAssociationGenotypeFilename = Common.genotypeTopLevel + os.sep + "MLC_taxa_imputed_408K_filtered.hmp.txt"
-    baseKinshipGenotypeFilename = Common.genotypeTopLevel + os.sep + "MLC_taxa_imputed_46K_filtered_LDPruned.hmp.txt"
-    exportDirectory = "/home/james/GoreLab/MaizeLeafCuticle/GWAS/"
-    if scaleByLeafSize:
-        exportDirectory += "RelativeCuticularEvaporation/"
-    else:
-        exportDirectory += "AbsoluteCuticularEvaporation/"
-    exportDirectory += envs
-    exportAssociationFilename = "MLC_taxa_imputed_408K_filtered_phenoSpecific.hmp.txt"
-    exportKinshipFilename = "MLC_taxa_imputed_46K_filtered_LDPruned_phenoSpecific.hmp.txt"
-    exportAssociationPath = exportDirectory + os.sep + exportAssociationFilename
-    exportKinshipPath = exportDirectory + os.sep + exportKinshipFilename
-    
-    os.chdir("/home/james")
-    sysCommandList = ["./TASSEL5/run_pipeline.pl","-h",baseAssociationGenotypeFilename,"-includeTaxaInFile",tempFilename,"-export",exportAssociationPath,"-exportType","HapmapDiploid"]
-    subprocess.call(sysCommandList)
-    sysCommandList = ["./TASSEL5/run_pipeline.pl","-h",baseKinshipGenotypeFilename,"-includeTaxaInFile",tempFilename,"-export",exportKinshipPath,"-exportType","HapmapDiploid"]
-    subprocess.call(sysCommandList)
-    
-    """
-    3) Make another system call to correct the problematic # character in
-    the new genotype files.
-    """
-    sysCommandList = ["sed","-i","-e",'1,1s/#//g',exportAssociationPath]
-    subprocess.call(sysCommandList)
-    sysCommandList = ["sed","-i","-e",'1,1s/#//g',exportKinshipPath]
-    subprocess.call(sysCommandList)
-    
-    """
-    4) Make another system call to delete the file listing taxa names.
-    """
-    sysCommandList = ["rm",tempFilename]
+    phenoDesignation = getPhenotypeDesignation(scaleByLeafSize, blupsNotBlues, transformed, checkFixed, checkRandom, envs)
+    with Instrumentation.stage("BuildHapMapsByPhenotype", phenotype=phenoDesignation):
+        
+        """
+        1) Generate a file listing taxa names based on phenotype specification.
+        """
+        with Instrumentation.stage("taxaList") as step:
+            phenotypeTaxa = getPhenotypeTaxa(phenoDesignation)
+            tempFilename = Common.projectTopLevel + os.sep + "GWAS/pipeline/tempTaxaList"
+            Common.writeTableToFile(list(map(lambda x: [x],phenotypeTaxa)), tempFilename)
+            step.count(rowsIn=len(phenotypeTaxa), rowsOut=len(phenotypeTaxa), bytesOut=os.path.getsize(tempFilename))
+        
+        """
+        2) Make a system call to TASSEL to filter the base genotype files for
+        those taxa.
+        """
+        baseAssociationGenotypeFilename = Common.genotypeTopLevel + os.sep + "MLC_taxa_imputed_408K_filtered.hmp.txt"
+        baseKinshipGenotypeFilename = Common.genotypeTopLevel + os.sep + "MLC_taxa_imputed_46K_filtered_LDPruned.hmp.txt"
+        exportDirectory = "/home/james/GoreLab/MaizeLeafCuticle/GWAS/"
+        if scaleByLeafSize:
+            exportDirectory += "RelativeCuticularEvaporation/"
+        else:
+            exportDirectory += "AbsoluteCuticularEvaporation/"
+        exportDirectory += envs
+        exportAssociationFilename = "MLC_taxa_imputed_408K_filtered_phenoSpecific.hmp.txt"
+        exportKinshipFilename = "MLC_taxa_imputed_46K_filtered_LDPruned_phenoSpecific.hmp.txt"
+        exportAssociationPath = exportDirectory + os.sep + exportAssociationFilename
+        exportKinshipPath = exportDirectory + os.sep + exportKinshipFilename
+        
+        os.chdir("/home/james")
+        sysCommandList = ["./TASSEL5/run_pipeline.pl","-h",baseAssociationGenotypeFilename,"-includeTaxaInFile",tempFilename,"-export",exportAssociationPath,"-exportType","HapmapDiploid"]
+        Instrumentation.call(sysCommandList, name="tasselAssociation")
+        sysCommandList = ["./TASSEL5/run_pipeline.pl","-h",baseKinshipGenotypeFilename,"-includeTaxaInFile",tempFilename,"-export",exportKinshipPath,"-exportType","HapmapDiploid"]
+        Instrumentation.call(sysCommandList, name="tasselKinship")
+        
+        """
+        3) Make another system call to correct the problematic # character in
+        the new genotype files.
+        """
+        sysCommandList = ["sed","-i","-e",'1,1s/#//g',exportAssociationPath]
+        Instrumentation.call(sysCommandList, name="sedAssociation")
+        sysCommandList = ["sed","-i","-e",'1,1s/#//g',exportKinshipPath]
+        Instrumentation.call(sysCommandList, name="sedKinship")
+        
+        """
+        4) Make another system call to delete the file listing taxa names.
+        """
+        sysCommandList = ["rm",tempFilename]
     
     print("Done!")
\ No newline at end of file
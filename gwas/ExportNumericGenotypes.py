@@ -0,0 +1,219 @@
+"""Export a HapMap to GAPIT's numeric format (GD genotype matrix + GM map) with
+bounded memory.
+
+HapMaps are site-major (one row per SNP) while GAPIT's GD is sample-major (one
+row per taxon). Rather than transposing the whole matrix in memory, as R does,
+this script reads blocks of sites, codes them as numbers, and writes each
+block transposed into its place in a memory-mapped taxa x SNP matrix. The
+transposition is done in tiles small enough to stay in the CPU cache, so both
+the reads from the block and the writes to the matrix are mostly sequential.
+
+Numeric coding: 0 = homozygous for the first allele of the alleles column,
+1 = heterozygous, 2 = homozygous for the second allele, missing = NA (text) or
+NaN (binary). Both single-character (e.g. "R") and diploid (e.g. "AG") calls
+are understood.
+
+Outputs, for an output prefix P:
+P.GM.txt -- SNP, Chromosome, Position
+P.GD.txt -- "taxa" followed by SNP names, then one row per taxon (text format)
+P.GD.bin -- float32 little-endian taxa x SNP matrix, row-major (binary format),
+            with the taxa order in P.GD.taxa.txt. In R:
+            matrix(readBin(f, "numeric", n=nTaxa*nSNP, size=4, endian="little"),
+                   nrow=nTaxa, byrow=TRUE)
+
+The taxa subset is the one BuildHapMapsByPhenotype.py uses for a phenotype
+configuration.
+"""
+
+"""Dependencies"""
+import argparse
+import importlib.util
+import os
+import numpy as np
+spec = importlib.util.spec_from_file_location("GenotypeView", os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "genotypes", "GenotypeView.py"))
+GenotypeView = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(GenotypeView)
+spec = importlib.util.spec_from_file_location("Instrumentation", os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "Instrumentation.py"))
+Instrumentation = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(Instrumentation)
+
+META_COLUMNS = 11
+MISSING_CODE = -1
+DEFAULT_BLOCK_SITES = 4096
+DEFAULT_TILE = 256 # 256 x 256 tile: 64 kB of int8 in, 256 kB of float32 out
+
+"""Return a 256-entry lookup table from a call character to its numeric code.
+
+    Arguments:
+    alleles -- the alleles column of the site, e.g. "C/T"
+"""
+def _buildCodeTable(alleles):
+    table = np.ones(256, dtype=np.int8) # anything else is heterozygous
+    table[ord("N")] = MISSING_CODE
+    if len(alleles) == 3:
+        table[ord(alleles[2])] = 2
+    table[ord(alleles[0])] = 0
+    return table
+
+"""Return the numeric codes for one site, for the selected taxa.
+
+    Arguments:
+    alleles -- the alleles column of the site
+    calls -- the calls part of the HapMap line, as bytes (no newline)
+    width -- number of characters per call (1 or 2)
+    columns -- indices of the selected taxa among the base taxa
+    codeTables -- cache of lookup tables, by alleles
+"""
+def codeSite(alleles, calls, width, columns, codeTables):
+    raw = np.frombuffer(calls + b"\t", dtype=np.uint8).reshape(-1, width + 1)[columns]
+    if width == 1:
+        table = codeTables.get(alleles)
+        if table is None:
+            table = _buildCodeTable(alleles)
+            codeTables[alleles] = table
+        return table[raw[:, 0]]
+    second = ord(alleles[2]) if len(alleles) == 3 else -1
+    codes = (raw[:, 0] == second).astype(np.int8) + (raw[:, 1] == second).astype(np.int8)
+    codes[(raw[:, 0] == ord("N")) | (raw[:, 1] == ord("N"))] = MISSING_CODE
+    return codes
+
+"""Copy a sites x taxa block, transposed, into a taxa x sites matrix, one
+cache-sized tile at a time.
+
+    Arguments:
+    block -- sites x taxa array
+    matrix -- taxa x sites array (e.g. a memmap) to write into
+    siteOffset -- column of matrix corresponding to the first row of block
+    tile -- edge length of a tile
+"""
+def transposeInto(block, matrix, siteOffset, tile=DEFAULT_TILE):
+    nSites, nTaxa = block.shape
+    for s0 in range(0, nSites, tile):
+        s1 = min(s0 + tile, nSites)
+        for t0 in range(0, nTaxa, tile):
+            t1 = min(t0 + tile, nTaxa)
+            matrix[t0:t1, siteOffset + s0:siteOffset + s1] = block[s0:s1, t0:t1].T
+
+"""Export a HapMap (or a view over one) as GD/GM.
+
+    Returns (number of taxa, number of SNPs).
+
+    Arguments:
+    view -- a GenotypeView selecting the sites and taxa to export
+    outputPrefix -- prefix of the output files
+    binary -- write P.GD.bin (float32) instead of P.GD.txt
+    blockSites -- number of sites read per block
+    tile -- edge length of the transposition tiles
+"""
+def exportNumeric(view, outputPrefix, binary=False, blockSites=DEFAULT_BLOCK_SITES, tile=DEFAULT_TILE):
+    with Instrumentation.stage("ExportNumericGenotypes", input=view.baseFilename, output=outputPrefix, binary=binary) as st:
+        nSites = view.nSites()
+        nTaxa = len(view.taxa)
+        columns = np.array(view.taxaColumns, dtype=np.intp)
+
+        if binary:
+            matrixFilename = outputPrefix + ".GD.bin"
+            matrix = np.memmap(matrixFilename, dtype="<f4", mode="w+", shape=(nTaxa, nSites))
+        else:
+            matrixFilename = outputPrefix + ".GD.scratch"
+            matrix = np.memmap(matrixFilename, dtype=np.int8, mode="w+", shape=(nTaxa, nSites))
+
+        """1) Code blocks of sites and transpose them into the matrix."""
+        with Instrumentation.stage("transpose") as step:
+            snpNames = []
+            gm = open(outputPrefix + ".GM.txt", 'w')
+            gm.write("SNP\tChromosome\tPosition\n")
+            codeTables = {}
+            block = np.empty((blockSites, nTaxa), dtype=np.int8)
+            width = None
+            n = 0
+            written = 0
+            for line in view.iterBaseLines():
+                fields = line.rstrip("\r\n").split("\t", META_COLUMNS)
+                if width is None:
+                    width = len(fields[META_COLUMNS].split("\t", 1)[0])
+                snpNames.append(fields[0])
+                gm.write(fields[0] + "\t" + fields[2] + "\t" + fields[3] + "\n")
+                block[n] = codeSite(fields[1], fields[META_COLUMNS].encode(), width, columns, codeTables)
+                n += 1
+                if n == blockSites:
+                    transposeInto(_toOutputType(block, binary), matrix, written, tile)
+                    written += n
+                    n = 0
+            if n > 0:
+                transposeInto(_toOutputType(block[:n], binary), matrix, written, tile)
+                written += n
+            gm.close()
+            matrix.flush()
+            step.count(rowsIn=written, rowsOut=nTaxa)
+
+        """2) Write the taxa order (binary) or format the rows (text)."""
+        with Instrumentation.stage("write") as step:
+            if binary:
+                taxaOut = open(outputPrefix + ".GD.taxa.txt", 'w')
+                for taxon in view.taxa:
+                    taxaOut.write(taxon + "\n")
+                taxaOut.close()
+                del matrix
+            else:
+                labels = np.array(["NA", "0", "1", "2"]) # indexed by code + 1
+                out = open(outputPrefix + ".GD.txt", 'w')
+                out.write("taxa\t" + "\t".join(snpNames) + "\n")
+                for t in range(0, nTaxa):
+                    out.write(view.taxa[t] + "\t" + "\t".join(labels[matrix[t].astype(np.intp) + 1]) + "\n")
+                out.close()
+                del matrix
+                os.remove(matrixFilename)
+            step.count(rowsOut=nTaxa)
+
+        st.count(rowsIn=nSites, rowsOut=nTaxa, bytesIn=os.path.getsize(view.baseFilename))
+    return (nTaxa, nSites)
+
+"""Return a block of codes in the matrix's type: float32 with NaN for missing
+(binary), or the int8 codes themselves (text).
+
+    Arguments:
+    block -- sites x taxa int8 codes
+    binary -- whether the matrix is float32
+"""
+def _toOutputType(block, binary):
+    if not binary:
+        return block
+    values = block.astype(np.float32)
+    values[block == MISSING_CODE] = np.nan
+    return values
+
+"""Executable"""
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Export a HapMap or genotype view as GAPIT GD/GM.")
+    parser.add_argument("input", help="HapMap file, or a view saved by GenotypeView.py (*.view.json)")
+    parser.add_argument("outputPrefix")
+    parser.add_argument("--binary", action="store_true", help="write a float32 GD.bin instead of GD.txt")
+    parser.add_argument("--taxa", help="file listing the taxa to export")
+    parser.add_argument("--phenotype", help="export the taxa of this phenotype designation, "
+                        "e.g. MLC_AZ16_CE_Rate_scaled_BLUP_transformed (see BuildHapMapsByPhenotype.py)")
+    parser.add_argument("--block-sites", type=int, default=DEFAULT_BLOCK_SITES)
+    parser.add_argument("--tile", type=int, default=DEFAULT_TILE)
+    args = parser.parse_args()
+
+    taxa = None
+    if args.taxa is not None:
+        taxa = GenotypeView.readNameList(args.taxa)
+    if args.phenotype is not None:
+        spec = importlib.util.spec_from_file_location("BuildHapMapsByPhenotype", os.path.join(os.path.dirname(os.path.abspath(__file__)), "BuildHapMapsByPhenotype.py"))
+        BuildHapMapsByPhenotype = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(BuildHapMapsByPhenotype)
+        taxa = BuildHapMapsByPhenotype.getPhenotypeTaxa(args.phenotype)
+
+    if args.input.endswith(".view.json"):
+        view = GenotypeView.loadView(args.input)
+        if taxa is not None:
+            view = GenotypeView.GenotypeView(view.baseFilename, **dict(view.filters, taxa=taxa))
+    else:
+        view = GenotypeView.GenotypeView(args.input, taxa=taxa)
+
+    nTaxa, nSites = exportNumeric(view, args.outputPrefix, args.binary, args.block_sites, args.tile)
+    print(str(nTaxa) + " taxa x " + str(nSites) + " SNPs written to " + args.outputPrefix + ".*")
+
+    print("Done!")
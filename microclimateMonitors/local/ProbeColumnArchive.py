@@ -0,0 +1,348 @@
+"""Columnar, day-partitioned archive of the readings synced from a probe.
+
+Replaces the one growing text table per probe (probeN_<name>.csv) for
+analysis: reading a date range only reads the days it covers, and no string
+parsing is involved.
+
+Each probe has an archive directory. Its readings are partitioned by the
+(UTC) day of their timestamp, and each day is stored as four column files:
+
+    YYYYMMDD.id    ID (int64)
+    YYYYMMDD.time  timestamp (int64, UNIX time)
+    YYYYMMDD.temp  temperature (float32)
+    YYYYMMDD.rh    relative humidity (float32)
+
+all in the machine's byte order (little-endian on the server and on the Pi),
+so a column can be read directly, e.g. with numpy.fromfile(path, "<i8"). Rows
+are in order of ID within a day.
+
+index.json holds, for each day, its number of rows, min and max timestamp,
+min and max ID, and whether its timestamps are sorted, plus the latest ID and
+timestamp of the archive. Appends write the column files first and then
+replace the index atomically, so the index is the commit point: on opening,
+column files longer than the index says (an append interrupted by a crash)
+are truncated back to it. Readings missing from the middle of the archive
+(e.g. backfilled, see ProbeGaps.py) are merged into their days by rewriting
+them, with the same index as commit point (see merge).
+
+Existing text tables convert one-shot, and the archive exports back to the
+text format SyncProbeDBs.py writes:
+
+    python3 ProbeColumnArchive.py convert probe1_rpithon1.csv probe1_rpithon1
+    python3 ProbeColumnArchive.py export probe1_rpithon1 probe1_rpithon1.csv [--start T] [--end T]
+"""
+import argparse
+from array import array
+import json
+import os
+import sys
+import time
+
+# name, file suffix, array typecode
+COLUMNS = [("id", ".id", "q"), ("time", ".time", "q"), ("temp", ".temp", "f"), ("rh", ".rh", "f")]
+INDEX_FILENAME = "index.json"
+TABLE_HEADER = "ID\tTimestamp\tTemperature\tRH" # of the text tables of SyncProbeDBs.py
+CONVERT_CHUNK_ROWS = 100000
+MERGE_SUFFIX = ".merge" # of the new column files of a day being merged into
+
+"""Return the partition (day, as YYYYMMDD) of a timestamp.
+
+    Arguments:
+    timestamp -- UNIX time
+"""
+def dayOf(timestamp):
+    return time.strftime("%Y%m%d", time.gmtime(timestamp))
+
+"""Columnar archive of a probe's readings. See the module docstring.
+
+    Arguments:
+    directory -- the archive directory; created if needed, unless readOnly
+    readOnly -- open without recovering or writing anything
+"""
+class ProbeColumnArchive(object):
+
+    def __init__(self, directory, readOnly=False):
+        self.directory = directory
+        self.readOnly = readOnly
+        if not readOnly:
+            os.makedirs(directory, exist_ok=True)
+        self.index = {"days": {}, "lastID": None, "lastTime": None}
+        indexFilepath = os.path.join(directory, INDEX_FILENAME)
+        if os.path.isfile(indexFilepath):
+            with open(indexFilepath) as f:
+                self.index = json.load(f)
+        if not readOnly:
+            self._recover()
+
+    def _columnFilepath(self, day, suffix):
+        return os.path.join(self.directory, day + suffix)
+
+    """Complete an interrupted merge (see merge), truncate column files to the
+    row counts of the index, and remove those of days not in the index."""
+    def _recover(self):
+        merging = [day for day, entry in self.index["days"].items() if entry.get("merging")]
+        for day in merging:
+            for name, suffix, typecode in COLUMNS:
+                filepath = self._columnFilepath(day, suffix)
+                if os.path.isfile(filepath + MERGE_SUFFIX):
+                    os.replace(filepath + MERGE_SUFFIX, filepath)
+            del self.index["days"][day]["merging"]
+        if len(merging) > 0:
+            self._writeIndex()
+        for day, entry in self.index["days"].items():
+            for name, suffix, typecode in COLUMNS:
+                filepath = self._columnFilepath(day, suffix)
+                size = entry["count"] * array(typecode).itemsize
+                if os.path.getsize(filepath) > size:
+                    with open(filepath, 'r+b') as f:
+                        f.truncate(size)
+        suffixes = [suffix for name, suffix, typecode in COLUMNS]
+        for filename in os.listdir(self.directory):
+            day, suffix = os.path.splitext(filename)
+            if suffix in (".tmp", MERGE_SUFFIX) or (suffix in suffixes and day not in self.index["days"]):
+                os.remove(os.path.join(self.directory, filename))
+
+    def _writeIndex(self):
+        indexFilepath = os.path.join(self.directory, INDEX_FILENAME)
+        tmpFilepath = indexFilepath + ".tmp"
+        with open(tmpFilepath, 'w') as f:
+            json.dump(self.index, f, sort_keys=True)
+        os.replace(tmpFilepath, indexFilepath)
+
+    """Return (ID, timestamp) of the latest reading, or None if the archive is
+    empty."""
+    def latest(self):
+        if self.index["lastID"] is None:
+            return None
+        return (self.index["lastID"], self.index["lastTime"])
+
+    """Return the days of the archive (YYYYMMDD), in order."""
+    def days(self):
+        return sorted(self.index["days"])
+
+    """Append readings. Readings already in the archive (by ID) are skipped.
+
+        Returns the number of readings appended.
+
+        Arguments:
+        rows -- (ID, timestamp, temperature, humidity) rows, in order of ID
+    """
+    def append(self, rows):
+        lastID = self.index["lastID"]
+        lastTime = self.index["lastTime"]
+        partitions = {}
+        for row in rows:
+            if lastID is not None and int(row[0]) <= lastID:
+                continue
+            lastID = int(row[0])
+            lastTime = int(row[1])
+            day = dayOf(lastTime)
+            if day not in partitions:
+                partitions[day] = [array(typecode) for name, suffix, typecode in COLUMNS]
+            columns = partitions[day]
+            columns[0].append(lastID)
+            columns[1].append(lastTime)
+            columns[2].append(float(row[2]))
+            columns[3].append(float(row[3]))
+        if len(partitions) == 0:
+            return 0
+        n = 0
+        for day, columns in partitions.items():
+            for (name, suffix, typecode), column in zip(COLUMNS, columns):
+                with open(self._columnFilepath(day, suffix), 'ab') as f:
+                    column.tofile(f)
+            entry = self.index["days"].get(day)
+            times = columns[1]
+            sortedTimes = all(times[i] <= times[i + 1] for i in range(0, len(times) - 1))
+            if entry is None:
+                entry = {"count": 0, "minTime": times[0], "maxTime": times[0], "minID": columns[0][0], "sorted": True}
+                self.index["days"][day] = entry
+            elif times[0] < entry["maxTime"]:
+                sortedTimes = False
+            entry["count"] += len(times)
+            entry["minTime"] = min(entry["minTime"], min(times))
+            entry["maxTime"] = max(entry["maxTime"], max(times))
+            entry["maxID"] = columns[0][-1]
+            entry["sorted"] = entry["sorted"] and sortedTimes
+            n += len(times)
+        self.index["lastID"] = lastID
+        self.index["lastTime"] = lastTime
+        self._writeIndex()
+        return n
+
+    """Insert readings missing from the archive (by ID) wherever their day is,
+    e.g. to fill gaps left by an interrupted sync. Readings already in the
+    archive are skipped.
+
+        Each day concerned is rewritten, in order of ID. Its new column files
+        are written beside the old ones, then the index is replaced with the new
+        counts and the day marked as merging, then the new files replace the
+        old ones and the mark is removed. A merge interrupted after the index
+        was replaced is completed on opening; one interrupted before is undone.
+
+        Returns the number of readings inserted.
+
+        Arguments:
+        rows -- (ID, timestamp, temperature, humidity) rows, in any order
+    """
+    def merge(self, rows):
+        partitions = {}
+        for row in rows:
+            record = (int(row[0]), int(row[1]), float(row[2]), float(row[3]))
+            partitions.setdefault(dayOf(record[1]), {})[record[0]] = record
+        merged = []
+        n = 0
+        for day in sorted(partitions):
+            records = partitions[day]
+            entry = self.index["days"].get(day)
+            if entry is not None:
+                columns = self.readDay(day)
+                new = len(set(records).difference(columns["id"]))
+                if new == 0:
+                    continue
+                records.update((row[0], row) for row in zip(columns["id"], columns["time"], columns["temp"], columns["rh"]))
+            else:
+                new = len(records)
+            columns = [array(typecode) for name, suffix, typecode in COLUMNS]
+            for id in sorted(records):
+                for column, value in zip(columns, records[id]):
+                    column.append(value)
+            for (name, suffix, typecode), column in zip(COLUMNS, columns):
+                with open(self._columnFilepath(day, suffix) + MERGE_SUFFIX, 'wb') as f:
+                    column.tofile(f)
+                    f.flush()
+                    os.fsync(f.fileno())
+            times = columns[1]
+            self.index["days"][day] = {
+                "count": len(times),
+                "minTime": min(times),
+                "maxTime": max(times),
+                "minID": columns[0][0],
+                "maxID": columns[0][-1],
+                "sorted": all(times[i] <= times[i + 1] for i in range(0, len(times) - 1)),
+                "merging": True
+            }
+            if self.index["lastID"] is None or columns[0][-1] > self.index["lastID"]:
+                self.index["lastID"] = columns[0][-1]
+                self.index["lastTime"] = times[-1]
+            merged.append(day)
+            n += new
+        if len(merged) == 0:
+            return 0
+        self._writeIndex()
+        for day in merged:
+            for name, suffix, typecode in COLUMNS:
+                os.replace(self._columnFilepath(day, suffix) + MERGE_SUFFIX, self._columnFilepath(day, suffix))
+            del self.index["days"][day]["merging"]
+        self._writeIndex()
+        return n
+
+    """Return the columns of a day, as a dict of arrays (see COLUMNS).
+
+        Arguments:
+        day -- YYYYMMDD
+    """
+    def readDay(self, day):
+        count = self.index["days"][day]["count"]
+        columns = {}
+        for name, suffix, typecode in COLUMNS:
+            column = array(typecode)
+            with open(self._columnFilepath(day, suffix), 'rb') as f:
+                column.fromfile(f, count)
+            columns[name] = column
+        return columns
+
+    """Return the days whose readings may fall within a time range, in order.
+
+        Arguments:
+        start -- first timestamp of the range, or None
+        end -- last timestamp of the range, or None
+    """
+    def daysInRange(self, start=None, end=None):
+        days = []
+        for day in self.days():
+            entry = self.index["days"][day]
+            if (start is None or entry["maxTime"] >= start) and (end is None or entry["minTime"] <= end):
+                days.append(day)
+        return days
+
+    """Generate the readings within a time range, as (ID, timestamp,
+    temperature, humidity), in order of day then ID.
+
+        Arguments:
+        start -- first timestamp of the range, or None
+        end -- last timestamp of the range, or None
+    """
+    def iterRows(self, start=None, end=None):
+        for day in self.daysInRange(start, end):
+            columns = self.readDay(day)
+            for row in zip(columns["id"], columns["time"], columns["temp"], columns["rh"]):
+                if (start is None or row[1] >= start) and (end is None or row[1] <= end):
+                    yield row
+
+    """Append the readings of a text table (see SyncProbeDBs.py) to the archive.
+
+        Returns the number of readings appended.
+
+        Arguments:
+        tablePath -- the text table
+    """
+    def importTable(self, tablePath):
+        n = 0
+        rows = []
+        with open(tablePath) as f:
+            for line in f:
+                vals = line.strip().split("\t")
+                if len(vals) < 4 or not vals[0].isdigit():
+                    continue # header, or blank line
+                rows.append(vals)
+                if len(rows) == CONVERT_CHUNK_ROWS:
+                    n += self.append(rows)
+                    rows = []
+        if len(rows) > 0:
+            n += self.append(rows)
+        return n
+
+    """Write the readings within a time range as a text table (see
+    SyncProbeDBs.py), replacing it atomically.
+
+        Returns the number of readings exported.
+
+        Arguments:
+        tablePath -- the text table to write
+        start -- first timestamp of the range, or None
+        end -- last timestamp of the range, or None
+    """
+    def exportTable(self, tablePath, start=None, end=None):
+        n = 0
+        tmpFilepath = tablePath + ".tmp"
+        with open(tmpFilepath, 'w') as out:
+            out.write(TABLE_HEADER + "\n")
+            for row in self.iterRows(start, end):
+                # float32 columns: print as the 2 decimals the Pi records
+                out.write(str(row[0]) + "\t" + str(row[1]) + "\t" + repr(round(row[2], 2)) + "\t" + repr(round(row[3], 2)) + "\n")
+                n += 1
+        os.replace(tmpFilepath, tablePath)
+        return n
+
+"""Executable"""
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Convert a probe's text table to a columnar archive, or export it back.")
+    parser.add_argument("command", choices=["convert", "export"])
+    parser.add_argument("source", help="text table to convert, or archive directory to export")
+    parser.add_argument("destination", help="archive directory to convert to, or text table to export to")
+    parser.add_argument("--start", type=int, help="first timestamp to export (UNIX time)")
+    parser.add_argument("--end", type=int, help="last timestamp to export (UNIX time)")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        archive = ProbeColumnArchive(args.destination)
+        print(str(archive.importTable(args.source)) + " readings converted")
+    else:
+        if not os.path.isfile(os.path.join(args.source, INDEX_FILENAME)):
+            sys.exit(args.source + " is not a columnar archive")
+        archive = ProbeColumnArchive(args.source, readOnly=True)
+        print(str(archive.exportTable(args.destination, args.start, args.end)) + " readings exported")
+
+    print("Done!")
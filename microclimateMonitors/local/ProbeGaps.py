@@ -0,0 +1,234 @@
+"""Find the gaps in the probes' columnar archives, and plan their backfill.
+
+Readings go missing in two ways:
+
+ID gaps -- holes in the ID sequence, e.g. from an interrupted sync or a local
+           table restored from an old copy. The readings may still be in the
+           Pi's MySQL table or local archive, and can be fetched again.
+time gaps -- holes in the sampling grid (a reading every 30 seconds), from power
+             cuts or failed sensor reads. The logger only numbers the readings
+             it takes, so these leave no hole in the IDs: there is nothing to
+             fetch, and they are only reported.
+
+Both are found with a vectorized difference (numpy) of the ID and timestamp
+columns of a whole archive (see ProbeColumnArchive.py). ID gaps are merged
+into as few ID ranges as is worth it: two gaps fewer than MERGE_DISTANCE IDs
+apart are fetched as one range, re-fetching the readings between them, which
+costs less than another query. A backfill thus transfers about the missing rows
+only, from the probe database (SyncProbeDBs.py --backfill), or from a text
+export of the Pi's archive (ProbeArchive.py export):
+
+    python3 ProbeGaps.py report rpithon2 rpithon5 --archive-path /data/microclimate -o coverage.tsv
+    python3 ProbeGaps.py backfill rpithon2 --source ProbeLog_rpithon2.tsv --archive-path /data/microclimate
+
+The report prints each probe's coverage and gaps, and writes its coverage per
+day: readings, readings expected (one per interval, from the probe's first to
+its last reading), IDs missing, and readings missing from time gaps other than
+ID gaps.
+"""
+
+"""Dependencies"""
+import argparse
+import bisect
+import os
+import numpy as np
+import ProbeColumnArchive
+import ProbeQuery
+
+SAMPLE_INTERVAL = 30 # seconds between readings on the Pis
+TIME_GAP_TOLERANCE = 1.5 # intervals between two readings beyond which readings are missing
+MERGE_DISTANCE = 100 # IDs between two gaps below which they are fetched as one range
+DAY = 86400
+
+"""Return the missing ID ranges of a probe, as an (n, 2) int64 array of first
+and last missing ID, in order. IDs start at 1 (0 is the null entry).
+
+    Arguments:
+    ids -- IDs of the probe's readings
+"""
+def idGaps(ids):
+    ids = np.unique(ids)
+    ids = ids[ids > 0]
+    if len(ids) == 0:
+        return np.empty((0, 2), dtype=np.int64)
+    ids = np.concatenate(([0], ids))
+    after = np.nonzero(np.diff(ids) > 1)[0]
+    return np.column_stack((ids[after] + 1, ids[after + 1] - 1)).astype(np.int64)
+
+"""Return the time gaps of a probe: (start, end, missing) arrays of the
+timestamps of the readings on either side of each gap, and the number of
+readings missing in it.
+
+    Arguments:
+    times -- timestamps of the probe's readings
+    ids -- their IDs, to leave out the gaps that are ID gaps too; or None
+    interval -- seconds between readings
+    tolerance -- intervals between two readings beyond which readings are missing
+"""
+def timeGaps(times, ids=None, interval=SAMPLE_INTERVAL, tolerance=TIME_GAP_TOLERANCE):
+    order = np.argsort(times, kind="stable")
+    times = times[order]
+    steps = np.diff(times)
+    isGap = steps > tolerance * interval
+    if ids is not None:
+        isGap &= np.diff(ids[order]) == 1
+    after = np.nonzero(isGap)[0]
+    missing = np.rint(steps[after] / interval).astype(np.int64) - 1
+    return (times[after], times[after + 1], missing)
+
+"""Return the coverage of a probe per UTC day, as a list of (day, readings,
+readings expected, IDs missing, readings missing from time gaps).
+
+    IDs missing are counted on the day of the reading before the gap, and time
+    gaps (other than ID gaps) on the day they start.
+
+    Arguments:
+    ids -- IDs of the probe's readings
+    times -- timestamps of the probe's readings
+    gaps -- missing ID ranges (see idGaps)
+    interval -- seconds between readings
+    tolerance -- intervals between two readings beyond which readings are missing
+"""
+def dayCoverage(ids, times, gaps, interval=SAMPLE_INTERVAL, tolerance=TIME_GAP_TOLERANCE):
+    if len(times) == 0:
+        return []
+    first, last = int(times.min()), int(times.max())
+    firstDay = first - first % DAY
+    nDays = (last - firstDay) // DAY + 1
+    dayStarts = firstDay + DAY * np.arange(nDays, dtype=np.int64)
+    readings = np.bincount((times - firstDay) // DAY, minlength=nDays)
+    spans = np.minimum(dayStarts + DAY, last + interval) - np.maximum(dayStarts, first)
+    expected = np.rint(spans / interval).astype(np.int64)
+    # the reading before each ID gap, found by ID
+    order = np.argsort(ids)
+    before = order[np.searchsorted(ids[order], gaps[:, 0] - 1).clip(0, len(ids) - 1)]
+    missingIDs = np.bincount((times[before] - firstDay) // DAY, weights=gaps[:, 1] - gaps[:, 0] + 1, minlength=nDays)
+    starts, ends, missing = timeGaps(times, ids, interval, tolerance)
+    missingReadings = np.bincount((starts - firstDay) // DAY, weights=missing, minlength=nDays)
+    coverage = []
+    for i in range(0, nDays):
+        day = ProbeColumnArchive.dayOf(int(dayStarts[i]))
+        coverage.append((day, int(readings[i]), int(expected[i]), int(missingIDs[i]), int(missingReadings[i])))
+    return coverage
+
+"""Merge ID gaps into the ranges to fetch, as a list of (first ID, last ID).
+
+    Gaps fewer than mergeDistance IDs apart are fetched as one range.
+
+    Arguments:
+    gaps -- missing ID ranges (see idGaps)
+    mergeDistance -- IDs between two gaps below which they are merged
+"""
+def planBackfill(gaps, mergeDistance=MERGE_DISTANCE):
+    if len(gaps) == 0:
+        return []
+    breaks = np.nonzero(gaps[1:, 0] - gaps[:-1, 1] - 1 >= mergeDistance)[0] + 1
+    firsts = gaps[np.concatenate(([0], breaks)), 0]
+    lasts = gaps[np.concatenate((breaks - 1, [len(gaps) - 1])), 1]
+    return list(zip(firsts.tolist(), lasts.tolist()))
+
+"""Return the gaps of a columnar archive: a dict of its "ids" and "times", the
+missing ID ranges ("idGaps") and the time gaps that are not ID gaps
+("timeGaps").
+
+    Arguments:
+    archive -- a ProbeColumnArchive
+    interval -- seconds between readings
+    tolerance -- intervals between two readings beyond which readings are missing
+"""
+def analyze(archive, interval=SAMPLE_INTERVAL, tolerance=TIME_GAP_TOLERANCE):
+    columns = ProbeQuery.readRange(archive, fields=["id"])
+    return {
+        "ids": columns["id"],
+        "times": columns["time"],
+        "idGaps": idGaps(columns["id"]),
+        "timeGaps": timeGaps(columns["time"], columns["id"], interval, tolerance)
+    }
+
+"""Return the ranges of a probe's archive to backfill (see planBackfill), and
+the number of IDs missing.
+
+    Arguments:
+    archive -- a ProbeColumnArchive
+    mergeDistance -- IDs between two gaps below which they are fetched as one range
+"""
+def backfillPlan(archive, mergeDistance=MERGE_DISTANCE):
+    gaps = idGaps(ProbeQuery.readRange(archive, fields=["id"])["id"])
+    return (planBackfill(gaps, mergeDistance), int((gaps[:, 1] - gaps[:, 0] + 1).sum()))
+
+"""Generate the readings of a text table (an export of the Pi's archive, or a
+local table) whose IDs are within the given ranges, as lists of strings.
+
+    Arguments:
+    tablePath -- the text table
+    ranges -- (first ID, last ID) ranges, in order
+"""
+def iterTableRanges(tablePath, ranges):
+    firsts = [first for first, last in ranges]
+    with open(tablePath) as f:
+        for line in f:
+            vals = line.strip().split("\t")
+            if len(vals) < 4 or not vals[0].isdigit():
+                continue # header, or blank line
+            id = int(vals[0])
+            i = bisect.bisect_right(firsts, id) - 1
+            if i >= 0 and id <= ranges[i][1]:
+                yield vals
+
+"""Print a probe's coverage and gaps, and return its coverage per day (see
+dayCoverage).
+
+    Arguments:
+    probe -- name of the probe
+    archive -- its ProbeColumnArchive
+    interval -- seconds between readings
+"""
+def reportProbe(probe, archive, interval=SAMPLE_INTERVAL):
+    gaps = analyze(archive, interval)
+    coverage = dayCoverage(gaps["ids"], gaps["times"], gaps["idGaps"], interval)
+    readings = sum(map(lambda x: x[1], coverage))
+    expected = sum(map(lambda x: x[2], coverage))
+    missingIDs = int((gaps["idGaps"][:, 1] - gaps["idGaps"][:, 0] + 1).sum())
+    starts, ends, missing = gaps["timeGaps"]
+    print(probe + ": " + str(readings) + " readings over " + str(len(coverage)) + " days, "
+          + ("%.1f" % (100.0 * readings / max(1, expected))) + "% of the expected " + str(expected))
+    print(probe + ": " + str(len(gaps["idGaps"])) + " ID gaps (" + str(missingIDs) + " IDs), backfilled in "
+          + str(len(planBackfill(gaps["idGaps"]))) + " ranges")
+    print(probe + ": " + str(len(starts)) + " time gaps (" + str(int(missing.sum())) + " readings)")
+    return coverage
+
+"""Executable"""
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Report the gaps of probe archives, or backfill them from a text export.")
+    parser.add_argument("command", choices=["report", "backfill"])
+    parser.add_argument("probes", nargs="+", help="probe names, or columnar archive directories")
+    parser.add_argument("--archive-path", default=".", help="directory holding the probe archives")
+    parser.add_argument("--interval", type=int, default=SAMPLE_INTERVAL, help="seconds between readings")
+    parser.add_argument("-o", "--output", help="table of the coverage per day to write (report)")
+    parser.add_argument("--source", help="text export of the Pi's archive to backfill from (backfill)")
+    args = parser.parse_args()
+
+    if args.command == "report":
+        rows = []
+        for probe in args.probes:
+            archive = ProbeColumnArchive.ProbeColumnArchive(ProbeQuery.archiveDirectory(probe, args.archive_path), readOnly=True)
+            for row in reportProbe(probe, archive, args.interval):
+                rows.append([probe] + list(row))
+        if args.output is not None:
+            tmpFilepath = args.output + ".tmp"
+            with open(tmpFilepath, 'w') as out:
+                out.write("probe\tday\treadings\texpected\tmissingIDs\tmissingReadings\n")
+                for row in rows:
+                    out.write("\t".join(map(str, row)) + "\n")
+            os.replace(tmpFilepath, args.output)
+    else:
+        if args.source is None or len(args.probes) != 1:
+            parser.error("backfill takes one probe and a --source")
+        archive = ProbeColumnArchive.ProbeColumnArchive(ProbeQuery.archiveDirectory(args.probes[0], args.archive_path))
+        ranges, missing = backfillPlan(archive)
+        print(args.probes[0] + ": " + str(missing) + " IDs missing, in " + str(len(ranges)) + " ranges")
+        if len(ranges) > 0:
+            print(str(archive.merge(iterTableRanges(args.source, ranges))) + " readings backfilled")
+
+    print("Done!")
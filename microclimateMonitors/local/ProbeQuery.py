@@ -0,0 +1,212 @@
+"""Query the columnar microclimate archives by time range, and align probes on
+a common time grid.
+
+    query(["rpithon2", "rpithon5", "rpithon7"], start, end, ["temp", "rh"], resample=300)
+
+returns the 5-minute grid and a (probe, field, bin) array of the mean of the
+readings in each bin (NaN where a probe has no reading). Without resample, it
+returns each probe's readings in the range, as they were recorded.
+
+Probes are read from their columnar archives (see ProbeColumnArchive.py),
+named probe<unit>_<name> in the archive path, as SyncProbeDBs.py creates them.
+Only the days whose index range overlaps the query are opened. Within a day
+whose timestamps are sorted, the bounds of the range are found by binary search
+of the timestamp column, and only that slice of the other columns is read.
+Binning is done with numpy (bincount, or ufunc.at for min and max).
+
+    python3 ProbeQuery.py rpithon2 rpithon5 --start 2017-06-01 --end 2017-09-01 --resample 300 -o aligned.tsv
+"""
+
+"""Dependencies"""
+import argparse
+import calendar
+import glob
+import os
+import time
+import numpy as np
+import ProbeColumnArchive
+
+FIELDS = ["temp", "rh"]
+# dtypes of the column files (see ProbeColumnArchive.COLUMNS)
+DTYPES = {"id": np.dtype("<i8"), "time": np.dtype("<i8"), "temp": np.dtype("<f4"), "rh": np.dtype("<f4")}
+AGGREGATES = ["mean", "min", "max"]
+
+"""Return the columnar archive directory of a probe.
+
+    Arguments:
+    probe -- a probe name (e.g. "rpithon2"), or an archive directory
+    archivePath -- directory holding the archives of all probes
+"""
+def archiveDirectory(probe, archivePath):
+    if os.path.isfile(os.path.join(probe, ProbeColumnArchive.INDEX_FILENAME)):
+        return probe
+    matches = glob.glob(os.path.join(archivePath, "probe*_" + probe, ProbeColumnArchive.INDEX_FILENAME))
+    if len(matches) != 1:
+        raise ValueError("no single columnar archive for " + probe + " in " + archivePath)
+    return os.path.dirname(matches[0])
+
+"""Read a slice of a column file.
+
+    Arguments:
+    filepath -- the column file
+    dtype -- dtype of the column
+    first -- first row
+    count -- number of rows
+"""
+def _readColumn(filepath, dtype, first, count):
+    return np.fromfile(filepath, dtype=dtype, count=count, offset=first * dtype.itemsize)
+
+"""Return one probe's readings within a time range, as a dict of arrays:
+"time" and the fields requested.
+
+    Arguments:
+    archive -- a ProbeColumnArchive
+    start -- first timestamp (UNIX time), or None
+    end -- last timestamp (UNIX time), or None
+    fields -- columns to read besides the time, e.g. ["temp", "rh"]
+"""
+def readRange(archive, start=None, end=None, fields=FIELDS):
+    parts = dict((name, []) for name in ["time"] + fields)
+    for day in archive.daysInRange(start, end):
+        entry = archive.index["days"][day]
+        count = entry["count"]
+        timeFilepath = archive._columnFilepath(day, ".time")
+        times = _readColumn(timeFilepath, DTYPES["time"], 0, count)
+        if entry["sorted"]:
+            first = 0 if start is None else int(np.searchsorted(times, start, side="left"))
+            last = count if end is None else int(np.searchsorted(times, end, side="right"))
+            parts["time"].append(times[first:last])
+            for name in fields:
+                parts[name].append(_readColumn(archive._columnFilepath(day, "." + name), DTYPES[name], first, last - first))
+        else:
+            mask = np.ones(count, dtype=bool)
+            if start is not None:
+                mask &= times >= start
+            if end is not None:
+                mask &= times <= end
+            parts["time"].append(times[mask])
+            for name in fields:
+                parts[name].append(_readColumn(archive._columnFilepath(day, "." + name), DTYPES[name], 0, count)[mask])
+    result = {}
+    for name, arrays in parts.items():
+        result[name] = np.concatenate(arrays) if len(arrays) > 0 else np.empty(0, dtype=DTYPES[name])
+    return result
+
+"""Aggregate values into the bins of a regular time grid.
+
+    Returns a float64 array with one value per bin, NaN for empty bins.
+
+    Arguments:
+    times -- timestamps of the values
+    values -- the values
+    gridStart -- start of the first bin
+    step -- bin width, in seconds
+    nBins -- number of bins
+    aggregate -- "mean", "min" or "max"
+"""
+def binValues(times, values, gridStart, step, nBins, aggregate="mean"):
+    bins = (times - gridStart) // step
+    keep = (bins >= 0) & (bins < nBins) & ~np.isnan(values)
+    bins = bins[keep]
+    values = values[keep].astype(np.float64)
+    counts = np.bincount(bins, minlength=nBins)
+    if aggregate == "mean":
+        sums = np.bincount(bins, weights=values, minlength=nBins)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out = sums / counts
+    elif aggregate == "min":
+        out = np.full(nBins, np.inf)
+        np.minimum.at(out, bins, values)
+    elif aggregate == "max":
+        out = np.full(nBins, -np.inf)
+        np.maximum.at(out, bins, values)
+    else:
+        raise ValueError("unknown aggregate " + aggregate)
+    out[counts == 0] = np.nan
+    return out
+
+"""Query probes' readings within a time range, optionally aligned on a grid.
+
+    Without resample, returns a dict from probe to its readings (see
+    readRange). With resample, returns (grid, values): the start of each bin
+    (int64 UNIX times, from start rounded down to a multiple of resample, to
+    end), and a float64 array of shape (probes, fields, bins).
+
+    Arguments:
+    probes -- probe names or archive directories (see archiveDirectory)
+    start -- first timestamp (UNIX time)
+    end -- last timestamp (UNIX time)
+    fields -- fields to return, among "temp" and "rh"
+    resample -- bin width in seconds, or None for the raw readings
+    aggregate -- how readings in a bin are combined: "mean", "min" or "max"
+    archivePath -- directory holding the archives of all probes
+"""
+def query(probes, start, end, fields=FIELDS, resample=None, aggregate="mean", archivePath="."):
+    for name in fields:
+        if name not in FIELDS:
+            raise ValueError("unknown field " + name)
+    readings = {}
+    for probe in probes:
+        archive = ProbeColumnArchive.ProbeColumnArchive(archiveDirectory(probe, archivePath), readOnly=True)
+        readings[probe] = readRange(archive, start, end, fields)
+    if resample is None:
+        return readings
+    gridStart = start - start % resample
+    grid = np.arange(gridStart, end + 1, resample, dtype=np.int64)
+    values = np.empty((len(probes), len(fields), len(grid)))
+    for p in range(0, len(probes)):
+        columns = readings[probes[p]]
+        for f in range(0, len(fields)):
+            values[p, f] = binValues(columns["time"], columns[fields[f]], gridStart, resample, len(grid), aggregate)
+    return (grid, values)
+
+"""Write aligned readings as a tab-separated table: the bin start, then one
+column per probe and field (e.g. rpithon2_temp), NA for empty bins.
+
+    Arguments:
+    filepath -- the table to write
+    grid -- bin starts, as returned by query()
+    values -- (probes, fields, bins) array, as returned by query()
+    probes -- probe names, in the order of values
+    fields -- field names, in the order of values
+"""
+def writeAlignedTable(filepath, grid, values, probes, fields):
+    flat = values.reshape(-1, len(grid)).T
+    labels = np.char.mod("%.2f", flat)
+    labels[np.isnan(flat)] = "NA"
+    with open(filepath, 'w') as out:
+        out.write("time\t" + "\t".join(probe + "_" + field for probe in probes for field in fields) + "\n")
+        for i in range(0, len(grid)):
+            out.write(str(grid[i]) + "\t" + "\t".join(labels[i]) + "\n")
+
+"""Return a UNIX time from a command-line date: UNIX time, or YYYY-MM-DD
+(midnight UTC).
+
+    Arguments:
+    value -- the command-line argument
+"""
+def parseTime(value):
+    if value.isdigit():
+        return int(value)
+    return calendar.timegm(time.strptime(value, "%Y-%m-%d"))
+
+"""Executable"""
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Query probes over a time range and align them on a time grid.")
+    parser.add_argument("probes", nargs="+", help="probe names, or columnar archive directories")
+    parser.add_argument("--start", required=True, type=parseTime, help="UNIX time or YYYY-MM-DD (UTC)")
+    parser.add_argument("--end", required=True, type=parseTime, help="UNIX time or YYYY-MM-DD (UTC)")
+    parser.add_argument("--fields", nargs="+", default=FIELDS, choices=FIELDS)
+    parser.add_argument("--resample", type=int, default=300, help="bin width in seconds")
+    parser.add_argument("--aggregate", default="mean", choices=AGGREGATES)
+    parser.add_argument("--archive-path", default=".", help="directory holding the probe archives")
+    parser.add_argument("-o", "--output", required=True, help="table to write")
+    args = parser.parse_args()
+
+    started = time.time()
+    grid, values = query(args.probes, args.start, args.end, args.fields, args.resample, args.aggregate, args.archive_path)
+    print(str(len(args.probes)) + " probes x " + str(len(grid)) + " bins in " + ("%.3f" % (time.time() - started)) + " s")
+    writeAlignedTable(args.output, grid, values, args.probes, args.fields)
+
+    print("Done!")
@@ -11,6 +11,45 @@ ensure this is set up properly.
 
 Also assumes the table always has at least the null first entry (with ID = 0).
 
+All probes are synced concurrently, each on its own thread, with connect and
+read timeouts on its database connection, so an unreachable Pi only delays its
+own sync. A per-probe summary (rows, bytes written, duration, error) is logged
+at the end.
+
+New entries are streamed from the probe database with an unbuffered cursor,
+and appended to the local table chunk by chunk as they arrive, so memory use
+does not depend on how many entries there are to sync.
+
+The ID to sync from is kept in a small state file next to each local table
+(<table>.state: last ID, last timestamp, byte length of the table and a
+checksum of its end), replaced atomically after each successful write. If the
+state file is missing, or does not match the table (e.g. the table was edited
+or restored), the last entry is read from the end of the table instead. Either
+way, a sync costs time proportional to the new entries, not to the history.
+
+The auth file is parsed once, and each probe's connection is kept and reused
+(checked with a ping first) by a ProbeRegistry. Besides a one-shot run (e.g.
+from cron), the script can run as a daemon that keeps syncing every probe every
+few seconds, so new readings land locally within seconds:
+
+    python3 SyncProbeDBs.py --daemon --interval 30
+
+Probes can instead be synced to columnar, day-partitioned archives (see
+ProbeColumnArchive.py), set in the configuration section below; a probe's text
+table is converted the first time. The entries missing from the middle of the
+columnar archives, which a sync from the latest ID never fetches, are found and
+fetched by ID range (see ProbeGaps.py) with:
+
+    python3 SyncProbeDBs.py --backfill
+
+Probes whose logger runs its HTTP server (ProbeLogger.py's httpPort option) can
+instead hand out their new entries as compressed, checksummed bundles of up to
+BUNDLE_ROWS entries, read from the Pi's local archive, set in the
+configuration section below. A few bundles replace the row-by-row transfer of
+a MySQL session, which matters on the Pis' weak links. Each bundle's checksum is
+verified before its entries are written; if the probe serves no bundles, the
+sync falls back to MySQL.
+
 VERSION: this version is intended to run on the GoreLab server, and is dependent
 on other code on the server to identify the appropriate path in the filesystem
 for the table for each unit.
@@ -20,14 +59,30 @@ Last modified:  May 30, 2017
 """
 
 """Dependencies"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import sys
 import os
 import time
 import datetime
+import json
 import pymysql
+import pymysql.cursors
+import ProbeColumnArchive
+import queue
+import random
+import signal
+import threading
+import urllib.request
+import zlib
+import importlib.util
 from importlib.machinery import SourceFileLoader
 Common = SourceFileLoader("Common","../../../pipeline/Common.py").load_module()
+# the Pi's archive module, for the bundle format shared with ProbeServer.py
+spec = importlib.util.spec_from_file_location("ProbeArchive", os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "pi", "ProbeArchive.py"))
+ProbeArchive = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(ProbeArchive)
 
 """"Set up logger routing to console and to file"""
 logger = logging.getLogger(__name__)
@@ -35,6 +90,20 @@ logger.setLevel(logging.DEBUG)
 logger.addHandler(logging.StreamHandler())
 logger.addHandler(logging.FileHandler('SyncProbeDBs.log', mode='w'))
 
+AUTH_CONF_FILENAME = "ProbeDB_auth.conf"
+CONNECT_TIMEOUT = 10 # seconds to connect to a probe database
+READ_TIMEOUT = 120 # seconds to wait on any one read from a probe database
+DAEMON_INTERVAL = 30 # seconds between syncs of a probe, in daemon mode
+DAEMON_JITTER = 0.2 # fraction of the interval by which the delay varies
+DAEMON_MAX_DELAY = 600 # seconds between syncs of a probe that keeps failing
+FETCH_CHUNK_ROWS = 5000 # rows fetched at a time from a probe database
+WRITE_QUEUE_CHUNKS = 4 # chunks fetched ahead of the writes to a local table
+WRITE_BUFFER_BYTES = 1 << 20
+PROBE_COLUMNS = ["ID", "Time", "Temperature", "Humidity"] # of the probe tables, in the local table order
+BACKFILL_RANGES_PER_QUERY = 100 # ID ranges fetched by one query when backfilling
+BUNDLE_ROWS = 50000 # entries per bundle fetched from a probe; at most ProbeServer.BUNDLE_MAX_ROWS
+TAIL_BLOCK = 4096 # bytes read at a time from the end of a table; also the bytes checksummed
+
 """Return a table object read from the given input file.
 
     Arguments:
@@ -106,117 +175,732 @@ def writeTableToFile(table, filename, header=None, delim="\t", pad=True, mode='w
 
     out.close()
 
+"""Parse the db auth file into a dict from probe name to its connection info:
+(unitNumber, host, user, password, databaseName, tableName), in file order.
+
+    Arguments:
+    dbAuthFilename -- the db auth file
+"""
+def parseAuthConf(dbAuthFilename=AUTH_CONF_FILENAME):
+    dbAuthFile = open(dbAuthFilename)
+    lines = list(map(lambda x: x.strip(), dbAuthFile.readlines()))
+    dbAuthFile.close()
+    confs = {}
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if line == "" or line[0] == "#":
+            i += 1
+            continue
+        # a block of 7 lines: probe name, then its connection info
+        probeName = line.split(" ")[2]
+        unitNumber = lines[i+1].split(" ")[2]
+        host = lines[i+2].split(" ")[2]
+        user = lines[i+3].split(" ")[2]
+        pwd = lines[i+4].split(" ")[2]
+        db = lines[i+5].split(" ")[2]
+        table = lines[i+6].split(" ")[2]
+        confs[probeName] = (unitNumber, host, user, pwd, db, table)
+        i += 7
+    return confs
+
+"""Connect to a probe database. Returns the connection, or None if the
+database cannot be reached.
+
+    Arguments:
+    probeName -- e.g. 'probe1', 'probe2', etc. 
+    conf -- connection info of the probe (see parseAuthConf)
+    connectTimeout -- seconds to wait for the connection
+    readTimeout -- seconds to wait on any one read
+"""
+def _connect(probeName, conf, connectTimeout, readTimeout):
+    
+    unitNumber, host, user, pwd, db, table = conf
+    
+    try:
+        return pymysql.connect(host=host, user=user, passwd=pwd, db=db,
+                               connect_timeout=connectTimeout, read_timeout=readTimeout, write_timeout=readTimeout)
+    except Exception as e:
+        logger.debug(probeName + ":\tDatabase connection test failed")
+        logger.debug(probeName + ":\tDetails:")
+        logger.debug(probeName + ":\t" + str(e))
+        return None
+
+"""The probes of the db auth file, and a reusable connection to each probe
+database.
+
+    The auth file is parsed once, and again only if it changes. A connection is
+    checked out with connection() and handed back with release(); it is
+    checked with a ping before being reused, and replaced if the ping fails.
+
+    Arguments:
+    dbAuthFilename -- the db auth file
+    connectTimeout -- seconds to wait for a connection
+    readTimeout -- seconds to wait on any one read
+    bundlePort -- port of the probes' HTTP servers to fetch bundles from, or
+                  None to only use MySQL
+"""
+class ProbeRegistry(object):
+    
+    def __init__(self, dbAuthFilename=AUTH_CONF_FILENAME, connectTimeout=CONNECT_TIMEOUT, readTimeout=READ_TIMEOUT, bundlePort=None):
+        self.dbAuthFilename = dbAuthFilename
+        self.connectTimeout = connectTimeout
+        self.readTimeout = readTimeout
+        self.bundlePort = bundlePort
+        self._confs = None
+        self._confMtime = None
+        self._connections = {}
+        self._lock = threading.Lock()
+    
+    def _loadConfs(self):
+        with self._lock:
+            mtime = os.path.getmtime(self.dbAuthFilename)
+            if self._confs is None or mtime != self._confMtime:
+                self._confs = parseAuthConf(self.dbAuthFilename)
+                self._confMtime = mtime
+            return self._confs
+    
+    """Return the names of the probes, in file order."""
+    def probes(self):
+        return list(self._loadConfs())
+    
+    """Return the connection info of a probe (see parseAuthConf), or None if it
+    is not in the auth file.
+    
+        Arguments:
+        probeName -- e.g. 'probe1', 'probe2', etc.
+    """
+    def conf(self, probeName):
+        conf = self._loadConfs().get(probeName)
+        if conf is None:
+            logger.debug("WARNING: " + probeName + " not found")
+        return conf
+    
+    """Return the URL of a probe's bundles (see ProbeServer.py), or None if
+    bundles are not used.
+    
+        Arguments:
+        probeName -- e.g. 'probe1', 'probe2', etc.
+    """
+    def bundleURL(self, probeName):
+        conf = self.conf(probeName)
+        if self.bundlePort is None or conf is None:
+            return None
+        return "http://" + conf[1] + ":" + str(self.bundlePort) + "/bundle?table=" + conf[5]
+    
+    """Check out a working connection to a probe database, reusing the last
+    one if it still answers. Returns None if the database cannot be reached.
+    
+        Arguments:
+        probeName -- e.g. 'probe1', 'probe2', etc.
+    """
+    def connection(self, probeName):
+        with self._lock:
+            dbConn = self._connections.pop(probeName, None)
+        if dbConn is not None:
+            try:
+                dbConn.ping(reconnect=False)
+                return dbConn
+            except Exception:
+                logger.debug(probeName + ":\tConnection lost; reconnecting")
+                self._close(dbConn)
+        conf = self.conf(probeName)
+        if conf is None:
+            return None
+        return _connect(probeName, conf, self.connectTimeout, self.readTimeout)
+    
+    """Hand back a connection checked out with connection().
+    
+        Arguments:
+        probeName -- e.g. 'probe1', 'probe2', etc.
+        dbConn -- the connection
+        broken -- close the connection instead (e.g. after an error mid-query)
+    """
+    def release(self, probeName, dbConn, broken=False):
+        if not broken:
+            with self._lock:
+                dbConn, self._connections[probeName] = self._connections.get(probeName), dbConn
+        if dbConn is not None:
+            self._close(dbConn)
+    
+    def _close(self, dbConn):
+        try:
+            dbConn.close()
+        except Exception:
+            pass # already closed, or the connection died
+    
+    """Close all connections."""
+    def close(self):
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections = {}
+        for dbConn in connections:
+            self._close(dbConn)
+
+# for the functions called without a registry
+defaultRegistry = ProbeRegistry()
+
 """Read db auth file and return connection info for the given named probe. 
 
     It is assumed that the db auth file is located in the same directory as this
-    script. Returns: (host, user, password, databaseName, tableName)
+    script. Returns: (unitNumber, host, user, password, databaseName, tableName)
 
     Arguments:
     probeName -- e.g. 'probe1', 'probe2', etc.
 """
 def _loadAuthConf(probeName):
-    dbAuthFilename = "ProbeDB_auth.conf"
-    dbAuthFile = open(dbAuthFilename)
-    lines = list(map(lambda x: x.strip(), dbAuthFile.readlines()))
-    for i in range(0, len(lines)):
-        line = lines[i]
-        if line == "": continue
-        if line[0] == "#": continue
-        if line.split(" ")[2] == probeName:
-            unitNumber = lines[i+1].split(" ")[2]
-            host = lines[i+2].split(" ")[2]
-            user = lines[i+3].split(" ")[2]
-            pwd = lines[i+4].split(" ")[2]
-            db = lines[i+5].split(" ")[2]
-            table = lines[i+6].split(" ")[2]
-            return (unitNumber, host, user, pwd, db, table)
-    logger.debug("WARNING: " + probeName + " not found")
-    return None
+    return defaultRegistry.conf(probeName)
+
+"""Connect to a given probe database. Returns (connection, table name), or
+None if the database cannot be reached.
+
+    Arguments:
+    probeName -- e.g. 'probe1', 'probe2', etc. 
+    connectTimeout -- seconds to wait for the connection
+    readTimeout -- seconds to wait on any one read
+"""
+def connectProbeDB(probeName, connectTimeout=CONNECT_TIMEOUT, readTimeout=READ_TIMEOUT):
+    conf = _loadAuthConf(probeName)
+    dbConn = _connect(probeName, conf, connectTimeout, readTimeout)
+    if dbConn is None:
+        return None
+    return (dbConn, conf[5])
+
+"""Generate the entries of a probe table newer than the given ID, in chunks
+(lists of row tuples), in order of ID.
+
+    Rows are streamed from the server with an unbuffered cursor, so only one
+    chunk is held in memory at a time. No other query can run on the connection
+    until the generator is exhausted.
+
+    Arguments:
+    dbConn -- a pymysql connection to the probe database
+    table -- name of the probe table
+    mostRecentID -- the ID of the latest entry already synced
+    chunkRows -- rows per chunk
+"""
+def iterNewData(dbConn, table, mostRecentID, chunkRows=FETCH_CHUNK_ROWS):
+    cursor = dbConn.cursor(pymysql.cursors.SSCursor)
+    try:
+        cursor.execute("SELECT " + ", ".join(PROBE_COLUMNS) + " FROM " + table + " WHERE ID > %s ORDER BY ID", (mostRecentID,))
+        while True:
+            rows = cursor.fetchmany(chunkRows)
+            if len(rows) == 0:
+                break
+            yield rows
+    finally:
+        cursor.close()
+
+"""Generate the entries of a probe table within ID ranges, in chunks, as
+iterNewData does, with one query per BACKFILL_RANGES_PER_QUERY ranges.
+
+    Arguments:
+    dbConn -- a pymysql connection to the probe database
+    table -- name of the probe table
+    ranges -- (first ID, last ID) ranges, in order
+    chunkRows -- rows per chunk
+"""
+def iterRangeData(dbConn, table, ranges, chunkRows=FETCH_CHUNK_ROWS):
+    for i in range(0, len(ranges), BACKFILL_RANGES_PER_QUERY):
+        batch = ranges[i:i + BACKFILL_RANGES_PER_QUERY]
+        cursor = dbConn.cursor(pymysql.cursors.SSCursor)
+        try:
+            cursor.execute("SELECT " + ", ".join(PROBE_COLUMNS) + " FROM " + table + " WHERE "
+                           + " OR ".join(["ID BETWEEN %s AND %s"] * len(batch)) + " ORDER BY ID",
+                           [id for idRange in batch for id in idRange])
+            while True:
+                rows = cursor.fetchmany(chunkRows)
+                if len(rows) == 0:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+
+"""Fetch the bundle of a probe's entries after an ID, and return its entries
+(see ProbeArchive.unpackBundle, on the Pi). Raises OSError if it cannot be
+fetched, ValueError if it is corrupted.
+
+    Arguments:
+    url -- URL of the probe's bundles (see ProbeRegistry.bundleURL)
+    afterID -- the ID of the latest entry already synced
+    timeout -- seconds to wait on the connection and any one read
+    limit -- maximum number of entries
+"""
+def fetchBundle(url, afterID, timeout=READ_TIMEOUT, limit=BUNDLE_ROWS):
+    with urllib.request.urlopen(url + "&after=" + str(afterID) + "&limit=" + str(limit), timeout=timeout) as response:
+        return ProbeArchive.unpackBundle(response.read())
+
+"""Generate a probe's new entries, one verified bundle at a time, until a
+bundle comes back short.
+
+    Arguments:
+    url -- URL of the probe's bundles (see ProbeRegistry.bundleURL)
+    afterID -- the ID of the latest entry already synced
+    timeout -- seconds to wait on the connection and any one read
+    rows -- entries of the first bundle, if already fetched
+"""
+def iterBundles(url, afterID, timeout=READ_TIMEOUT, rows=None):
+    while True:
+        if rows is None:
+            rows = fetchBundle(url, afterID, timeout)
+        if len(rows) > 0:
+            yield rows
+        if len(rows) < BUNDLE_ROWS:
+            return
+        afterID = rows[-1][0]
+        rows = None
 
 """Query a given probe database for new entries and return as an ordered table.
 
     "New" entries are determined by ID number. Order is by ID. Recall script
-    invariant.
+    invariant. Returns None if the database cannot be reached.
     
     Arguments:
     probeName -- e.g. 'probe1', 'probe2', etc. 
+    mostRecentID -- the ID of the latest entry already synced
+    connectTimeout -- seconds to wait for the connection
+    readTimeout -- seconds to wait on any one read
 """
-def queryNewData(probeName, mostRecentID):
-    
-    unitNumber, host, user, pwd, db, table = _loadAuthConf(probeName)
+def queryNewData(probeName, mostRecentID, connectTimeout=CONNECT_TIMEOUT, readTimeout=READ_TIMEOUT):
     
-    try:
-        dbConn = pymysql.connect(host=host, user=user, passwd=pwd, db=db)
-        cursor = dbConn.cursor()
-    except Exception as e:
-        logger.debug("Database connection test failed")
-        logger.debug("Details:")
-        logger.debug(str(e))
+    conn = connectProbeDB(probeName, connectTimeout, readTimeout)
+    if conn is None:
         return None
-    
-    query = ("SELECT * FROM " + table + " WHERE ID > " + str(mostRecentID))
+    dbConn, table = conn
     res = []
+    try:
+        for rows in iterNewData(dbConn, table, mostRecentID):
+            res.extend(map(list, rows))
+    finally:
+        dbConn.close()
+    return res
+
+"""Append chunks of entries to a local table as they arrive.
+
+    Chunks are formatted and written by a separate thread, through a small
+    queue, so the disk writes overlap the transfer of the next chunks. The
+    sync state (see writeSyncState) is updated after each chunk written, so an
+    interrupted sync keeps what it wrote. Returns the number of entries
+    written. The table is only created once there is an entry to write.
+
+    Arguments:
+    chunks -- iterable of lists of entries (e.g. iterNewData())
+    tablePath -- filepath to the local table
+    header -- header line to write first if the table is created, or None
+"""
+def appendChunks(chunks, tablePath, header=None):
+    out = []
     
-    cursor.execute(query)
-    for row in cursor:
-        res.append([row[0],row[1],row[2], row[3]])
+    def writeChunk(rows):
+        if len(out) == 0:
+            isNew = not os.path.exists(tablePath)
+            out.append(open(tablePath, 'a', buffering=WRITE_BUFFER_BYTES))
+            if isNew and header is not None:
+                out[0].write(header + "\n")
+        out[0].write("".join(map(lambda row: "\t".join(map(str, row)) + "\n", rows)))
+        out[0].flush()
+        writeSyncState(tablePath, rows[-1])
+        return len(rows)
     
-    return res
+    try:
+        return writeInBackground(chunks, writeChunk, tablePath)
+    finally:
+        if len(out) > 0:
+            out[0].close()
+
+"""Hand chunks of entries to a write function on a separate thread, through a
+small queue, so the writes overlap the production of the next chunks.
+
+    Returns the sum of what the write function returns. An exception raised
+    by the write function stops the writes and is raised again here.
+
+    Arguments:
+    chunks -- iterable of lists of entries
+    writeChunk -- function writing a chunk, returning the number of entries written
+    name -- name of the writer thread
+"""
+def writeInBackground(chunks, writeChunk, name):
+    chunkQueue = queue.Queue(maxsize=WRITE_QUEUE_CHUNKS)
+    result = {"rows": 0, "error": None}
+    
+    def writeChunks():
+        try:
+            while True:
+                rows = chunkQueue.get()
+                if rows is None:
+                    break
+                result["rows"] += writeChunk(rows)
+        except Exception as e:
+            result["error"] = e
+            while chunkQueue.get() is not None: # let the producing side finish
+                pass
+    
+    writer = threading.Thread(target=writeChunks, name="writeInBackground " + name)
+    writer.start()
+    try:
+        for rows in chunks:
+            if result["error"] is not None:
+                break
+            chunkQueue.put(rows)
+    finally:
+        chunkQueue.put(None)
+        writer.join()
+    if result["error"] is not None:
+        raise result["error"]
+    return result["rows"]
+
+"""Return the path of the local table of a probe.
+
+    Arguments:
+    probeName -- e.g. 'probe1', 'probe2', etc.
+    localArchivePath -- path to the directory in which the local tables are (to be) stored 
+    registry -- the ProbeRegistry the probe is in; defaults to defaultRegistry
+"""
+def localTablePath(probeName, localArchivePath, registry=None):
+    conf = (defaultRegistry if registry is None else registry).conf(probeName)
+    if conf is None:
+        raise ValueError(probeName + " not found in ProbeDB_auth.conf")
+    unitNumber = conf[0]
+    return localArchivePath + os.sep + "probe" + unitNumber + "_" + probeName + ".csv"
+
+"""Return the last entry of a local table (as a list of strings), reading only
+the end of the file, or None if it holds no entries.
+
+    Arguments:
+    tablePath -- filepath to the local table
+"""
+def readLastEntry(tablePath):
+    with open(tablePath, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        data = b""
+        lines = [b""]
+        while pos > 0:
+            readSize = min(TAIL_BLOCK, pos)
+            pos -= readSize
+            f.seek(pos)
+            data = f.read(readSize) + data
+            lines = data.rstrip(b"\r\n").split(b"\n")
+            if len(lines) > 1 or pos == 0:
+                break
+    lastLine = lines[-1].decode().strip()
+    if not lastLine.split("\t")[0].isdigit():
+        return None # empty, or header only
+    return lastLine.split("\t")
+
+"""Return the checksum of the last TAIL_BLOCK bytes of a file.
+
+    Arguments:
+    filepath -- the file
+    size -- size of the file
+"""
+def _tailChecksum(filepath, size):
+    with open(filepath, 'rb') as f:
+        f.seek(max(0, size - TAIL_BLOCK))
+        return zlib.crc32(f.read(TAIL_BLOCK))
+
+"""Return the sync state of a local table as a dict (lastID, lastTimestamp,
+bytes, tailCRC), or None if there is no state file or it does not match the
+table.
+
+    Arguments:
+    tablePath -- filepath to the local table
+"""
+def readSyncState(tablePath):
+    try:
+        with open(tablePath + ".state") as f:
+            state = json.load(f)
+        size = os.path.getsize(tablePath)
+        if state["bytes"] != size or state["tailCRC"] != _tailChecksum(tablePath, size):
+            logger.debug(tablePath + ": state file is stale")
+            return None
+        return state
+    except (IOError, ValueError, KeyError):
+        return None
+
+"""Replace the sync state of a local table.
+
+    Arguments:
+    tablePath -- filepath to the local table
+    lastEntry -- the last entry of the table
+"""
+def writeSyncState(tablePath, lastEntry):
+    size = os.path.getsize(tablePath)
+    state = {"lastID": int(lastEntry[0]), "lastTimestamp": int(lastEntry[1]),
+             "bytes": size, "tailCRC": _tailChecksum(tablePath, size)}
+    tmpFilepath = tablePath + ".state.tmp"
+    with open(tmpFilepath, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmpFilepath, tablePath + ".state")
+
+"""Return the ID of the latest entry of a local table, from its state file, or
+from the end of the table if the state file is missing or stale.
+
+    Arguments:
+    tablePath -- filepath to the local table
+"""
+def readMostRecentID(tablePath):
+    state = readSyncState(tablePath)
+    if state is not None:
+        return state["lastID"]
+    lastEntry = readLastEntry(tablePath)
+    if lastEntry is None:
+        return 0
+    writeSyncState(tablePath, lastEntry)
+    return int(lastEntry[0])
 
 """Sync the local database for a probe with all new entries from the remote one.
 
+    Returns the number of entries synced, or None if the database could not be
+    reached.
+
     Arguments:
     probeName -- e.g. 'probe1', 'probe2', etc.
     localArchivePath -- path to the directory in which the local tables are (to be) stored 
+    columnar -- sync to a columnar archive (see ProbeColumnArchive.py), next to
+                where the text table would be, instead of the text table; an
+                existing text table is converted first
+    registry -- ProbeRegistry to take the probe's connection from; by default,
+                a connection is opened for this sync only
 """
-def update(probeName, localArchivePath):
+def update(probeName, localArchivePath, columnar=False, registry=None):
+    
+    if registry is None:
+        registry = ProbeRegistry()
+        try:
+            return update(probeName, localArchivePath, columnar, registry)
+        finally:
+            registry.close()
     
     logger.debug("Initiating update for " + probeName + "...")
     
-    unitNumber, host, user, pwd, db, table = _loadAuthConf(probeName)
+    localArchivePath = localTablePath(probeName, localArchivePath, registry)
     
-    localArchivePath = localArchivePath + os.sep + "probe" + unitNumber + "_" + probeName + ".csv"
+    columnArchive = None
+    mostRecentID = 0
+    if columnar:
+        columnArchivePath = os.path.splitext(localArchivePath)[0]
+        isNew = not os.path.isdir(columnArchivePath)
+        columnArchive = ProbeColumnArchive.ProbeColumnArchive(columnArchivePath)
+        if isNew and os.path.exists(localArchivePath):
+            logger.debug(probeName + ":\tconverting " + localArchivePath + " to a columnar archive...")
+            logger.debug(probeName + ":\t" + str(columnArchive.importTable(localArchivePath)) + " entries converted")
+        if columnArchive.latest() is not None:
+            mostRecentID = columnArchive.latest()[0]
+    # is this the first ever sync call? if so, get all available data from the
+    # database; if not, determine what needs to be synced
+    elif os.path.exists(localArchivePath):
+        mostRecentID = readMostRecentID(localArchivePath)
     
-    # is this the first ever sync call?
-    if not os.path.exists(localArchivePath):
-        # if so, get all available data from the database
-        queryTable = queryNewData(probeName, 0)
-        # if the queryTable is None, there was an error connecting
-        if queryTable is None:
-            logger.debug("Unable to connect to the database: abandoning sync attempt")
-            return
-        # if the database is empty, do nothing
-        if len(queryTable) == 0:
-            logger.debug("No new entries; sync already complete")
-            return
-        # if not, write the whole table to file with the header
-        logger.debug(probeName + ":\t" + str(len(queryTable)) + " new entries synced!")
-        header = "ID\tTimestamp\tTemperature\tRH"
-        writeTableToFile(queryTable, localArchivePath, header=header)  
-    # if this is not the first sync call, determine what needs to be synced
+    # new entries come as bundles from the probe's HTTP server, if it serves
+    # them, otherwise from the database
+    chunks = None
+    dbConn = None
+    bundleURL = registry.bundleURL(probeName)
+    if bundleURL is not None:
+        try:
+            rows = fetchBundle(bundleURL, mostRecentID, registry.readTimeout)
+            chunks = iterBundles(bundleURL, mostRecentID, registry.readTimeout, rows)
+        except (OSError, ValueError) as e:
+            logger.debug(probeName + ":\tNo bundle (" + str(e) + "); falling back to the database")
+    if chunks is None:
+        dbConn = registry.connection(probeName)
+        # if dbConn is None, there was an error connecting
+        if dbConn is None:
+            logger.debug(probeName + ":\tUnable to connect to the database: abandoning sync attempt")
+            return None
+        chunks = iterNewData(dbConn, registry.conf(probeName)[5], mostRecentID)
+    
+    # stream new entries to the local table, with the header if it is new
+    header = "ID\tTimestamp\tTemperature\tRH"
+    try:
+        if columnArchive is not None:
+            n = writeInBackground(chunks, columnArchive.append, columnArchive.directory)
+        else:
+            n = appendChunks(chunks, localArchivePath, header=header)
+    except Exception:
+        if dbConn is not None:
+            registry.release(probeName, dbConn, broken=True)
+        raise
+    if dbConn is not None:
+        registry.release(probeName, dbConn)
+    if n == 0:
+        logger.debug(probeName + ":\tNo new entries; sync already complete")
     else:
-        currentArchive = readTableFromFile(localArchivePath)
-        mostRecentID = max(list(map(lambda x: int(x[0]), currentArchive)))
-        #print(mostRecentID)
-        # query for any new entries
-        queryTable = queryNewData(probeName, mostRecentID)
-        # if the queryTable is None, there was an error connecting
-        if queryTable is None:
-            logger.debug("Unable to connect to the database: abandoning sync attempt")
-            return
-        # if the database is empty, do nothing
-        if len(queryTable) == 0:
-            logger.debug("No new entries; sync already complete")
-            return
-        # if the query is not empty, add these to the local database
-        writeTableToFile(queryTable, localArchivePath, mode='a')
-        logger.debug(probeName + ":\t" + str(len(queryTable)) + " new entries synced!")
+        logger.debug(probeName + ":\t" + str(n) + " new entries synced!")
+    
+    return n
+
+"""Fetch the entries missing from the middle of a probe's columnar archive
+(see ProbeGaps.py) from the probe database, and merge them in.
+
+    Only the ranges of missing IDs are queried, gaps close together being
+    fetched as one range. Entries after the latest one of the archive are left
+    to update(). Returns (ranges queried, IDs missing, entries backfilled), or
+    None if the database cannot be reached.
+
+    Arguments:
+    probeName -- e.g. 'probe1', 'probe2', etc.
+    localArchivePath -- path to the directory in which the local tables are stored
+    registry -- ProbeRegistry to take the probe's connection from; by default,
+                a connection is opened for this backfill only
+"""
+def backfill(probeName, localArchivePath, registry=None):
+    
+    if registry is None:
+        registry = ProbeRegistry()
+        try:
+            return backfill(probeName, localArchivePath, registry)
+        finally:
+            registry.close()
+    
+    columnArchivePath = os.path.splitext(localTablePath(probeName, localArchivePath, registry))[0]
+    if not os.path.isdir(columnArchivePath):
+        raise ValueError("no columnar archive " + columnArchivePath + " to backfill")
+    import ProbeGaps # needs numpy, which the sync itself does not
+    columnArchive = ProbeColumnArchive.ProbeColumnArchive(columnArchivePath)
+    ranges, missing = ProbeGaps.backfillPlan(columnArchive)
+    if len(ranges) == 0:
+        return (0, 0, 0)
+    logger.debug(probeName + ":\t" + str(missing) + " missing entries, in " + str(len(ranges)) + " ranges")
+    
+    dbConn = registry.connection(probeName)
+    if dbConn is None:
+        logger.debug(probeName + ":\tUnable to connect to the database: abandoning backfill attempt")
+        return None
+    try:
+        n = 0
+        for rows in iterRangeData(dbConn, registry.conf(probeName)[5], ranges):
+            n += columnArchive.merge(rows)
+    except Exception:
+        registry.release(probeName, dbConn, broken=True)
+        raise
+    registry.release(probeName, dbConn)
+    logger.debug(probeName + ":\t" + str(n) + " entries backfilled")
+    return (len(ranges), missing, n)
+
+"""Return the bytes stored for a probe: the size of its text table, or of its
+columnar archive.
+
+    Arguments:
+    tablePath -- filepath to the local table
+    columnar -- whether the probe is synced to a columnar archive
+"""
+def _storedBytes(tablePath, columnar):
+    if columnar:
+        archivePath = os.path.splitext(tablePath)[0]
+        if not os.path.isdir(archivePath):
+            return 0
+        return sum(map(lambda x: os.path.getsize(os.path.join(archivePath, x)), os.listdir(archivePath)))
+    if not os.path.exists(tablePath):
+        return 0
+    return os.path.getsize(tablePath)
+
+"""Sync one probe and return a summary of the sync: (probeName, rows synced,
+bytes written to the local table, duration in seconds, error or None).
+
+    Never raises, so one failing probe does not affect the others.
+
+    Arguments:
+    probeName -- e.g. 'probe1', 'probe2', etc.
+    localArchivePath -- path to the directory in which the local tables are (to be) stored 
+    columnar -- sync to a columnar archive (see update)
+    registry -- ProbeRegistry to take the probe's connection from (see update)
+"""
+def syncProbe(probeName, localArchivePath, columnar=False, registry=None):
+    start = time.time()
+    rows = 0
+    error = None
+    tablePath = None
+    sizeBefore = 0
+    try:
+        tablePath = localTablePath(probeName, localArchivePath, registry)
+        sizeBefore = _storedBytes(tablePath, columnar)
+        rows = update(probeName, localArchivePath, columnar, registry)
+        if rows is None:
+            rows = 0
+            error = "database unreachable"
+    except Exception as e:
+        error = type(e).__name__ + ": " + str(e)
+        logger.debug(probeName + ":\tsync failed: " + error)
+    written = 0
+    if tablePath is not None:
+        written = _storedBytes(tablePath, columnar) - sizeBefore
+    return (probeName, rows, written, time.time() - start, error)
+
+"""Sync all probes concurrently, one thread each, and return their summaries
+(see syncProbe), in the order given.
+
+    Arguments:
+    probes -- names of the probes
+    localArchivePath -- path to the directory in which the local tables are (to be) stored 
+    columnar -- sync to columnar archives (see update)
+    registry -- ProbeRegistry to take the connections from (see update)
+"""
+def syncAll(probes, localArchivePath, columnar=False, registry=None):
+    with ThreadPoolExecutor(max_workers=len(probes)) as executor:
+        futures = [executor.submit(syncProbe, probe, localArchivePath, columnar, registry) for probe in probes]
+        return [future.result() for future in futures]
+
+"""Log the summary of a probe's sync (see syncProbe) as a table row."""
+def logSummary(summary):
+    probeName, rows, written, duration, error = summary
+    logger.debug(probeName + "\t" + str(rows) + "\t" + str(written) + "\t" + ("%.1f" % duration) + "\t" + ("" if error is None else error))
+
+"""Keep syncing probes until stopped, each on its own thread and schedule.
+
+    Each probe is synced every interval seconds, give or take a random jitter,
+    so the probes are not all queried at the same moment. After a failed sync,
+    the delay doubles, up to DAEMON_MAX_DELAY. Only syncs that brought new
+    entries, or failed, are logged in the summary format.
+
+    Arguments:
+    probes -- names of the probes
+    localArchivePath -- path to the directory in which the local tables are (to be) stored 
+    registry -- ProbeRegistry holding the connections between syncs
+    interval -- seconds between syncs of a probe
+    jitter -- fraction of the interval by which each delay varies at random
+    columnar -- sync to columnar archives (see update)
+    stopEvent -- threading.Event ending the daemon once set
+"""
+def runDaemon(probes, localArchivePath, registry, interval=DAEMON_INTERVAL, jitter=DAEMON_JITTER, columnar=False, stopEvent=None):
+    if stopEvent is None:
+        stopEvent = threading.Event()
+    
+    def syncLoop(probeName):
+        delay = interval
+        while not stopEvent.is_set():
+            summary = syncProbe(probeName, localArchivePath, columnar, registry)
+            if summary[1] > 0 or summary[4] is not None:
+                logSummary(summary)
+            if summary[4] is None:
+                delay = interval
+            else:
+                delay = min(2 * delay, DAEMON_MAX_DELAY)
+            stopEvent.wait(delay * random.uniform(1 - jitter, 1 + jitter))
     
-    return
+    threads = [threading.Thread(target=syncLoop, args=(probe,), name="sync " + probe) for probe in probes]
+    for thread in threads:
+        thread.start()
+    try:
+        while not stopEvent.wait(1):
+            pass
+    finally:
+        stopEvent.set()
+        for thread in threads:
+            thread.join()
+        registry.close()
 
 """Executable"""
 if __name__ == "__main__":
     
+    parser = argparse.ArgumentParser(description="Sync the local copies of the probe databases.")
+    parser.add_argument("--daemon", action="store_true", help="keep syncing every --interval seconds, until interrupted")
+    parser.add_argument("--interval", type=float, default=DAEMON_INTERVAL, help="seconds between syncs of a probe, in daemon mode")
+    parser.add_argument("--jitter", type=float, default=DAEMON_JITTER, help="fraction of the interval by which the delay varies")
+    parser.add_argument("--backfill", action="store_true", help="fetch the entries missing from the middle of the columnar archives, then exit")
+    args = parser.parse_args()
+    
     """
     ============================================================================
     ==== CONFIGURATION
@@ -224,6 +908,11 @@ if __name__ == "__main__":
     """
     
     localArchivePath = Common.microclimateArchivePath 
+    # sync to columnar archives (see ProbeColumnArchive.py) instead of text tables
+    columnar = False
+    # fetch new entries as bundles from the probes' HTTP servers (the httpPort
+    # of ProbeLogger.conf) on this port, instead of from MySQL; None to disable
+    bundlePort = None
     
     """
     ============================================================================
@@ -235,7 +924,36 @@ if __name__ == "__main__":
     
     probes = ['rpithon1','rpithon2', 'rpithon3', 'rpithon4', 'rpithon5', 'rpithon6', 'rpithon7']
     
-    for probe in probes:
-        update(probe, localArchivePath)
+    registry = ProbeRegistry(bundlePort=bundlePort)
+    
+    if args.backfill:
+        logger.debug("probe\tranges\tmissing\tbackfilled")
+        for probe in probes:
+            try:
+                result = backfill(probe, localArchivePath, registry)
+            except Exception as e:
+                logger.debug(probe + ":\tbackfill failed: " + type(e).__name__ + ": " + str(e))
+                continue
+            if result is not None:
+                logger.debug(probe + "\t" + "\t".join(map(str, result)))
+        registry.close()
+    elif args.daemon:
+        stopEvent = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopEvent.set())
+        logger.debug("Syncing every " + str(args.interval) + " seconds, until interrupted")
+        logger.debug("probe\trows\tbytes\tseconds\terror")
+        try:
+            runDaemon(probes, localArchivePath, registry, args.interval, args.jitter, columnar, stopEvent)
+        except KeyboardInterrupt:
+            pass
+    else:
+        start = time.time()
+        summaries = syncAll(probes, localArchivePath, columnar, registry)
+        registry.close()
+        
+        logger.debug("probe\trows\tbytes\tseconds\terror")
+        for summary in summaries:
+            logSummary(summary)
+        logger.debug("Synced " + str(len(probes)) + " probes in " + ("%.1f" % (time.time() - start)) + " seconds")
     
     logger.debug('SyncProbeDBs shutdown at ' + str(time.asctime()))
\ No newline at end of file
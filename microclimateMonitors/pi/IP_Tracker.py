@@ -1,16 +1,29 @@
 """Script written to ping the GoreLab server with any changes to IP address.
 
-This is written to be run as a regular cron job. When run, it checks to see if
-there is an internet connection. If there is not, nothing else will be done. If
-there is, it will check to see if the IP address has changed since the last
-update. If so, it will change the local record (in ip.txt) and ping the GoreLab
-server with the change, which should then be reflected at a known url.
+This was written to be run as a regular cron job. When run, it checks to see if
+the IP address has changed since the last update. If so, it will change the
+local record (in ip.txt) and, if there is an internet connection, ping the
+GoreLab server with the change, which should then be reflected at a known url.
+
+It can instead run as a long-running watcher (e.g. launched at boot from the
+crontab), which waits on the kernel's address change events, through
+"ip monitor address", and only then reads the address again:
+
+    python3 IP_Tracker.py --watch
+
+The address is read from the interfaces ("ip addr"), with no network traffic,
+and the internet connection is only tested when there is a change to report.
+If "ip monitor" is not available, the watcher checks every POLL_INTERVAL
+seconds instead.
 
 Author: James Chamness
 Last modified: May 04, 2017
 """
-import httplib
+import argparse
+import http.client
 import logging
+import os
+import select
 import socket
 import subprocess
 import time
@@ -21,6 +34,14 @@ logger.setLevel(logging.DEBUG)
 logger.addHandler(logging.StreamHandler())
 logger.addHandler(logging.FileHandler('IP_Tracker.log', mode='a'))
 
+IP_FILENAME = "ip.txt"
+ADDRESS_COMMAND = ["ip", "-4", "-o", "addr", "show", "scope", "global"]
+MONITOR_COMMAND = ["ip", "-o", "monitor", "address"]
+SETTLE_SECONDS = 2 # the events of one change come in bursts: wait until they stop
+RETRY_INTERVAL = 60 # seconds between attempts to report a change that could not be
+POLL_INTERVAL = 60 # seconds between checks of the address, without ip monitor
+RESTART_DELAY = 10 # seconds before restarting ip monitor if it exits
+
 """Load the probe-specific configuration"""
 def loadConf(confFilename):
     confFile = open(confFilename)
@@ -37,7 +58,7 @@ def loadConf(confFilename):
 
 """Test if there is an internet connection"""
 def have_internet():
-    conn = httplib.HTTPConnection("www.google.com", timeout=5)
+    conn = http.client.HTTPConnection("www.google.com", timeout=5)
     try:
         conn.request("HEAD", "/")
         conn.close()
@@ -59,6 +80,31 @@ def get_ip():
     s.connect(("8.8.8.8", 80)) # this is Google's public DNS page. this line would fail if there was no internet connection
     return(s.getsockname()[0])
 
+"""Get the current IP address from the interfaces, without any network
+traffic: the first global IPv4 address. Falls back to get_ip() if the ip
+command is not available; returns None if there is no address."""
+def get_interface_ip():
+    try:
+        output = subprocess.check_output(ADDRESS_COMMAND).decode()
+    except (OSError, subprocess.CalledProcessError):
+        try:
+            return get_ip()
+        except OSError:
+            return None
+    for line in output.splitlines():
+        vals = line.split()
+        if "inet" in vals:
+            return vals[vals.index("inet") + 1].split("/")[0]
+    return None
+
+"""Return the IP address on record in the local file, or None if there is none."""
+def read_ip_local():
+    try:
+        with open(IP_FILENAME, 'r') as f:
+            return f.readline().strip()
+    except IOError:
+        return None
+
 """Update the local file storing the IP address with (potentially) new address.
 
     Check the local file storing IP address. If address on file is the same as
@@ -69,43 +115,103 @@ def get_ip():
     ip -- string of new IP address
 """
 def update_ip_local(ip):
-    ipFilename = "ip.txt"
-    with open(ipFilename, 'r') as f:
-        oldIP = f.readlines()[0].strip()
-        #logger.debug("Old IP: " + oldIP)
-        if oldIP == ip:
-            return False
-    with open(ipFilename, 'w') as f:
+    if read_ip_local() == ip:
+        return False
+    with open(IP_FILENAME + ".tmp", 'w') as f:
         f.write(ip)
-        return True
+    os.replace(IP_FILENAME + ".tmp", IP_FILENAME)
+    return True
 
 """Ping the GoreLab server with IP update.
+
+    The command runs render_ip_page.py on the server with the unit number and
+    new IP (see render_ip_page.py). Returns True if it succeeded.
 """
 def update_ip_server(ip, unitNumber):
     sysCommandString = "" # hardcoded
-    subprocess.call(sysCommandString, shell=True)
+    return subprocess.call(sysCommandString, shell=True) == 0
+
+"""Record the current IP address if it changed, and report it to the server.
+
+    The local record is only changed once the server has the new address, so
+    an address that could not be reported (no internet connection, or the
+    server command failed) is reported at the next check. Returns the IP
+    address last reported.
+
+    Arguments:
+    reportedIP -- the IP address last reported
+    unitNumber -- unit number of the Pi
+"""
+def check_ip(reportedIP, unitNumber):
+    ip = get_interface_ip()
+    if ip is None or ip == reportedIP:
+        return reportedIP
+    if not have_internet() or not update_ip_server(ip, unitNumber):
+        logger.debug("Unable to ping the GoreLab server with new IP " + ip + "; will retry")
+        return reportedIP
+    update_ip_local(ip)
+    logger.debug("IP change logged at " + str(time.asctime()))
+    logger.debug("New IP: " + ip)
+    return ip
+
+"""Wait for output from a process. Returns True once there is some (which is
+read), or False after timeout seconds or at the end of the output.
+
+    Arguments:
+    fd -- file descriptor of the process output
+    timeout -- maximum seconds to wait, or None to wait indefinitely
+"""
+def wait_for_event(fd, timeout):
+    readable, writable, errors = select.select([fd], [], [], timeout)
+    return len(readable) > 0 and os.read(fd, 4096) != b""
+
+"""Report the IP address whenever it changes, until interrupted.
+
+    Arguments:
+    unitNumber -- unit number of the Pi
+"""
+def watch_ip(unitNumber):
+    reportedIP = read_ip_local()
+    reportedIP = check_ip(reportedIP, unitNumber)
+    while True:
+        try:
+            monitor = subprocess.Popen(MONITOR_COMMAND, stdout=subprocess.PIPE)
+        except OSError:
+            logger.debug("ip monitor not available: checking every " + str(POLL_INTERVAL) + " seconds")
+            while True:
+                time.sleep(POLL_INTERVAL)
+                reportedIP = check_ip(reportedIP, unitNumber)
+        fd = monitor.stdout.fileno()
+        try:
+            while True:
+                # with a change not reported yet, wake up to retry it
+                pending = get_interface_ip() != reportedIP
+                if wait_for_event(fd, RETRY_INTERVAL if pending else None):
+                    while wait_for_event(fd, SETTLE_SECONDS):
+                        pass
+                elif monitor.poll() is not None:
+                    break
+                reportedIP = check_ip(reportedIP, unitNumber)
+        finally:
+            monitor.kill()
+            monitor.wait()
+        logger.debug("ip monitor exited: restarting it in " + str(RESTART_DELAY) + " seconds")
+        time.sleep(RESTART_DELAY)
+        reportedIP = check_ip(reportedIP, unitNumber) # changes while it was down
 
 """Executable"""
 if __name__ == "__main__":
-    
+
+    parser = argparse.ArgumentParser(description="Report changes to the IP address of this Pi.")
+    parser.add_argument("--watch", action="store_true", help="keep running, and report each change as it happens")
+    args = parser.parse_args()
+
     probeName, unitNumber, pin, host, user, passwd, db, table = loadConf("ProbeLogger.conf")
-    
-    if not have_internet():
-        quit()
+
+    if args.watch:
+        try:
+            watch_ip(unitNumber)
+        except KeyboardInterrupt:
+            pass
     else:
-        ip = get_ip()
-        if update_ip_local(ip):
-            logger.debug("IP change logged at " + str(time.asctime()))
-            logger.debug("New IP: " + ip)
-            update_ip_server(ip, unitNumber)
-            logger.debug("GoreLab server pinged with new IP")
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
\ No newline at end of file
+        check_ip(read_ip_local(), unitNumber)
@@ -4,6 +4,11 @@ This script should be in the same directory as the probe logger script, and be
 run with permissions allowing it to edit /var/www/html. It should launch at
 startup.
 
+The logger's status is read from the heartbeat ProbeLogger.py publishes (see
+ProbeStatus.py); the monitor sleeps until that file changes, or until a
+heartbeat is overdue, and rewrites status.html only when its content changes.
+status.html holds the status, "Uptime" or "Downtime", and the UNIX time the
+up/downtime is counted from; the page counts the seconds itself.
 
 
 Author: James Chamness
@@ -12,9 +17,14 @@ Last modified April 28, 2017
 import jinja2
 import json
 import logging
-import subprocess
 import os
 import time
+import ProbeArchive
+import ProbeStatus
+
+STATUS_PAGE_FILENAME = "../../var/www/html/status.html"
+LOCAL_ARCHIVE_DIRECTORY = "ProbeArchive"
+LEGACY_ARCHIVE_FILENAME = "ProbeLog.csv"
 
 """"Set up logger routing to console and to file"""
 logger = logging.getLogger(__name__)
@@ -36,51 +46,83 @@ def loadConf(confFilename):
     table = lines[7].split(" ")[2]
     return (probeName, unitNumber, pin, host, user, pwd, db, table)
 
+"""Return the optional settings of the probe-specific configuration as a dict
+(see ProbeLogger.loadOptions)."""
+def loadOptions(confFilename):
+    confFile = open(confFilename)
+    lines = list(map(lambda x: x.strip(), confFile.readlines()))
+    options = {}
+    for line in lines[8:]:
+        if line == "" or line[0] == "#": continue
+        options[line.split(" ")[0]] = line.split(" ")[2]
+    return options
+
+"""Return the time of the latest reading.
+
+    Read from the local archive; before ProbeLogger.py has created it (on the
+    first boot after upgrading), from the last reading of the legacy text
+    archive. Returns the current time if there is no reading at all.
+"""
+def latestReadTime():
+    latest = ProbeArchive.ProbeArchive(LOCAL_ARCHIVE_DIRECTORY, readOnly=True).latest()
+    if latest is not None:
+        return latest[1]
+    if os.path.isfile(LEGACY_ARCHIVE_FILENAME):
+        with open(LEGACY_ARCHIVE_FILENAME, 'rb') as f:
+            for line in reversed(f.readlines()):
+                record = ProbeArchive.parseLegacyLine(line)
+                if record is not None:
+                    return record[1]
+    return int(time.time())
+
 """Return a diagnostic from test of ProbeLogger status.
 
-    Checks to see if the system process for the ProbeLogger script is currently
-    running, and return two values. If the process is running, return True and
-    the uptime in seconds. If the process is not running, return False and the
-    downtime in seconds.
+    Reads the heartbeat published by ProbeLogger.py, and return two values. If
+    the logger is running, return True and the time it started. If it is not
+    running, return False and the time of its latest reading.
 """
 def testProbeLoggerStatus():
     
-    #logger.debug("Testing probe status")
-    
-    operational = True
-    try:
-        pid = subprocess.check_output(["pgrep","-f","ProbeLogger.py"])
-        #logger.debug("Found process!")
-    except subprocess.CalledProcessError as e:
-        # interestingly, if this same command is called from a bash terminal and
-        # no results are found, it just doesn't print anything, but if called
-        # using subprocess, and no results are found, it throws an exception.
-        # I don't have a good explanation for that but hey this works
-        operational = False
-        #logger.debug("Did NOT find process!")
+    status = ProbeStatus.readStatus()
+    if ProbeStatus.isRunning(status):
+        return (True, int(status["started"]))
     
-    if operational:
-        """determine uptime from log file"""
-        with open("ProbeLogger.log") as f:
-            lines = f.readlines()
-            firstRead = int(lines[-1].split('\t')[1])
-            present = int(time.time())
-            uptime = present - firstRead        
-        return(True,uptime)
+    """determine downtime from the latest reading"""
+    lastReads = []
+    if status is not None:
+        lastReads = [sensor["lastSample"] for sensor in status["sensors"].values() if sensor["lastSample"] is not None]
+    if len(lastReads) > 0:
+        lastRead = max(lastReads)
     else:
-        """determine downtime from readings log file"""
-        with open("ProbeLog.csv") as f:
-            lastRead = int(f.readlines()[-1].split('\t')[1])
-            present = int(time.time())
-            downtime = present - lastRead
-        return(False,downtime)
+        lastRead = latestReadTime()
+    return (False, int(lastRead))
+
+"""Replace the status object on the public page, if it changed.
+
+    Returns whether the page was rewritten.
+
+    Arguments:
+    obj -- [status, timeCode, timestamp]
+    previous -- the object last written, or None
+"""
+def writeStatusPage(obj, previous=None):
+    if obj == previous:
+        return False
+    tmpFilename = STATUS_PAGE_FILENAME + ".tmp"
+    jsonFilestream = open(tmpFilename,'w')
+    json.dump(obj,jsonFilestream)
+    jsonFilestream.close()
+    os.replace(tmpFilename, STATUS_PAGE_FILENAME)
+    return True
 
 """Perform initial render of webpage and set status object to "booting"
     
     Arguments:
     probeName -- the name of the probe this script is running on
+    httpPort -- port of the logger's own HTTP server (see ProbeServer.py), or
+                None if the page reads files
 """
-def renderMonitoringPage(probeName):
+def renderMonitoringPage(probeName, httpPort=None):
     
     publicPageFilename = "../../var/www/html/index.html"
         
@@ -89,7 +131,8 @@ def renderMonitoringPage(probeName):
     templateFilename = "MonitoringPage.jinja"
     template = templateEnv.get_template(templateFilename)
         
-    templateVars = { "probeName" : probeName + " (Unit " + unitNumber + ")"}
+    templateVars = { "probeName" : probeName + " (Unit " + unitNumber + ")",
+                     "httpPort" : json.dumps(httpPort)}
     
     outputText = template.render(templateVars)
     outputFile = open(publicPageFilename,'w')
@@ -97,23 +140,22 @@ def renderMonitoringPage(probeName):
     outputFile.close()
     
     
-    with open("ProbeLog.csv") as f:
-        lastRead = int(f.readlines()[-1].split('\t')[1])
-        present = int(time.time())
-        downtime = present - lastRead
+    lastRead = latestReadTime()
     
-    obj = ["Pi booted, sensor logger still launching...","Downtime",downtime]
-    publicPageFilename = "../../var/www/html/status.html"
-    jsonFilestream = open(publicPageFilename,'w')
-    json.dump(obj,jsonFilestream)
-    jsonFilestream.close()
-    return
+    obj = ["Pi booted, sensor logger still launching...","Downtime",lastRead]
+    writeStatusPage(obj)
+    return obj
 
 """Update status object on public page for site.
+
+    Returns the status object.
+
+    Arguments:
+    previous -- the status object last written
 """
-def updateMonitoringPage():
+def updateMonitoringPage(previous):
     
-    status, time = testProbeLoggerStatus()
+    status, since = testProbeLoggerStatus()
     if status:
         status = "running"
         timeCode = "Uptime"
@@ -121,13 +163,10 @@ def updateMonitoringPage():
         status = "DOWN"
         timeCode = "Downtime"
     
-    obj = [status,timeCode,time]
-    
-    publicPageFilename = "../../var/www/html/status.html"
-    jsonFilestream = open(publicPageFilename,'w')
-    json.dump(obj,jsonFilestream)
-    jsonFilestream.close()
-    return
+    obj = [status,timeCode,since]
+    if writeStatusPage(obj, previous):
+        logger.debug("Status changed: " + json.dumps(obj))
+    return obj
 
 """Executable"""
 if __name__ == "__main__":
@@ -135,14 +174,18 @@ if __name__ == "__main__":
     logger.debug('Monitor launched at ' + str(time.asctime()))
     logger.debug("Loading configuration")
     probeName, unitNumber, pin, host, user, passwd, db, table = loadConf("ProbeLogger.conf")
+    options = loadOptions("ProbeLogger.conf")
+    httpPort = int(options["httpPort"]) if "httpPort" in options else None
     logger.debug("Performing initial monitoring page render")
-    renderMonitoringPage(probeName)
+    obj = renderMonitoringPage(probeName, httpPort)
     logger.debug("Waiting for ProbeLogger to launch...")
     time.sleep(120) # wait so that ProbeLogger.py can finish startup routine
     logger.debug("Starting Monitoring loop...")
     
+    watcher = ProbeStatus.StatusWatcher()
     while (True):
-        updateMonitoringPage()
-        time.sleep(1)
+        obj = updateMonitoringPage(obj)
+        # woken by a heartbeat, or a missing one
+        watcher.wait(ProbeStatus.HEARTBEAT_STALE)
     
     
\ No newline at end of file
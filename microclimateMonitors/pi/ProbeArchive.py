@@ -0,0 +1,524 @@
+"""Crash-safe, append-only local archive of probe readings.
+
+Replaces the plain text archive (ProbeLog.csv), whose last line could be left
+as a string of corrupted (^@) bytes when the Pi lost power, and which then had
+to be rewritten in full at every boot to remove them.
+
+Readings are stored in segment files in the archive directory. Each segment
+starts with a magic string, followed by one frame per reading:
+
+    payload length (uint32), CRC32 of payload (uint32), payload
+
+where the payload is the reading packed as ID (int64), timestamp (int64),
+temperature (double) and humidity (double), all little-endian. A frame whose
+length or CRC does not match is the end of the valid data: on opening the
+archive for writing, the last segment is simply truncated after its last valid
+frame, so recovery never rewrites history.
+
+Segments are named after the ID of their first reading and the (UTC) day of
+its timestamp, e.g. 000000123456-20170603.seg. A new segment is started when
+the day changes or the segment would exceed a maximum size. Closed segments
+are compressed with gzip (.seg.gz). Segment names serve as the index from an
+ID to its segment; within a segment, frames have a fixed size, so the frame of
+an ID is found from its distance to the first ID (checked, with a scan as
+fallback). Writes are flushed to the OS after every reading, but only fsync'ed
+every fsyncInterval seconds, to limit flash wear.
+A reading lost at a power cut is restored from the MySQL database by
+ProbeLogger.py's sync routine, as before.
+
+The archive can be exported to, and imported from, the legacy tab-separated
+format (ID, Time, Temperature, Humidity, with a header line):
+
+    python3 ProbeArchive.py import ProbeArchive ProbeLog.csv
+    python3 ProbeArchive.py export ProbeArchive ProbeLog.csv
+    python3 ProbeArchive.py check ProbeArchive
+
+Readings after a given ID can also be exported as a bundle, for the server to
+fetch (see ProbeServer.py /bundle): a header (magic, first and last ID, number
+of readings, length of the compressed payload), the SHA-256 of the header and
+the uncompressed payload, then the payload compressed with zlib. The payload
+holds the columns of the readings, all little-endian: IDs and timestamps as
+int64 differences from the previous one (the first from 0), so that regular
+readings compress to almost nothing, then temperatures and humidities as
+doubles.
+
+    python3 ProbeArchive.py bundle ProbeArchive bundle.bin [--after ID]
+"""
+import argparse
+import bisect
+import gzip
+import hashlib
+import itertools
+import os
+import struct
+import time
+import zlib
+
+MAGIC = b"MLCPRB1\n"
+FRAME_HEADER = struct.Struct("<II") # payload length, CRC32 of payload
+RECORD = struct.Struct("<qqdd") # ID, timestamp, temperature, humidity
+FRAME_SIZE = FRAME_HEADER.size + RECORD.size
+SEGMENT_SUFFIX = ".seg"
+COMPRESSED_SUFFIX = ".seg.gz"
+DEFAULT_MAX_SEGMENT_BYTES = 4 * 1024 * 1024
+DEFAULT_FSYNC_INTERVAL = 60 # seconds
+LEGACY_HEADER = "ID\tTime\tTemperature\tHumidity"
+BUNDLE_MAGIC = b"MLCBDL1\n"
+BUNDLE_HEADER = struct.Struct("<8sqqII") # magic, first ID, last ID, readings, compressed payload length
+BUNDLE_DIGEST_SIZE = 32 # SHA-256
+BUNDLE_COMPRESSION = 6 # zlib level
+
+"""Return the frame holding a reading.
+
+    Arguments:
+    record -- (ID, timestamp, temperature, humidity)
+"""
+def packFrame(record):
+    payload = RECORD.pack(*record)
+    return FRAME_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+"""Yield (end offset, record) for the valid frames of a segment's data, in order.
+
+    Stops at the first frame that is incomplete, or whose length or CRC does
+    not match.
+
+    Arguments:
+    data -- the (uncompressed) contents of a segment, including the magic
+    start -- offset of the first frame to read; defaults to the first frame
+"""
+def iterFrames(data, start=None):
+    if data[:len(MAGIC)] != MAGIC:
+        return
+    offset = len(MAGIC) if start is None else start
+    while offset + FRAME_SIZE <= len(data):
+        length, crc = FRAME_HEADER.unpack_from(data, offset)
+        if length != RECORD.size:
+            return
+        payloadStart = offset + FRAME_HEADER.size
+        payload = data[payloadStart:payloadStart + length]
+        if zlib.crc32(payload) != crc:
+            return
+        offset = payloadStart + length
+        yield (offset, RECORD.unpack(payload))
+
+"""Return the offset of the frame of the first reading with an ID at or above
+the given one, in a segment's data.
+
+    Readings usually have consecutive IDs, so the frame is first looked for at
+    its distance from the segment's first ID; the segment is scanned if the
+    reading found there is not the one looked for.
+
+    Arguments:
+    data -- the (uncompressed) contents of a segment, including the magic
+    firstID -- ID of the segment's first reading
+    id -- the ID to look for
+"""
+def frameOffset(data, firstID, id):
+    guess = len(MAGIC) + max(0, id - firstID) * FRAME_SIZE
+    for end, record in iterFrames(data, guess):
+        if record[0] == id:
+            return guess
+        break
+    end = len(MAGIC)
+    for end, record in iterFrames(data):
+        if record[0] >= id:
+            return end - FRAME_SIZE
+    return end
+
+"""Return readings packed as a bundle (see the module docstring).
+
+    Arguments:
+    records -- (ID, timestamp, temperature, humidity) readings, in order of ID
+"""
+def packBundle(records):
+    n = len(records)
+    ids = [record[0] for record in records]
+    times = [record[1] for record in records]
+    payload = (struct.pack("<%dq" % n, *[b - a for a, b in zip([0] + ids, ids)])
+               + struct.pack("<%dq" % n, *[b - a for a, b in zip([0] + times, times)])
+               + struct.pack("<%dd" % n, *[record[2] for record in records])
+               + struct.pack("<%dd" % n, *[record[3] for record in records]))
+    compressed = zlib.compress(payload, BUNDLE_COMPRESSION)
+    header = BUNDLE_HEADER.pack(BUNDLE_MAGIC, ids[0] if n > 0 else 0, ids[-1] if n > 0 else 0, n, len(compressed))
+    return header + hashlib.sha256(header + payload).digest() + compressed
+
+"""Return the readings of a bundle, as a list of (ID, timestamp, temperature,
+humidity). Raises ValueError if the bundle is truncated or corrupted.
+
+    Arguments:
+    data -- the bundle
+"""
+def unpackBundle(data):
+    start = BUNDLE_HEADER.size + BUNDLE_DIGEST_SIZE
+    if len(data) < start:
+        raise ValueError("truncated bundle")
+    magic, firstID, lastID, n, length = BUNDLE_HEADER.unpack_from(data)
+    if magic != BUNDLE_MAGIC:
+        raise ValueError("not a bundle")
+    if len(data) != start + length:
+        raise ValueError("truncated bundle")
+    try:
+        payload = zlib.decompress(data[start:])
+    except zlib.error as e:
+        raise ValueError("corrupted bundle: " + str(e))
+    if len(payload) != n * RECORD.size or hashlib.sha256(data[:BUNDLE_HEADER.size] + payload).digest() != data[BUNDLE_HEADER.size:start]:
+        raise ValueError("bundle checksum mismatch")
+    ids = list(itertools.accumulate(struct.unpack_from("<%dq" % n, payload, 0)))
+    times = list(itertools.accumulate(struct.unpack_from("<%dq" % n, payload, 8 * n)))
+    temperatures = struct.unpack_from("<%dd" % n, payload, 16 * n)
+    humidities = struct.unpack_from("<%dd" % n, payload, 24 * n)
+    return list(zip(ids, times, temperatures, humidities))
+
+"""Return the reading parsed from a line of the legacy text archive as
+(ID, timestamp, temperature, humidity), or None if the line is not a reading
+(e.g. the header, or corrupted bytes).
+
+    Arguments:
+    line -- the line, as bytes
+"""
+def parseLegacyLine(line):
+    try:
+        vals = line.decode("ascii").strip().split("\t")
+        if len(vals) != 4:
+            return None
+        return (int(vals[0]), int(vals[1]), float(vals[2]), float(vals[3]))
+    except ValueError: # includes undecodable (corrupted) bytes
+        return None
+
+"""Return a reading as a line of the legacy text archive.
+
+    Arguments:
+    record -- (ID, timestamp, temperature, humidity)
+"""
+def formatLegacyLine(record):
+    return str(record[0]) + "\t" + str(record[1]) + "\t" + str(record[2]) + "\t" + str(record[3]) + "\n"
+
+"""fsync a directory, so that files created or renamed in it are durable."""
+def _fsyncDirectory(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+"""The archive of one probe's readings. See the module docstring.
+
+    Only one process may open the archive for writing (ProbeLogger.py). Other
+    processes may open it read-only at any time, e.g. to find the latest
+    reading; they see every reading flushed so far.
+
+    Arguments:
+    directory -- the archive directory; created if needed (unless readOnly)
+    maxSegmentBytes -- size at which a new segment is started
+    fsyncInterval -- seconds between fsyncs of the active segment
+    readOnly -- open for reading only: no recovery, no writes
+"""
+class ProbeArchive(object):
+
+    def __init__(self, directory, maxSegmentBytes=DEFAULT_MAX_SEGMENT_BYTES, fsyncInterval=DEFAULT_FSYNC_INTERVAL, readOnly=False):
+        self.directory = directory
+        self.maxSegmentBytes = maxSegmentBytes
+        self.fsyncInterval = fsyncInterval
+        self.readOnly = readOnly
+        self._activeFile = None
+        self._activeDay = None
+        self._activeSize = 0
+        self._latest = None
+        self._lastFsync = time.monotonic()
+        if not readOnly:
+            os.makedirs(directory, exist_ok=True)
+            self._recover()
+        self._segments = self._listSegments()
+        if not readOnly and len(self._segments) > 0 and not self._segments[-1][2]:
+            self._openActive()
+
+    """Return the segments as a list of (firstID, path, compressed), by first ID.
+
+        A segment being compressed (see _compress) is briefly there twice, with
+        and without the compressed suffix: only the compressed copy is listed.
+    """
+    def _listSegments(self):
+        segments = []
+        if not os.path.isdir(self.directory):
+            return segments
+        names = set(os.listdir(self.directory))
+        for name in names:
+            if name.endswith(COMPRESSED_SUFFIX):
+                compressed = True
+            elif name.endswith(SEGMENT_SUFFIX) and name + ".gz" not in names:
+                compressed = False
+            else:
+                continue
+            segments.append((int(name.split("-")[0]), os.path.join(self.directory, name), compressed))
+        segments.sort()
+        return segments
+
+    """Bring the directory back to a consistent state after a crash or power cut.
+
+        Leftover temporary files are removed, segments whose compression did
+        not complete are compressed again, and the last segment is truncated
+        after its last valid frame (or removed if it holds none).
+    """
+    def _recover(self):
+        names = set(os.listdir(self.directory))
+        for name in names:
+            if name.endswith(".tmp"):
+                os.remove(os.path.join(self.directory, name))
+            elif name.endswith(SEGMENT_SUFFIX) and name + ".gz" in names:
+                os.remove(os.path.join(self.directory, name)) # crashed between compressing and removing it
+        segments = self._listSegments()
+        for firstID, path, compressed in segments[:-1]:
+            if not compressed:
+                self._compress(path)
+        if len(segments) == 0 or segments[-1][2]:
+            return
+        path = segments[-1][1]
+        with open(path, 'rb') as f:
+            data = f.read()
+        end = None
+        for end, record in iterFrames(data):
+            pass
+        if end is None:
+            os.remove(path)
+        elif end < len(data):
+            os.truncate(path, end)
+
+    """Open the last segment for appending and note its latest reading."""
+    def _openActive(self):
+        path = self._segments[-1][1]
+        self._activeFile = open(path, 'ab')
+        self._activeSize = os.path.getsize(path)
+        self._activeDay = os.path.basename(path)[-len(SEGMENT_SUFFIX) - 8:-len(SEGMENT_SUFFIX)]
+
+    """Return the uncompressed contents of a segment."""
+    def _readSegment(self, path, compressed):
+        with open(path, 'rb') as f:
+            data = f.read()
+        if compressed:
+            data = gzip.decompress(data)
+        return data
+
+    """Return the uncompressed contents of a listed segment.
+
+        A read-only archive lists the segments again, once, if the segment
+        was compressed (or removed) by the writer since it was listed.
+    """
+    def _readListedSegment(self, firstID, path, compressed):
+        try:
+            return self._readSegment(path, compressed)
+        except FileNotFoundError:
+            if not self.readOnly:
+                raise
+        self._segments = self._listSegments()
+        for segment in self._segments:
+            if segment[0] == firstID:
+                return self._readSegment(segment[1], segment[2])
+        raise FileNotFoundError("segment " + path + " no longer in the archive")
+
+    """Replace a closed segment by its compressed copy."""
+    def _compress(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        tmpPath = path + ".gz.tmp"
+        with open(tmpPath, 'wb') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) as gz:
+                gz.write(data)
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmpPath, path + ".gz")
+        _fsyncDirectory(self.directory)
+        os.remove(path)
+
+    """Close the active segment and start a new one.
+
+        Arguments:
+        firstID -- ID of the first reading of the new segment
+        day -- UTC day (YYYYMMDD) of the first reading of the new segment
+    """
+    def _rotate(self, firstID, day):
+        if self._activeFile is not None:
+            self.sync()
+            self._activeFile.close()
+            self._activeFile = None
+            self._compress(self._segments[-1][1])
+            self._segments[-1] = (self._segments[-1][0], self._segments[-1][1] + ".gz", True)
+        path = os.path.join(self.directory, "%012d-%s%s" % (firstID, day, SEGMENT_SUFFIX))
+        self._activeFile = open(path, 'wb')
+        self._activeFile.write(MAGIC)
+        self._activeFile.flush()
+        os.fsync(self._activeFile.fileno())
+        _fsyncDirectory(self.directory)
+        self._lastFsync = time.monotonic()
+        self._activeSize = len(MAGIC)
+        self._activeDay = day
+        self._segments.append((firstID, path, False))
+
+    """Append a reading to the archive.
+
+        The reading is flushed to the OS right away, and fsync'ed at most
+        fsyncInterval seconds later.
+
+        Arguments:
+        id, timestamp, temperature, humidity -- the reading
+    """
+    def append(self, id, timestamp, temperature, humidity):
+        record = (int(id), int(timestamp), float(temperature), float(humidity))
+        day = time.strftime("%Y%m%d", time.gmtime(record[1]))
+        if self._activeFile is None or day != self._activeDay or self._activeSize + FRAME_SIZE > self.maxSegmentBytes:
+            self._rotate(record[0], day)
+        self._activeFile.write(packFrame(record))
+        self._activeFile.flush()
+        self._activeSize += FRAME_SIZE
+        self._latest = record
+        if time.monotonic() - self._lastFsync >= self.fsyncInterval:
+            self.sync()
+
+    """fsync the active segment."""
+    def sync(self):
+        if self._activeFile is not None:
+            self._activeFile.flush()
+            os.fsync(self._activeFile.fileno())
+        self._lastFsync = time.monotonic()
+
+    def close(self):
+        if self._activeFile is not None:
+            self.sync()
+            self._activeFile.close()
+            self._activeFile = None
+
+    """Return the latest reading as (ID, timestamp, temperature, humidity), or
+    None if the archive is empty."""
+    def latest(self):
+        if self._latest is None or self.readOnly:
+            tail = self.tail(1)
+            if len(tail) == 0:
+                return None
+            self._latest = tail[0]
+        return self._latest
+
+    """Return the last count readings, oldest first.
+
+        Only the segments holding them are read.
+
+        Arguments:
+        count -- number of readings
+    """
+    def tail(self, count):
+        if self.readOnly:
+            self._segments = self._listSegments()
+        records = []
+        for firstID, path, compressed in reversed(self._segments):
+            segmentRecords = list(map(lambda x: x[1], iterFrames(self._readListedSegment(firstID, path, compressed))))
+            records = segmentRecords[-(count - len(records)):] + records
+            if len(records) >= count:
+                break
+        return records
+
+    """Yield the readings with an ID greater than afterID, in order.
+
+        Segments before the one holding afterID + 1 are skipped, by name, and
+        the reading is then located in its segment with frameOffset().
+
+        Arguments:
+        afterID -- yield readings after this ID; None for all readings
+    """
+    def iterRecords(self, afterID=None):
+        if self.readOnly:
+            self._segments = self._listSegments()
+        start = 0
+        if afterID is not None:
+            firstIDs = list(map(lambda x: x[0], self._segments))
+            start = max(0, bisect.bisect_right(firstIDs, afterID + 1) - 1)
+        for firstID, path, compressed in self._segments[start:]:
+            data = self._readListedSegment(firstID, path, compressed)
+            offset = None
+            if afterID is not None and afterID >= firstID:
+                offset = frameOffset(data, firstID, afterID + 1)
+            for end, record in iterFrames(data, offset):
+                if afterID is None or record[0] > afterID:
+                    yield record
+
+    """Append the readings of a legacy text archive, skipping any already in
+    the archive (by ID), and return the number appended.
+
+        Arguments:
+        legacyFilepath -- the legacy archive, e.g. ProbeLog.csv
+    """
+    def importLegacy(self, legacyFilepath):
+        latest = self.latest()
+        n = 0
+        with open(legacyFilepath, 'rb') as f:
+            for line in f:
+                record = parseLegacyLine(line)
+                if record is None or (latest is not None and record[0] <= latest[0]):
+                    continue
+                self.append(*record)
+                n += 1
+        self.sync()
+        return n
+
+    """Write the readings to a legacy text archive and return the number written.
+
+        Arguments:
+        legacyFilepath -- the file to write
+        afterID -- only write readings after this ID; None for all readings
+    """
+    def exportLegacy(self, legacyFilepath, afterID=None):
+        n = 0
+        out = open(legacyFilepath, 'w')
+        out.write(LEGACY_HEADER + "\n")
+        for record in self.iterRecords(afterID):
+            out.write(formatLegacyLine(record))
+            n += 1
+        out.close()
+        return n
+
+    """Return the readings after an ID as a bundle (see packBundle).
+
+        Arguments:
+        afterID -- bundle readings after this ID; None for all readings
+        limit -- maximum number of readings
+    """
+    def exportBundle(self, afterID=None, limit=None):
+        return packBundle(list(itertools.islice(self.iterRecords(afterID), limit)))
+
+"""Executable"""
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Import, export, bundle or check a probe archive.")
+    parser.add_argument("command", choices=["import", "export", "bundle", "check"])
+    parser.add_argument("archive", help="the archive directory")
+    parser.add_argument("legacyFile", nargs="?", help="the legacy text archive to import or export, or the bundle to write")
+    parser.add_argument("--after", type=int, help="bundle the readings after this ID")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        archive = ProbeArchive(args.archive)
+        print(str(archive.importLegacy(args.legacyFile)) + " readings imported")
+        archive.close()
+    elif args.command == "export":
+        archive = ProbeArchive(args.archive, readOnly=True)
+        print(str(archive.exportLegacy(args.legacyFile)) + " readings exported")
+    elif args.command == "bundle":
+        archive = ProbeArchive(args.archive, readOnly=True)
+        bundle = archive.exportBundle(args.after)
+        with open(args.legacyFile, 'wb') as f:
+            f.write(bundle)
+        print(str(BUNDLE_HEADER.unpack_from(bundle)[3]) + " readings bundled in " + str(len(bundle)) + " bytes")
+    else:
+        archive = ProbeArchive(args.archive, readOnly=True)
+        previousID = None
+        n = 0
+        for firstID, path, compressed in archive._listSegments():
+            data = archive._readListedSegment(firstID, path, compressed)
+            end = len(MAGIC)
+            for end, record in iterFrames(data):
+                if previousID is not None and record[0] <= previousID:
+                    print(path + ": ID " + str(record[0]) + " out of order")
+                previousID = record[0]
+                n += 1
+            if end != len(data):
+                print(path + ": " + str(len(data) - end) + " bytes after the last valid frame")
+        print(str(n) + " readings checked")
+
+    print("Done!")
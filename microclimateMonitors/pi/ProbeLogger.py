@@ -1,19 +1,29 @@
 """Fault-tolerant script to continuously log measurements from DHT22 sensor.
 
 This script should be placed in the user (pi) crontab, to launch at boot. 
-Readings from the sensor are logged to both a local archive (a text file) and a
-MySQL database. Both of these should be initialized with at least the null entry
-before this script is first called. Unit-specific configuration for the MySQL
+Readings from the sensor are logged to both a local archive (see
+ProbeArchive.py) and a MySQL database. Both of these should be initialized with
+at least the null entry before this script is first called; for the local
+archive, a ProbeLog.csv text file holding the null entry is imported into a new
+archive on first start (the archives of extra sensors start from the null entry
+themselves). Unit-specific configuration for the MySQL
 database and the GPIO pin number for the sensor should be specified in a
 'ProbeLogger.conf' configuration file, in the same directory as the script. 
 
 This script runs two routines: a startup routine, followed by a continuous
 logging routine. At startup, tests are run for the sensor connection, and access
 to the target MySQL database. The sensor connection test must pass or the script
-will terminate. If the MySQL access test fails, the logger routine will start,
-but it will only record readings to the local archive. If it succeeds, a
-subroutine will check if the local archive and MySQL database are synced, sync
-if necessary, then launching a logging routine recording readings to both.
+will terminate. If the MySQL access test succeeds, a subroutine will check if
+the local archive and MySQL database are synced, and sync if necessary. The
+logging routine then starts either way.
+
+The logging routine samples each configured sensor (one Pi can serve several)
+on fixed ticks, every sampleInterval seconds from startup, with the blocking
+sensor reads on a thread pool. Readings go through queues to the local archive,
+then to the other sinks: the live feed, and the MySQL database through a
+separate writer thread (see DBWriter), which catches up from the local archive
+whenever the database is, or becomes, unreachable. Sampling never waits on the
+sinks or the network.
 
 For any logging routine, new entries will be appended with unique IDs,
 incrementing from the ID of the entry with the highest ID found at startup,
@@ -29,25 +39,47 @@ the local file occurs before the database commit). The corrupted bytecode leads
 to a bug because python does not read this very well with a standard file()
 object, so my readTableFromFile() function locks up. Further, the invariant that
 the local archive is always ahead or equal to the MySQL database is violated.
-I've thus implemented a hackety workaround, to check the local archive file at
-startup for corrupted data and fix it before any other routine attempts to 
-read the file. The sync function for the local file and MySQL database can also
-handle if this occurs.
+The local archive is now a framed, checksummed format (ProbeArchive.py) that
+truncates such garbage after the last valid reading when it is opened, without
+rewriting the rest of the archive. The sync function for the local archive and
+MySQL database still restores the lost reading when this occurs. Only the
+latest segment of the archive is read at startup, whatever its total size.
+
+NOTE: minute, hour and day aggregates of the readings are also kept, and
+published to the public html folder for week- and month-scale plots (see
+ProbeRollups.py).
+
+NOTE: a heartbeat (start time, PID, last sample and error counters of each
+sensor) is published to a small status file on tmpfs for Monitor.py (see
+ProbeStatus.py), so the monitor no longer checks the process list and log.
 
-NOTE: added feature to dump table as JSON object to the public html folder every
-time a reading is added. This is for the live display.
+NOTE: added feature to publish the most recent readings to the public html
+folder every time a reading is added. This is for the live display. Only a
+fixed-size window of readings is kept in memory, and the browser fetches only
+the readings it has not seen yet (see LiveFeed). If an httpPort is configured,
+the logger serves the live window, rollups and heartbeat itself, from memory,
+and writes none of these files (see ProbeServer.py). The same server hands out
+compressed bundles of the local archive, which SyncProbeDBs.py fetches instead
+of querying MySQL row by row.
 
 Author: James Chamness
 Last modified: June 03, 2017
 """
 import Adafruit_DHT
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import json
 import logging
 import MySQLdb
 import os
-from string import Template
-import subprocess
+import queue
+import threading
 import time
+import ProbeArchive
+import ProbeRollups
+import ProbeServer
+import ProbeStatus
 
 """"Set up logger routing to console and to file"""
 logger = logging.getLogger(__name__)
@@ -55,6 +87,16 @@ logger.setLevel(logging.DEBUG)
 logger.addHandler(logging.StreamHandler())
 logger.addHandler(logging.FileHandler('ProbeLogger.log', mode='a'))
 
+LIVE_WINDOW = 1000 # readings published for the live display (8+ hours of continuous data)
+DEFAULT_DB_BATCH_ROWS = 10 # readings per MySQL commit...
+DEFAULT_DB_BATCH_SECONDS = 120 # ...or seconds between commits, whichever comes first
+RESYNC_CHUNK_ROWS = 500 # readings per MySQL commit when catching up from the local archive
+RESYNC_STATE_FILENAME = "ProbeResync.state" # of the sensor of the configuration
+DB_QUEUE_SIZE = 1000
+DB_RETRY_MIN = 5 # seconds before the first reconnection attempt, doubled up to DB_RETRY_MAX
+DB_RETRY_MAX = 300
+DHT_RETRY_DELAY = 2 # seconds between attempts to read a sensor
+
 """Return a table object read from the given input file.
 
     Arguments:
@@ -93,6 +135,24 @@ def loadConf(confFilename):
     table = lines[7].split(" ")[2]
     return (probeName, unitNumber, pin, host, user, pwd, db, table)
 
+"""Return the optional settings of the probe-specific configuration as a dict.
+
+    Optional settings follow the 8 required lines, in the same
+    "name = value" format, e.g. "archiveFsyncInterval = 60". Values are
+    returned as strings.
+    
+    Arguments:
+    confFilename -- the configuration file
+"""
+def loadOptions(confFilename):
+    confFile = open(confFilename)
+    lines = list(map(lambda x: x.strip(), confFile.readlines()))
+    options = {}
+    for line in lines[8:]:
+        if line == "" or line[0] == "#": continue
+        options[line.split(" ")[0]] = line.split(" ")[2]
+    return options
+
 """Test sensor connection, log result and terminate script if unsuccessful.
 
     The test works by trying to take a reading. It will retry up to 15 times,
@@ -141,173 +201,689 @@ def testDB(host,user,passwd,db):
             logger.debug(str(e))
             return None
 
-"""Check and fix local archive file for any corrupted binary data at the end.
+"""Return the statement inserting one reading into the MySQL table, with
+parameters for ID, timestamp, temperature and humidity.
+
+    IDs already in the table are skipped rather than failing the whole batch.
+
+    Arguments:
+    table -- the name of the MySQL table
+"""
+def insertStatement(table):
+    return "INSERT IGNORE INTO " + table + " VALUES (%s, %s, %s, %s)"
+
+"""Return the latest ID in the MySQL table, or -1 if the table is empty.
+
+    Arguments:
+    connection -- a MySQLdb connection object to the relevant database
+    table -- the name of the MySQL table
+"""
+def queryLatestID(connection, table):
+    cursor = connection.cursor()
+    cursor.execute("SELECT MAX(ID) FROM " + table)
+    latestIDdb = cursor.fetchone()[0]
+    if latestIDdb is None:
+        return -1
+    return latestIDdb
+
+"""Return the progress of an unfinished resync, as recorded in the state file,
+or None if there is none.
+
+    Arguments:
+    stateFilepath -- the resync state file
+"""
+def readResyncState(stateFilepath):
+    try:
+        with open(stateFilepath) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+"""Record the progress of a resync in the state file, or remove the file once
+the resync is complete. The file is replaced atomically (rename).
 
-    This is a bug that occurs when the Pi loses power unexpectedly, e.g. if it
-    is just unplugged. Note that it only seems to occur if this script was
-    launched from the crontab- if called directly from terminal, doesn't occur.
+    Arguments:
+    stateFilepath -- the resync state file
+    state -- dict with direction ("push" or "pull"), fromID, toID, doneID and
+             started; None when the resync is complete
+"""
+def writeResyncState(stateFilepath, state):
+    if state is None:
+        if os.path.exists(stateFilepath):
+            os.remove(stateFilepath)
+        return
+    tmpFilepath = stateFilepath + ".tmp"
+    stateFilestream = open(tmpFilepath, 'w')
+    json.dump(state, stateFilestream)
+    stateFilestream.close()
+    os.replace(tmpFilepath, stateFilepath)
+
+"""Copy the readings of the local archive after afterID to the MySQL table.
+
+    Readings are streamed from the archive, which locates afterID without
+    reading what precedes it, and inserted with executemany() in chunks of
+    chunkRows, each chunk committed on its own. Progress is recorded in the
+    state file after each commit, so an interrupted resync resumes after the
+    last chunk committed (the next resync starts from the table's latest ID).
+    
+    Returns (number of readings copied, latest ID copied, or afterID if none).
     
     Arguments:
-    localArchiveFilepath -- filepath to the local archive (path + filename)
+    archive -- the local archive (a ProbeArchive)
+    connection -- a MySQLdb connection object to the relevant database
+    table -- the name of the MySQL table
+    afterID -- the latest ID already in the table
+    stateFilepath -- the resync state file, or None to record no progress
+    chunkRows -- readings per commit
 """
-def bugFixLocal(localArchiveFilepath):
-    
-    # Determine if there are readings in the table, or just the table stub.
-    # This is necessary because Dan's bash one-liner below wipes the table clean
-    # (including the header) if there is not at least one real entry. I don't
-    # know enough bash to figure out why so this is a hackety workaround
-    sysCommandString = "wc -l < " + localArchiveFilepath
-    lines = int(subprocess.Popen(sysCommandString,shell=True,stdout=subprocess.PIPE).stdout.read().strip())
-    # If just the table stub, no way for there to be bytecode error (since
-    # logger must not have been run yet), so return
-    if lines == 2: return
-        
-    # Check for the weird char string and remove if found
-    sysCommandString = "tfile='mktemp'; sudo cat -v " + localArchiveFilepath + " | grep -P '^([0-9]+|ID)' > $tfile; sudo mv $tfile " + localArchiveFilepath
-    subprocess.call(sysCommandString, shell=True)
+def pushToDB(archive, connection, table, afterID, stateFilepath=None, chunkRows=RESYNC_CHUNK_ROWS):
+    latest = archive.latest()
+    if latest is None or latest[0] <= afterID:
+        return (0, afterID)
+    state = {"direction": "push", "fromID": afterID, "toID": latest[0], "doneID": afterID, "started": int(time.time())}
+    cursor = connection.cursor()
+    command = insertStatement(table)
+    n = 0
+    batch = []
+    for record in archive.iterRecords(afterID=afterID):
+        batch.append(record)
+        if len(batch) == chunkRows:
+            cursor.executemany(command, batch)
+            connection.commit()
+            n += len(batch)
+            state["doneID"] = batch[-1][0]
+            batch = []
+            if stateFilepath is not None:
+                writeResyncState(stateFilepath, state)
+    if len(batch) > 0:
+        cursor.executemany(command, batch)
+        connection.commit()
+        n += len(batch)
+        state["doneID"] = batch[-1][0]
+    if stateFilepath is not None:
+        writeResyncState(stateFilepath, None)
+    return (n, state["doneID"])
+
+"""Copy the readings of the MySQL table after afterID to the local archive.
+
+    This is the reverse case of pushToDB(), for when the table is ahead of the
+    archive (see the power-off bug above). Rows are fetched in ID order, in
+    chunks of chunkRows, and the archive is fsync'ed after each chunk; progress
+    is recorded in the state file as for pushToDB().
+    
+    Returns the number of readings copied.
+    
+    Arguments:
+    archive -- the local archive (a ProbeArchive), open for writing
+    connection -- a MySQLdb connection object to the relevant database
+    table -- the name of the MySQL table
+    afterID -- the latest ID already in the archive
+    stateFilepath -- the resync state file, or None to record no progress
+    chunkRows -- readings per chunk
+"""
+def pullFromDB(archive, connection, table, afterID, stateFilepath=None, chunkRows=RESYNC_CHUNK_ROWS):
+    state = {"direction": "pull", "fromID": afterID, "toID": queryLatestID(connection, table), "doneID": afterID, "started": int(time.time())}
+    cursor = connection.cursor()
+    n = 0
+    while True:
+        cursor.execute("SELECT * FROM " + table + " WHERE ID > %s ORDER BY ID LIMIT %s", (state["doneID"], chunkRows))
+        rows = cursor.fetchall()
+        if len(rows) == 0:
+            break
+        for row in rows:
+            archive.append(row[0], row[1], row[2], row[3])
+        archive.sync()
+        n += len(rows)
+        state["doneID"] = rows[-1][0]
+        if stateFilepath is not None:
+            writeResyncState(stateFilepath, state)
+    if stateFilepath is not None:
+        writeResyncState(stateFilepath, None)
+    return n
 
 """Test if MySQL db is synced with local archive, and if not, perform sync.
 
     Basic assumption is that entries are never deleted from either source, and
     are always ordered in the local archive by ID. Determines entries to sync by
     ID. Presumably the local archive is always at or ahead of the MySQL db, but
-    if the end-of-file bug occurred, a fix is implemented to import the lost
-    reading from the hosted db to the local one.
+    if the end-of-file bug occurred, the readings missing from the local archive
+    are imported from the hosted db. Both directions are copied in bulk, in
+    chunks, and an interrupted sync resumes where it stopped (see pushToDB and
+    pullFromDB).
     
     Arguments:
-    localArchiveFilepath -- filepath to the local archive (path + filename)
-    cursor -- a MySQLdb cursor object to the relevant database
+    archive -- the local archive (a ProbeArchive)
+    connection -- a MySQLdb connection object to the relevant database
     table -- the name of the MySQL table to sync
+    stateFilepath -- the resync state file
 """
-def syncDBwithLocal(localArchiveFilepath, connection, table):
+def syncDBwithLocal(archive, connection, table, stateFilepath=RESYNC_STATE_FILENAME):
     logger.debug("Testing local archive sync with db...")
     
-    # Once determined archive is safe to read as table, do so
-    localArchive = readTableFromFile(localArchiveFilepath)
+    # The archive was recovered when opened, so it is safe to read
+    latest = archive.latest()
     
-    if len(localArchive) == 0:
+    if latest is None:
         logger.debug("WARNING: local archive not initialized")
         logger.debug("Terminating sync routine and ProbeLogger script")
         quit()
-    if len(localArchive) == 1:
+    if latest[0] == 0:
         logger.debug("Local archive is empty, no sync required!")
         return
-    else:
-        latestID = max(list(map(lambda x: int(x[0]), localArchive)))
+    latestID = latest[0]
     logger.debug("Local archive latest ID: " + str(latestID))
     
-    cursor = connection.cursor()
-    cursor.execute("SELECT * FROM " + table + " ORDER BY ID DESC LIMIT 1", )
-    for row in cursor:
-        latestIDdb = row[0]
+    state = readResyncState(stateFilepath)
+    if state is not None:
+        logger.debug("Resuming interrupted " + state["direction"] + " sync, stopped at ID " + str(state["doneID"]) + " of " + str(state["toID"]))
     
+    latestIDdb = queryLatestID(connection, table)
     logger.debug("MySQL database latest ID: " + str(latestIDdb))
     diff = latestID - latestIDdb
     
     if diff > 0:
         logger.debug("Syncing " + str(diff) + " local entries to MySQL database...")
-        
-        for entry in localArchive[latestIDdb+1:]:
-            cursor.execute("INSERT INTO " + table + " VALUES (" + entry[0] + "," + entry[1] + "," + entry[2] + ","+ entry[3] + ")" )
-    
-        connection.commit() # must be called explicitly to make changes to the database
-        logger.debug("Entries synced")
+        n = pushToDB(archive, connection, table, latestIDdb, stateFilepath)[0]
+        logger.debug(str(n) + " entries synced")
     elif diff == 0:
+        writeResyncState(stateFilepath, None)
         logger.debug("Already synced")
     elif diff < 0:
         # this block is only reached if there are more MySQL entries than in the local
-        # file. this should only ever be 1 or 2, due to the power-off bug
+        # archive. this should only ever be 1 or 2, due to the power-off bug
         logger.debug("Applying bugfix...")
-        cursor = connection.cursor()
-        cursor.execute("SELECT * FROM " + table + " ORDER BY ID DESC LIMIT " + str(-diff), )
-        f = open(localArchiveFilepath,'a')
-        for row in cursor:
-            latestIDdb = row[0]
-            missingEntryLine = str(row[0]) + "\t" + str(row[1]) + "\t" + str(row[2]) + "\t" + str(row[3]) + "\n"
-            f.write(missingEntryLine)
-        logger.debug(str(-diff) + " entries synced from MySQL table to local archive.")
+        n = pullFromDB(archive, connection, table, latestID, stateFilepath)
+        logger.debug(str(n) + " entries synced from MySQL table to local archive.")
         logger.debug("Local archive and database re-synced.")
     else:
         logger.debug("WARNING: SYNC INVARIANT VIOLATED")
         logger.debug("Terminating sync routine and ProbeLogger script")
         quit()
 
-"""Routine to continuously log readings.
+"""Live window of the most recent readings, published for the live display.
 
+    Readings are kept in a ring buffer of fixed size, so memory use does not
+    grow with uptime. They are published as an append-only feed of JSON lines
+    ([ID, timestamp, temperature, humidity], one reading per line) in the public
+    html directory. The browser keeps the byte offset of the feed it has read,
+    and requests only the bytes appended since (an HTTP Range request on the
+    static file, see getGraphData.js).
+    
+    So the feed does not grow without limit either, it is rewritten with just
+    the window once it holds twice the window. The rewrite is atomic (rename),
+    and the browser detects it because the byte before its offset is no longer
+    a newline, or the next ID does not follow the last one it has; it then
+    reloads the whole feed.
+    
+    When the logger serves the window itself (see ProbeServer.py), no feed is
+    written and the window is only kept in memory. Functions in listeners are
+    called with each reading added, e.g. to push it to the browsers.
+    
     Arguments:
-    localArchiveFilepath -- filepath to the local archive (path + filename)
-    localOnly -- if True, only record readings to local archive
-    pin -- number of the GPIO pin to which the sensor data cable is connected
-    w -- measurement frequency, in seconds
+    feedFilename -- filepath to the feed (path + filename), or None to write
+                    no feed
+    window -- number of readings kept and published
 """
-def loggerRoutine(localArchiveFilepath, localOnly, pin, connection=None, table=None,w = 30):
+class LiveFeed(object):
     
-    if localOnly:
-        logger.debug("Launching logger routine in local-only mode")
-    else:
-        logger.debug("Launching logger routine in standard mode")
-        cursor = connection.cursor()
+    def __init__(self, feedFilename, window=LIVE_WINDOW):
+        self.feedFilename = feedFilename
+        self.window = window
+        self.readings = deque(maxlen=window)
+        self.listeners = []
+        self._feedLines = 0
+        self._feedFilestream = None
     
-    localArchive = readTableFromFile(localArchiveFilepath)
-    if len(localArchive) == 0:
-        startID = 1
-    else:
-        startID = max(list(map(lambda x: int(x[0]), localArchive))) + 1
-    id = startID
-    localFilestream = open(localArchiveFilepath,'a')
+    """Fill the window from archive entries and publish it.
     
-    jsonFilename = "/var/www/html/data.html"
+        Arguments:
+        entries -- archive entries ([ID, timestamp, temperature, humidity] as
+                   strings), oldest first. The null entry (ID 0) is skipped.
+    """
+    def load(self, entries):
+        for entry in entries:
+            if int(entry[0]) == 0:
+                continue
+            self.readings.append(self._feedRow(entry))
+        if self.feedFilename is not None:
+            self._rewrite()
     
-    logger.debug("Logging...")
+    """Add a reading to the window and to the feed.
+    
+        Arguments:
+        entry -- [ID, timestamp, temperature, humidity]
+    """
+    def append(self, entry):
+        row = self._feedRow(entry)
+        self.readings.append(row)
+        for listener in self.listeners:
+            listener(row)
+        if self.feedFilename is None:
+            return
+        if self._feedLines >= 2 * self.window:
+            self._rewrite()
+            return
+        self._feedFilestream.write(json.dumps(row) + "\n")
+        self._feedFilestream.flush()
+        self._feedLines += 1
+    
+    def close(self):
+        if self._feedFilestream is not None:
+            self._feedFilestream.close()
+            self._feedFilestream = None
+    
+    def _feedRow(self, entry):
+        return [int(entry[0]), int(entry[1]), float(entry[2]), float(entry[3])]
+    
+    """Replace the feed with the current window."""
+    def _rewrite(self):
+        self.close()
+        tmpFilename = self.feedFilename + ".tmp"
+        tmpFilestream = open(tmpFilename, 'w')
+        for row in self.readings:
+            tmpFilestream.write(json.dumps(row) + "\n")
+        tmpFilestream.close()
+        os.replace(tmpFilename, self.feedFilename)
+        self._feedLines = len(self.readings)
+        self._feedFilestream = open(self.feedFilename, 'a')
+
+"""Writes readings to the MySQL database on a background thread.
+
+    The logging routine hands each reading over with submit(), which never
+    blocks. The writer commits readings with executemany() every batchRows
+    readings or batchSeconds seconds, whichever comes first.
+    
+    The local archive is the write-ahead log: a reading is always in the
+    archive before it is submitted. So whenever the writer connects, or finds
+    that readings were skipped (e.g. dropped from a full queue), it looks up the
+    latest ID in the database and catches up from the archive (see pushToDB).
+    If the database
+    is unreachable, or the connection is lost, it retries with an increasing
+    delay instead of giving up.
+    
+    Arguments:
+    archiveDirectory -- the local archive directory
+    host,user,passwd,db -- MySQL db parameters provided in configuration file
+    table -- the name of the MySQL table to write to
+    connection -- an open MySQLdb connection to start with, or None
+    stateFilepath -- the resync state file used when catching up
+    batchRows -- maximum number of readings per commit
+    batchSeconds -- maximum seconds a reading waits for its commit
+"""
+class DBWriter(object):
+    
+    def __init__(self, archiveDirectory, host, user, passwd, db, table, connection=None, stateFilepath=RESYNC_STATE_FILENAME,
+                 batchRows=DEFAULT_DB_BATCH_ROWS, batchSeconds=DEFAULT_DB_BATCH_SECONDS):
+        self.archive = ProbeArchive.ProbeArchive(archiveDirectory, readOnly=True)
+        self.table = table
+        self.connection = connection
+        self.stateFilepath = stateFilepath
+        self.batchRows = batchRows
+        self.batchSeconds = batchSeconds
+        self.latestID = None # latest ID known to be in the database
+        self.errors = 0
+        self.insertCommand = insertStatement(table)
+        self._connectArgs = (host, user, passwd, db)
+        self._behind = True
+        self._queue = queue.Queue(maxsize=DB_QUEUE_SIZE)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="DBWriter")
+        self._thread.daemon = True
+    
+    def start(self):
+        self._thread.start()
+    
+    """Stop the writer, after it has written what it holds if it can.
+    
+        Arguments:
+        timeout -- maximum seconds to wait for the writer
+    """
+    def stop(self, timeout=None):
+        self._stopped.set()
+        self._thread.join(timeout)
+    
+    """Queue a reading for the database, without blocking.
     
-    while(True):
+        Arguments:
+        record -- (ID, timestamp, temperature, humidity), already in the archive
+    """
+    def submit(self, record):
         try:
-            ### get reading
-            humidity, temperature = Adafruit_DHT.read_retry(Adafruit_DHT.DHT22, pin)
-            humidity = round(humidity,2)
-            temperature = round(temperature,2)
-            timestamp = int(time.time())
-            
-            ### record reading in local archive
-            entryString = str(id) + "\t" + str(timestamp) + "\t" + str(temperature) + "\t" + str(humidity) + "\n"
-            localFilestream.write(entryString)
-            localFilestream.flush()
-            
-            ### update table and dump as JSON object to file in the public directory of LAMP server
-            ### ONLY write most recent 1000 readings (8+ hours of continuous data)
-            localArchive.append([str(id),str(timestamp),str(temperature),str(humidity)])
-            jsonFilestream = open(jsonFilename,'w')
-            if len(localArchive) > 1000:
-                json.dump(localArchive[-1000:],jsonFilestream)
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self._behind = True # the writer will pick it up from the archive
+    
+    def _run(self):
+        retryDelay = DB_RETRY_MIN
+        while True:
+            try:
+                if self.connection is None:
+                    self.connection = MySQLdb.connect(*self._connectArgs)
+                    logger.debug("DBWriter connected to database")
+                    self._behind = True
+                if self._behind:
+                    self._catchUp()
+                if self._stopped.is_set():
+                    self._writeBatch(self._takeBatch(0))
+                    return
+                self._writeBatch(self._takeBatch(self.batchSeconds))
+                retryDelay = DB_RETRY_MIN
+            except MySQLdb.Error as e:
+                self.errors += 1
+                logger.debug("DBWriter database error, retrying in " + str(retryDelay) + " seconds")
+                logger.debug(str(e))
+                self._disconnect()
+                if self._stopped.wait(retryDelay):
+                    return
+                retryDelay = min(2 * retryDelay, DB_RETRY_MAX)
+            except OSError as e:
+                # e.g. a segment compressed while it was being read; read again
+                logger.debug("DBWriter archive read failed, retrying: " + str(e))
+                self._behind = True
+                if self._stopped.wait(1):
+                    return
+    
+    def _disconnect(self):
+        try:
+            if self.connection is not None:
+                self.connection.close()
+        except MySQLdb.Error:
+            pass
+        self.connection = None
+        self._behind = True
+    
+    """Commit all readings of the archive after the latest in the database."""
+    def _catchUp(self):
+        self.latestID = queryLatestID(self.connection, self.table)
+        self._behind = False
+        n, self.latestID = pushToDB(self.archive, self.connection, self.table, self.latestID, self.stateFilepath)
+        if n > 0:
+            logger.debug("DBWriter caught up " + str(n) + " entries from local archive")
+    
+    """Return the queued readings, waiting up to maxWait seconds for batchRows
+    of them (and at most 1 second for the first, to check for stop() often)."""
+    def _takeBatch(self, maxWait):
+        batch = []
+        deadline = None
+        while len(batch) < self.batchRows:
+            if deadline is None:
+                timeout = min(maxWait, 1)
             else:
-                json.dump(localArchive[1:],jsonFilestream) # skip null entry at beginning
-            jsonFilestream.close()
-            
-            ### update MySQL
-            if not localOnly:
-                command = Template('INSERT INTO $Table VALUES ($ID, $Time, $Temperature, $Humidity);')
-                command = command.substitute(Table=table, ID=id, Time=timestamp, Temperature=temperature, Humidity=humidity)
-                cursor.execute(command)
-                connection.commit() # must be called explicitly to make changes to the database
-            
-            # Note the first entry of this batch in the log file
-            if id == startID:
-                logger.debug("First entry:")
-                logger.debug(entryString.strip())
-            
-            time.sleep(30)
-            id += 1
-            
-        except TypeError:
-            if humidity is None or temperature is None:
-                logger.debug("Probe reading failed!")
-                logger.debug("Initiating ProbeLogger termination...")
-                localFilestream.close()
-                jsonFilestream.close()
-                # Note the final entry of this batch in the log file
-                logger.debug("Last entry:")
-                logger.debug(entryString)
-                logger.debug('ProbeLogger shutdown at ' + str(time.time()))
+                timeout = deadline - time.monotonic()
+            try:
+                if timeout <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+            if deadline is None:
+                deadline = time.monotonic() + maxWait
+        return batch
+    
+    def _writeBatch(self, batch):
+        batch = list(filter(lambda x: x[0] > self.latestID, batch)) # already caught up from the archive
+        if len(batch) == 0:
+            return
+        if batch[0][0] != self.latestID + 1:
+            self._behind = True # readings skipped; the archive has them
+            return
+        self._insert(batch)
+    
+    def _insert(self, batch):
+        cursor = self.connection.cursor()
+        inserted = cursor.executemany(self.insertCommand, batch)
+        self.connection.commit()
+        if inserted is not None and inserted < len(batch):
+            logger.debug("WARNING: " + str(len(batch) - inserted) + " IDs up to " + str(batch[-1][0]) + " already in the database")
+        self.latestID = batch[-1][0]
+
+"""A sensor attached to this Pi, and where its readings go.
+
+    Arguments:
+    name -- name of the sensor, for the log
+    pin -- number of the GPIO pin to which the sensor data cable is connected
+    archive -- the sensor's local archive (a ProbeArchive), open for writing
+    liveFeed -- the sensor's LiveFeed, or None
+    dbWriter -- the sensor's started DBWriter, or None to only record readings
+                to local archive
+    rollups -- the sensor's ProbeRollups.Rollups, or None
+"""
+class Sensor(object):
+    
+    def __init__(self, name, pin, archive, liveFeed=None, dbWriter=None, rollups=None):
+        self.name = name
+        self.pin = pin
+        self.archive = archive
+        self.liveFeed = liveFeed
+        self.dbWriter = dbWriter
+        self.rollups = rollups
+        latest = archive.latest()
+        self.nextID = 1 if latest is None else latest[0] + 1
+        self.lastSample = None
+        self.failures = 0 # failed readings
+        self.overruns = 0 # ticks skipped because a reading took too long
+        self.sinkErrors = 0
+    
+    """Return the functions each reading is handed to once it is archived."""
+    def sinks(self):
+        sinks = []
+        if self.dbWriter is not None:
+            sinks.append(("mysql", self.dbWriter.submit))
+        if self.liveFeed is not None:
+            sinks.append(("liveFeed", self.liveFeed.append))
+        if self.rollups is not None:
+            sinks.append(("rollups", self.rollups.add))
+        return sinks
+    
+    """Return the sensor's part of the logger's heartbeat (see ProbeStatus)."""
+    def status(self):
+        status = {
+            "pin": self.pin,
+            "lastSample": self.lastSample,
+            "lastID": self.nextID - 1,
+            "failures": self.failures,
+            "overruns": self.overruns,
+            "sinkErrors": self.sinkErrors
+        }
+        if self.dbWriter is not None:
+            status["db"] = {
+                "connected": self.dbWriter.connection is not None,
+                "latestID": self.dbWriter.latestID,
+                "errors": self.dbWriter.errors
+            }
+        return status
+    
+    def close(self):
+        if self.dbWriter is not None:
+            self.dbWriter.stop(30)
+        self.archive.close()
+        if self.liveFeed is not None:
+            self.liveFeed.close()
+
+"""Take a reading from a DHT22 sensor, retrying for at most about one sampling
+interval. Returns (humidity, temperature), both None if every attempt failed.
+
+    Arguments:
+    pin -- number of the GPIO pin to which the sensor data cable is connected
+    w -- measurement frequency, in seconds
+"""
+def readSensor(pin, w):
+    retries = max(1, int(w // DHT_RETRY_DELAY) - 1)
+    return Adafruit_DHT.read_retry(Adafruit_DHT.DHT22, pin, retries=retries, delay_seconds=DHT_RETRY_DELAY)
+
+"""Sample a sensor on absolute deadlines, every w seconds, and queue readings.
+
+    Ticks are computed from the start time rather than from the end of the
+    previous reading, so the cadence does not drift. A reading that takes longer
+    than w seconds skips the ticks it overran.
+    
+    Arguments:
+    sensor -- the Sensor
+    w -- measurement frequency, in seconds
+    executor -- executor running the blocking sensor reads
+    archiveQueue -- asyncio queue of readings to archive
+"""
+async def sampleSensor(sensor, w, executor, archiveQueue):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time()
+    while True:
+        humidity, temperature = await loop.run_in_executor(executor, readSensor, sensor.pin, w)
+        timestamp = int(time.time())
+        if humidity is None or temperature is None:
+            sensor.failures += 1
+            logger.debug(sensor.name + ": probe reading failed! (" + str(sensor.failures) + " failures)")
+        else:
+            archiveQueue.put_nowait((sensor.nextID, timestamp, round(temperature,2), round(humidity,2)))
+            sensor.nextID += 1
+            sensor.lastSample = timestamp
+        
+        deadline += w
+        now = loop.time()
+        if now > deadline:
+            missed = int((now - deadline) // w) + 1
+            logger.debug(sensor.name + ": reading overran, skipping " + str(missed) + " tick(s)")
+            sensor.overruns += missed
+            deadline += missed * w
+        await asyncio.sleep(deadline - now)
+
+"""Archive the queued readings of a sensor, then hand them to its other sinks.
+
+    A reading only goes to the other sinks once it is in the archive, which the
+    MySQL writer relies on.
+    
+    Arguments:
+    sensor -- the Sensor
+    archiveQueue -- asyncio queue of readings to archive
+    sinkQueues -- asyncio queues of the other sinks
+"""
+async def archiveSink(sensor, archiveQueue, sinkQueues):
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=1)
+    startID = sensor.nextID
+    while True:
+        record = await archiveQueue.get()
+        try:
+            await loop.run_in_executor(executor, sensor.archive.append, *record)
+        except Exception as e:
+            sensor.sinkErrors += 1
+            logger.debug(sensor.name + ": failed to archive entry " + str(record[0]) + ": " + str(e))
+            continue
+        # Note the first entry of this batch in the log file
+        if record[0] == startID:
+            logger.debug(sensor.name + " first entry:")
+            logger.debug("\t".join(map(str, record)))
+        for sinkQueue in sinkQueues:
+            sinkQueue.put_nowait(record)
+
+"""Hand queued readings to a sink function, on the sink's own thread, so a
+slow sink delays neither the sampling nor the other sinks.
+
+    Arguments:
+    sensor -- the Sensor
+    name -- name of the sink, for the log
+    sinkQueue -- asyncio queue of readings for the sink
+    handle -- function taking a reading
+"""
+async def runSink(sensor, name, sinkQueue, handle):
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=1)
+    while True:
+        record = await sinkQueue.get()
+        try:
+            await loop.run_in_executor(executor, handle, record)
+        except Exception as e:
+            sensor.sinkErrors += 1
+            logger.debug(sensor.name + ": " + name + " failed on entry " + str(record[0]) + ": " + str(e))
+
+"""Return the logger's heartbeat (see ProbeStatus).
+
+    Arguments:
+    sensors -- list of Sensor
+    started -- time the logger was launched
+"""
+def heartbeatStatus(sensors, started):
+    return {
+        "pid": os.getpid(),
+        "started": started,
+        "heartbeat": time.time(),
+        "sensors": dict((sensor.name, sensor.status()) for sensor in sensors)
+    }
+
+"""Publish the logger's heartbeat every ProbeStatus.HEARTBEAT_INTERVAL seconds.
+
+    Arguments:
+    sensors -- list of Sensor
+    started -- time the logger was launched
+    server -- ProbeServer also serving the heartbeat, or None
+"""
+async def heartbeat(sensors, started, server=None):
+    while True:
+        status = heartbeatStatus(sensors, started)
+        if server is not None:
+            server.publishStatus(status)
+        try:
+            ProbeStatus.writeStatus(status)
+        except OSError as e:
+            logger.debug("Failed to write heartbeat: " + str(e))
+        await asyncio.sleep(ProbeStatus.HEARTBEAT_INTERVAL)
+
+"""Routine to continuously log readings from all sensors.
+
+    Each sensor is sampled by its own task; readings go through queues to the
+    archive, then to the other sinks (see Sensor.sinks), each in its own task.
+    Another task publishes the logger's heartbeat.
+    
+    Arguments:
+    sensors -- list of Sensor
+    w -- measurement frequency, in seconds
+    started -- time the logger was launched
+    server -- ProbeServer serving the sensors' data, or None
+"""
+async def _loggerRoutine(sensors, w, started, server):
+    readExecutor = ThreadPoolExecutor(max_workers=len(sensors))
+    tasks = [heartbeat(sensors, started, server)]
+    for sensor in sensors:
+        archiveQueue = asyncio.Queue()
+        sinkQueues = []
+        for name, handle in sensor.sinks():
+            sinkQueue = asyncio.Queue()
+            sinkQueues.append(sinkQueue)
+            tasks.append(runSink(sensor, name, sinkQueue, handle))
+        tasks.append(archiveSink(sensor, archiveQueue, sinkQueues))
+        tasks.append(sampleSensor(sensor, w, readExecutor, archiveQueue))
+    await asyncio.gather(*tasks)
+
+"""Routine to continuously log readings.
+
+    Arguments:
+    sensors -- list of Sensor
+    w -- measurement frequency, in seconds
+    server -- ProbeServer serving the sensors' data, or None
+"""
+def loggerRoutine(sensors, w = 30, server = None):
+    started = time.time()
+    for sensor in sensors:
+        if sensor.dbWriter is None:
+            logger.debug(sensor.name + ": launching logger routine in local-only mode")
+        else:
+            logger.debug(sensor.name + ": launching logger routine in standard mode")
+    logger.debug("Logging...")
+    if server is not None:
+        server.start()
+    try:
+        asyncio.run(_loggerRoutine(sensors, w, started, server))
+    finally:
+        logger.debug("Initiating ProbeLogger termination...")
+        for sensor in sensors:
+            sensor.close()
+        status = heartbeatStatus(sensors, started)
+        status["stopped"] = time.time()
+        ProbeStatus.writeStatus(status)
+        if server is not None:
+            server.publishStatus(status)
+            server.stop()
+        logger.debug('ProbeLogger shutdown at ' + str(time.time()))
 
 """Executable"""
 if __name__ == "__main__":
@@ -315,20 +891,80 @@ if __name__ == "__main__":
     logger.debug('Logger launched at ' + str(time.asctime()))
     
     probeName, unitNumber, pin, host, user, passwd, db, table = loadConf("ProbeLogger.conf")
-    localArchiveFilepath = "ProbeLog.csv"
+    options = loadOptions("ProbeLogger.conf")
+    w = float(options.get("sampleInterval", 30))
+    # With "httpPort = <port>", the live window, rollups and heartbeat are
+    # served from memory (see ProbeServer.py) instead of files in /var/www/html,
+    # and bundles of the local archive are served to SyncProbeDBs.py
+    httpPort = int(options["httpPort"]) if "httpPort" in options else None
+    legacyArchiveFilepath = "ProbeLog.csv"
     
-    if not os.path.isfile(localArchiveFilepath):
-        logger.debug("WARNING: local archive file not found!")
-        logger.debug("Terminating sync routine and ProbeLogger script")
-        quit()
+    # The sensor of the configuration, then any extra sensors on the same Pi,
+    # configured as "extraSensors = <pin>:<table>,<pin>:<table>". Each has its
+    # own local archive, MySQL table, live feed and rollups, told apart by a
+    # suffix to their file names.
+    sensorConfs = [(probeName, pin, table, "")]
+    if "extraSensors" in options:
+        for extra in options["extraSensors"].split(","):
+            extraPin, extraTable = extra.split(":")
+            sensorConfs.append((probeName + "_" + extraTable, int(extraPin), extraTable, "_" + extraTable))
+    
+    archives = []
+    for sensorName, sensorPin, sensorTable, suffix in sensorConfs:
+        localArchiveDirectory = "ProbeArchive" + suffix
+        # Opening the archive truncates any corrupted data left by a power cut
+        archive = ProbeArchive.ProbeArchive(localArchiveDirectory,
+                                            maxSegmentBytes=int(options.get("archiveSegmentBytes", ProbeArchive.DEFAULT_MAX_SEGMENT_BYTES)),
+                                            fsyncInterval=float(options.get("archiveFsyncInterval", ProbeArchive.DEFAULT_FSYNC_INTERVAL)))
+        if archive.latest() is None and suffix == "" and os.path.isfile(legacyArchiveFilepath):
+            logger.debug("Importing " + legacyArchiveFilepath + " into the local archive...")
+            logger.debug(str(archive.importLegacy(legacyArchiveFilepath)) + " entries imported")
+        elif archive.latest() is None and suffix != "":
+            # a new extra sensor starts from the null entry, as its MySQL table does
+            logger.debug("Initializing local archive " + localArchiveDirectory + " with the null entry")
+            archive.append(0, 0, 0, 0)
+            archive.sync()
+        
+        if archive.latest() is None:
+            logger.debug("WARNING: local archive " + localArchiveDirectory + " not initialized!")
+            logger.debug("Terminating sync routine and ProbeLogger script")
+            quit()
+        archives.append(archive)
+    
+    for sensorConf in sensorConfs:
+        testSensor(sensorConf[1])
     
-    bugFixLocal(localArchiveFilepath)
-    testSensor(pin)
     connection = testDB(host,user,passwd,db)
-      
-    if connection is None:
-        loggerRoutine(localArchiveFilepath, True, pin, w=30)
-    else:
-        syncDBwithLocal(localArchiveFilepath, connection, table)
-        loggerRoutine(localArchiveFilepath, False, pin, connection, table, w=30)
+    sensors = []
+    for sensorConf, archive in zip(sensorConfs, archives):
+        sensorName, sensorPin, sensorTable, suffix = sensorConf
+        stateFilepath = "ProbeResync" + suffix + ".state"
+        if connection is not None and len(sensors) > 0:
+            # each writer thread needs its own connection
+            try:
+                connection = MySQLdb.connect(host,user,passwd,db)
+            except MySQLdb.Error:
+                connection = None
+        if connection is not None:
+            syncDBwithLocal(archive, connection, sensorTable, stateFilepath)
+        else:
+            logger.debug("Database unreachable: the writer thread will keep retrying")
+        dbWriter = DBWriter(archive.directory, host, user, passwd, db, sensorTable, connection, stateFilepath,
+                            batchRows=int(options.get("dbBatchRows", DEFAULT_DB_BATCH_ROWS)),
+                            batchSeconds=float(options.get("dbBatchSeconds", DEFAULT_DB_BATCH_SECONDS)))
+        dbWriter.start()
+        if httpPort is None:
+            liveFeed = LiveFeed("/var/www/html/feed" + suffix + ".jsonl")
+            rollups = ProbeRollups.Rollups("ProbeRollups" + suffix, "/var/www/html/rollups" + suffix)
+        else:
+            liveFeed = LiveFeed(None)
+            rollups = ProbeRollups.Rollups("ProbeRollups" + suffix)
+        liveFeed.load(archive.tail(LIVE_WINDOW))
+        logger.debug(sensorName + ": " + str(rollups.replay(archive)) + " entries replayed into rollups")
+        sensors.append(Sensor(sensorName, sensorPin, archive, liveFeed, dbWriter, rollups))
     
+    server = None
+    if httpPort is not None:
+        server = ProbeServer.ProbeServer(sensors, httpPort)
+        logger.debug("Serving live data on port " + str(httpPort))
+    loggerRoutine(sensors, w, server)
@@ -0,0 +1,215 @@
+"""Running minute, hour and day aggregates of probe readings.
+
+For each resolution, the readings of the current bucket (minute, hour or UTC
+day) are summed up as they arrive: count, and min, max and sum of temperature
+and humidity, so each reading costs O(1). When a reading falls in a new bucket,
+the previous one is closed: it is appended to a small side table for its
+resolution (minute.tsv, hour.tsv, day.tsv in the rollup directory), and the
+most recent closed buckets are published as JSON (e.g. rollups_hour.json), so
+week- and month-scale plots never have to scan the raw archive.
+
+Table and JSON rows are: bucket start (UNIX time), count, temperature min, max
+and mean, humidity min, max and mean.
+
+On startup, replay() feeds the readings archived since the last bucket written
+back in, so the open buckets (and any bucket closed but not written when the
+logger stopped) are restored.
+"""
+import json
+import os
+
+# name, bucket length in seconds, number of closed buckets published as JSON
+RESOLUTIONS = [("minute", 60, 1440), ("hour", 3600, 24 * 40), ("day", 86400, 400)]
+TABLE_HEADER = "start\tcount\ttempMin\ttempMax\ttempMean\trhMin\trhMax\trhMean"
+TAIL_BLOCK = 4096 # bytes read at a time when reading the end of a table
+REPLAY_CHUNK = 2880 # readings fetched at a time when replaying (a day at 30 s)
+
+"""Return the last count lines of a text file, oldest first, reading only the
+end of the file.
+
+    Arguments:
+    filepath -- the file
+    count -- number of lines
+"""
+def readLastLines(filepath, count):
+    with open(filepath, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        data = b""
+        while pos > 0 and data.count(b"\n") <= count:
+            readSize = min(TAIL_BLOCK, pos)
+            pos -= readSize
+            f.seek(pos)
+            data = f.read(readSize) + data
+    lines = data.decode("ascii").split("\n")
+    if pos > 0:
+        lines = lines[1:] # partial
+    return list(filter(lambda x: x != "", lines))[-count:]
+
+"""The running aggregate of one bucket.
+
+    Arguments:
+    start -- start of the bucket (UNIX time)
+"""
+class Bucket(object):
+
+    def __init__(self, start):
+        self.start = start
+        self.count = 0
+        self.tempMin = self.tempMax = self.tempSum = 0.0
+        self.rhMin = self.rhMax = self.rhSum = 0.0
+
+    def add(self, temperature, humidity):
+        if self.count == 0:
+            self.tempMin = self.tempMax = temperature
+            self.rhMin = self.rhMax = humidity
+        else:
+            self.tempMin = min(self.tempMin, temperature)
+            self.tempMax = max(self.tempMax, temperature)
+            self.rhMin = min(self.rhMin, humidity)
+            self.rhMax = max(self.rhMax, humidity)
+        self.tempSum += temperature
+        self.rhSum += humidity
+        self.count += 1
+
+    """Return the bucket as a table/JSON row."""
+    def row(self):
+        return [self.start, self.count, self.tempMin, self.tempMax, round(self.tempSum / self.count, 3),
+                self.rhMin, self.rhMax, round(self.rhSum / self.count, 3)]
+
+"""Minute, hour and day aggregates of one probe's readings. See the module
+docstring.
+
+    Arguments:
+    directory -- directory of the side tables; created if needed
+    jsonPrefix -- prefix of the JSON files (e.g. "/var/www/html/rollups"), or
+                  None to publish none
+"""
+class Rollups(object):
+
+    def __init__(self, directory, jsonPrefix=None):
+        self.directory = directory
+        self.jsonPrefix = jsonPrefix
+        self.skipped = 0 # readings older than the open bucket (e.g. clock set back)
+        self._open = {}
+        self._closed = {}
+        self._written = {}
+        os.makedirs(directory, exist_ok=True)
+        for name, length, keep in RESOLUTIONS:
+            self._open[name] = None
+            rows = []
+            tableFilepath = self._tableFilepath(name)
+            if os.path.isfile(tableFilepath):
+                rows = list(map(self._parseRow, filter(lambda x: x != TABLE_HEADER, readLastLines(tableFilepath, keep))))
+            else:
+                with open(tableFilepath, 'w') as f:
+                    f.write(TABLE_HEADER + "\n")
+            self._closed[name] = rows
+            self._written[name] = rows[-1][0] + length if len(rows) > 0 else None
+
+    def _tableFilepath(self, name):
+        return os.path.join(self.directory, name + ".tsv")
+
+    def _parseRow(self, line):
+        vals = line.split("\t")
+        return [int(vals[0]), int(vals[1])] + list(map(float, vals[2:]))
+
+    """Return the time from which archived readings must be fed back in to
+    restore the aggregates.
+
+        Resolutions with no bucket written yet start at the given time.
+
+        Arguments:
+        default -- where to start for a resolution with no bucket written yet
+    """
+    def resumeFrom(self, default):
+        for name in self._written:
+            if self._written[name] is None:
+                self._written[name] = default
+        return min(self._written.values())
+
+    """Add a reading to the aggregates.
+
+        Arguments:
+        record -- (ID, timestamp, temperature, humidity)
+    """
+    def add(self, record):
+        timestamp, temperature, humidity = record[1], record[2], record[3]
+        for name, length, keep in RESOLUTIONS:
+            start = timestamp - timestamp % length
+            if self._written[name] is not None and start < self._written[name]:
+                continue # already in a written bucket (replay)
+            bucket = self._open[name]
+            if bucket is None or start > bucket.start:
+                if bucket is not None:
+                    self._close(name, length, keep, bucket)
+                bucket = Bucket(start)
+                self._open[name] = bucket
+            elif start < bucket.start:
+                if name == RESOLUTIONS[0][0]:
+                    self.skipped += 1
+                continue
+            bucket.add(temperature, humidity)
+
+    """Write a closed bucket to its table, and publish the latest closed buckets."""
+    def _close(self, name, length, keep, bucket):
+        row = bucket.row()
+        with open(self._tableFilepath(name), 'a') as f:
+            f.write("\t".join(map(str, row)) + "\n")
+        closed = self._closed[name]
+        closed.append(row)
+        if len(closed) > keep:
+            del closed[:len(closed) - keep]
+        self._written[name] = bucket.start + length
+        if self.jsonPrefix is not None:
+            self.writeJSON(name)
+
+    """Return the latest closed buckets of a resolution, oldest first, as rows.
+
+        Arguments:
+        name -- "minute", "hour" or "day"
+    """
+    def rows(self, name):
+        return list(self._closed[name])
+
+    """Publish the latest closed buckets of a resolution as JSON (replaced
+    atomically, by rename).
+
+        Arguments:
+        name -- "minute", "hour" or "day"
+    """
+    def writeJSON(self, name):
+        jsonFilename = self.jsonPrefix + "_" + name + ".json"
+        tmpFilename = jsonFilename + ".tmp"
+        jsonFilestream = open(tmpFilename, 'w')
+        json.dump(self._closed[name], jsonFilestream)
+        jsonFilestream.close()
+        os.replace(tmpFilename, jsonFilename)
+
+    """Feed back in the archived readings not yet in a written bucket.
+
+        Returns the number of readings replayed.
+
+        Arguments:
+        archive -- the probe's ProbeArchive
+    """
+    def replay(self, archive):
+        latest = archive.latest()
+        if latest is None:
+            return 0
+        # aggregates start from the day of the latest reading
+        replayFrom = self.resumeFrom(latest[1] - latest[1] % RESOLUTIONS[-1][1])
+        count = REPLAY_CHUNK
+        records = archive.tail(count)
+        while len(records) == count and records[0][1] >= replayFrom:
+            count *= 2
+            records = archive.tail(count)
+        n = 0
+        for record in records:
+            if record[0] > 0 and record[1] >= replayFrom: # skip the null entry
+                self.add(record)
+                n += 1
+        if self.jsonPrefix is not None:
+            for name, length, keep in RESOLUTIONS:
+                self.writeJSON(name)
+        return n
@@ -0,0 +1,362 @@
+"""Small HTTP server, embedded in ProbeLogger.py, for the live display.
+
+Serves the logger's in-memory state, so the web page no longer needs files in
+the public html folder rewritten every reading:
+
+/live?sensor=<name>&since=<ID>
+    readings of the live window ([ID, timestamp, temperature, humidity]) with
+    an ID above since; the whole window if since is omitted, or older than the
+    window (the client then sees the IDs do not follow its own)
+/rollups?sensor=<name>&resolution=<minute|hour|day>&since=<start>
+    closed buckets of the rollups (see ProbeRollups.py) starting after since
+/status
+    the logger's latest heartbeat (see ProbeStatus.py)
+/events?sensor=<name>
+    a Server-Sent Events stream, pushing each reading of the sensor the moment
+    it enters the live window, and each status change (see below)
+/bundle?table=<table>&after=<ID>&limit=<count>
+    the readings of the sensor's local archive after an ID (at most limit, and
+    BUNDLE_MAX_ROWS), as a compressed, checksummed bundle (see
+    ProbeArchive.packBundle), for SyncProbeDBs.py to fetch instead of querying
+    MySQL row by row. The sensor can be named by its MySQL table.
+
+sensor defaults to the first sensor of the logger. Other responses are JSON,
+carry an ETag derived from the state they were made from, and are gzipped if
+the client accepts it. A request whose If-None-Match matches gets 304 Not Modified without
+the response being built, so polling a window that has not changed is nearly
+free. The page is served by the web server on port 80, so responses allow
+cross-origin requests.
+
+Events of the stream:
+window   the whole live window, as /live returns it; sent first, and instead of
+         the missed readings when the client is too far behind
+reading  one reading; its event ID is the reading ID
+status   the heartbeat, without what changes with every reading (last sample,
+         last ID, latest ID in the database); sent first, then when it changes
+The event ID is always the ID of the latest reading sent, so a browser
+reconnecting with Last-Event-ID only gets the readings it missed. Each open
+stream holds a thread, waiting on a condition the logger notifies.
+"""
+import gzip
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+from urllib.parse import parse_qs, urlsplit
+import ProbeArchive
+
+DEFAULT_PORT = 8080
+GZIP_MIN_BYTES = 512 # smaller responses are sent as is
+GZIP_LEVEL = 6
+CACHE_ENTRIES = 64 # responses kept, already encoded, for other clients
+KEEPALIVE_INTERVAL = 15 # seconds between comments on an idle event stream
+RETRY_MILLISECONDS = 5000 # delay before the browser reconnects a stream
+BUNDLE_MAX_ROWS = 50000 # readings per bundle, at most
+
+"""Serves the live window, rollups and heartbeat of the logger's sensors over
+HTTP, on a background thread. See the module docstring.
+
+    Arguments:
+    sensors -- list of ProbeLogger.Sensor; their liveFeed and rollups are read
+    port -- TCP port to listen on
+    host -- address to listen on; all interfaces by default
+"""
+class ProbeServer(object):
+
+    def __init__(self, sensors, port=DEFAULT_PORT, host=""):
+        self.sensors = sensors
+        self.status = None # latest heartbeat, see publishStatus
+        self._cache = {}
+        self._cacheLock = threading.Lock()
+        self._changed = threading.Condition()
+        self._version = 0 # incremented on every reading and status change
+        self._stopping = False
+        for sensor in sensors:
+            if sensor.liveFeed is not None:
+                sensor.liveFeed.listeners.append(self.notify)
+        self._httpd = ThreadingHTTPServer((host, port), ProbeRequestHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.probeServer = self
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="ProbeServer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._changed:
+            self._stopping = True
+            self._changed.notify_all()
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._httpd.server_close()
+
+    """Wake the event streams; called by the logger on each reading.
+
+        Arguments:
+        row -- the reading added to a live window (unused)
+    """
+    def notify(self, row=None):
+        with self._changed:
+            self._version += 1
+            self._changed.notify_all()
+
+    """Set the heartbeat served, and push it to the event streams if it
+    changed.
+
+        Arguments:
+        status -- the heartbeat (see ProbeLogger.heartbeatStatus)
+    """
+    def publishStatus(self, status):
+        changed = self.status is None or statusEvent(status) != statusEvent(self.status)
+        self.status = status
+        if changed:
+            self.notify()
+
+    """Wait until the version differs from the given one, the server stops, or
+    timeout seconds elapse. Returns the current version, or None if the server
+    is stopping and there is nothing more to send.
+
+        Arguments:
+        version -- the version last seen
+        timeout -- maximum seconds to wait
+    """
+    def waitForChange(self, version, timeout):
+        with self._changed:
+            self._changed.wait_for(lambda: self._version != version or self._stopping, timeout)
+            if self._stopping and self._version == version:
+                return None
+            return self._version
+
+    def _sensor(self, query):
+        name = query.get("sensor")
+        table = query.get("table")
+        if name is None and table is None:
+            return self.sensors[0]
+        for sensor in self.sensors:
+            if sensor.name == name:
+                return sensor
+            if table is not None and sensor.dbWriter is not None and sensor.dbWriter.table == table:
+                return sensor
+        return None
+
+    """Return (status code, bundle) for a /bundle request, or (status code,
+    error message).
+
+        The archive is read through its own read-only instance, as the
+        logger's instance is being appended to on another thread.
+
+        Arguments:
+        query -- dict of query parameters
+    """
+    def bundle(self, query):
+        try:
+            afterID = int(query.get("after", "0"))
+            limit = min(int(query.get("limit", BUNDLE_MAX_ROWS)), BUNDLE_MAX_ROWS)
+        except ValueError:
+            return (400, "after and limit must be integers")
+        sensor = self._sensor(query)
+        if sensor is None:
+            return (404, "no such sensor")
+        archive = ProbeArchive.ProbeArchive(sensor.archive.directory, readOnly=True)
+        return (200, archive.exportBundle(afterID, limit))
+
+    """Return (status code, ETag, function building the JSON object) for a
+    request, or (status code, None, error message).
+
+        The ETag is computed from the state alone, so a client that already has
+        the response costs no more than this.
+
+        Arguments:
+        path -- path of the request
+        query -- dict of query parameters
+    """
+    def route(self, path, query):
+        try:
+            since = int(query["since"]) if "since" in query else None
+        except ValueError:
+            return (400, None, "since must be an integer")
+        if path == "/status":
+            status = self.status
+            if status is None:
+                return (503, None, "no heartbeat yet")
+            return (200, "status-" + repr(status["heartbeat"]), lambda: status)
+        sensor = self._sensor(query)
+        if sensor is None:
+            return (404, None, "no sensor " + query.get("sensor", query.get("table")))
+        if path == "/live":
+            if sensor.liveFeed is None:
+                return (404, None, "no live window")
+            readings = list(sensor.liveFeed.readings)
+            if len(readings) == 0:
+                return (200, "live-" + sensor.name + "-empty", lambda: [])
+            firstID, lastID = readings[0][0], readings[-1][0]
+            if since is None or since < firstID - 1:
+                since = firstID - 1
+            etag = "live-" + sensor.name + "-" + str(firstID) + "-" + str(lastID) + "-" + str(since)
+            return (200, etag, lambda: readings[max(0, since - firstID + 1):])
+        if path == "/rollups":
+            resolution = query.get("resolution", "minute")
+            if sensor.rollups is None or resolution not in ("minute", "hour", "day"):
+                return (404, None, "no rollups " + resolution)
+            rows = sensor.rollups.rows(resolution)
+            if len(rows) == 0:
+                return (200, "rollups-" + sensor.name + "-" + resolution + "-empty", lambda: [])
+            etag = "rollups-" + sensor.name + "-" + resolution + "-" + str(rows[0][0]) + "-" + str(rows[-1][0]) + "-" + str(since)
+            return (200, etag, lambda: rows if since is None else [row for row in rows if row[0] > since])
+        return (404, None, "not found")
+
+    """Return (body, gzipped body) of a response, built once per ETag.
+
+        Arguments:
+        key -- ETag of the response, as returned by route()
+        build -- function building the JSON object
+    """
+    def encode(self, key, build):
+        with self._cacheLock:
+            cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+        body = json.dumps(build(), separators=(",", ":")).encode("ascii")
+        gzipped = None
+        if len(body) >= GZIP_MIN_BYTES:
+            gzipped = gzip.compress(body, GZIP_LEVEL)
+        with self._cacheLock:
+            if len(self._cache) >= CACHE_ENTRIES:
+                self._cache.clear()
+            self._cache[key] = (body, gzipped)
+        return (body, gzipped)
+
+"""Return the part of a heartbeat sent as status event: what does not change
+with every reading.
+
+    Arguments:
+    status -- the heartbeat
+"""
+def statusEvent(status):
+    event = dict((k, v) for k, v in status.items() if k != "heartbeat")
+    sensors = {}
+    for name, sensor in status["sensors"].items():
+        sensor = dict((k, v) for k, v in sensor.items() if k not in ("lastSample", "lastID"))
+        if "db" in sensor:
+            sensor["db"] = dict((k, v) for k, v in sensor["db"].items() if k != "latestID")
+        sensors[name] = sensor
+    event["sensors"] = sensors
+    return event
+
+"""Return the text of one Server-Sent Event.
+
+    Arguments:
+    name -- event type
+    data -- JSON-serializable payload
+    eventID -- event ID, or None for none
+"""
+def formatEvent(name, data, eventID=None):
+    text = "event: " + name + "\n"
+    if eventID is not None:
+        text += "id: " + str(eventID) + "\n"
+    return text + "data: " + json.dumps(data, separators=(",", ":")) + "\n\n"
+
+class ProbeRequestHandler(BaseHTTPRequestHandler):
+
+    def do_OPTIONS(self):
+        # CORS preflight, for the If-None-Match header
+        self.send_response(204)
+        self._sendCORSHeaders()
+        self.send_header("Access-Control-Allow-Methods", "GET")
+        self.send_header("Access-Control-Allow-Headers", "If-None-Match, Last-Event-ID")
+        self.send_header("Access-Control-Max-Age", "86400")
+        self.end_headers()
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = dict((name, values[-1]) for name, values in parse_qs(url.query).items())
+        probeServer = self.server.probeServer
+        if url.path == "/events":
+            self._serveEvents(probeServer, query)
+            return
+        if url.path == "/bundle":
+            code, body = probeServer.bundle(query)
+            if code != 200:
+                self._sendBody(code, body.encode("ascii"), "text/plain")
+            else:
+                self._sendBody(code, body, "application/octet-stream", [("Cache-Control", "no-cache")])
+            return
+        code, key, build = probeServer.route(url.path, query)
+        if key is None:
+            self._sendBody(code, build.encode("ascii"), "text/plain")
+            return
+        gzipOK = "gzip" in self.headers.get("Accept-Encoding", "")
+        etag = '"' + key + ("-gz" if gzipOK else "") + '"'
+        if etag in map(lambda x: x.strip(), self.headers.get("If-None-Match", "").split(",")):
+            self.send_response(304)
+            self._sendCORSHeaders()
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        body, gzipped = probeServer.encode(key, build)
+        headers = [("ETag", etag), ("Cache-Control", "no-cache"), ("Vary", "Accept-Encoding")]
+        if gzipOK and gzipped is not None:
+            body = gzipped
+            headers.append(("Content-Encoding", "gzip"))
+        self._sendBody(code, body, "application/json", headers)
+
+    def _serveEvents(self, probeServer, query):
+        sensor = probeServer._sensor(query)
+        if sensor is None or sensor.liveFeed is None:
+            self._sendBody(404, b"no live window", "text/plain")
+            return
+        try:
+            lastID = int(self.headers.get("Last-Event-ID", query.get("lastEventId", "")))
+        except ValueError:
+            lastID = None # new stream
+        self.send_response(200)
+        self._sendCORSHeaders()
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.close_connection = True
+        text = "retry: " + str(RETRY_MILLISECONDS) + "\n\n"
+        sentStatus = None
+        version = probeServer._version
+        try:
+            while version is not None:
+                readings = list(sensor.liveFeed.readings)
+                if len(readings) > 0:
+                    firstID, newID = readings[0][0], readings[-1][0]
+                    if lastID is None or lastID < firstID - 1:
+                        text += formatEvent("window", readings, newID)
+                    else:
+                        for row in readings[max(0, lastID - firstID + 1):]:
+                            text += formatEvent("reading", row, row[0])
+                    lastID = newID
+                status = probeServer.status
+                if status is not None and statusEvent(status) != sentStatus:
+                    sentStatus = statusEvent(status)
+                    text += formatEvent("status", sentStatus)
+                if text == "":
+                    text = ": keepalive\n\n" # so dead clients are noticed
+                self.wfile.write(text.encode("ascii"))
+                self.wfile.flush()
+                text = ""
+                version = probeServer.waitForChange(version, KEEPALIVE_INTERVAL)
+        except (BrokenPipeError, ConnectionResetError):
+            pass # browser went away
+
+    def _sendCORSHeaders(self):
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Access-Control-Expose-Headers", "ETag")
+
+    def _sendBody(self, code, body, contentType, headers=[]):
+        self.send_response(code)
+        self._sendCORSHeaders()
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # polled every few seconds; not worth logging
@@ -0,0 +1,120 @@
+"""Heartbeat of ProbeLogger.py, for Monitor.py.
+
+While it runs, ProbeLogger.py rewrites a small JSON status file every few
+seconds: its PID, start time, the time of the heartbeat, and per-sensor last
+sample time, last ID and error counters. The file lives on tmpfs (/dev/shm), so
+the heartbeat never touches the SD card, and it is replaced atomically (rename),
+so a reader never sees half of it.
+
+The logger is considered running if its last heartbeat is recent and its PID is
+alive. Monitor.py waits for the file to change (with inotify if the optional
+inotify_simple package is installed, else by polling its stat) rather than
+checking the process list every second.
+"""
+import json
+import os
+import time
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+STATUS_FILEPATH = "/dev/shm/ProbeLogger.status"
+HEARTBEAT_INTERVAL = 5 # seconds between heartbeats
+HEARTBEAT_STALE = 30 # seconds without a heartbeat after which the logger is down
+POLL_INTERVAL = 1 # seconds between stats of the status file, without inotify
+
+"""Replace the status file with the given status.
+
+    Arguments:
+    status -- a JSON-serializable dict
+    filepath -- the status file
+"""
+def writeStatus(status, filepath=STATUS_FILEPATH):
+    tmpFilepath = filepath + ".tmp"
+    statusFilestream = open(tmpFilepath, 'w')
+    json.dump(status, statusFilestream, sort_keys=True)
+    statusFilestream.close()
+    os.replace(tmpFilepath, filepath)
+
+"""Return the status read from the status file, or None if there is none.
+
+    Arguments:
+    filepath -- the status file
+"""
+def readStatus(filepath=STATUS_FILEPATH):
+    try:
+        with open(filepath) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+"""Return whether a status shows a running logger: a recent heartbeat, from a
+live process, that has not announced it stopped.
+
+    Arguments:
+    status -- a status read with readStatus(), or None
+    now -- the current time; defaults to time.time()
+"""
+def isRunning(status, now=None):
+    if status is None or status.get("stopped") is not None:
+        return False
+    if now is None:
+        now = time.time()
+    if now - status["heartbeat"] > HEARTBEAT_STALE:
+        return False
+    try:
+        os.kill(status["pid"], 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass # alive, under another user
+    return True
+
+"""Waits for the status file to change.
+
+    Arguments:
+    filepath -- the status file
+"""
+class StatusWatcher(object):
+
+    def __init__(self, filepath=STATUS_FILEPATH):
+        self.filepath = filepath
+        self._inotify = None
+        self._lastStat = self._stat()
+        if inotify_simple is not None:
+            self._inotify = inotify_simple.INotify()
+            flags = inotify_simple.flags
+            self._inotify.add_watch(os.path.dirname(filepath), flags.MOVED_TO | flags.CLOSE_WRITE | flags.DELETE)
+
+    def _stat(self):
+        try:
+            st = os.stat(self.filepath)
+            return (st.st_ino, st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    """Return True once the status file has changed, or False after timeout
+    seconds without change.
+
+        Arguments:
+        timeout -- maximum seconds to wait
+    """
+    def wait(self, timeout):
+        deadline = time.monotonic() + timeout
+        name = os.path.basename(self.filepath)
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if self._inotify is not None:
+                for event in self._inotify.read(timeout=int(remaining * 1000)):
+                    if event.name == name:
+                        return True
+            else:
+                time.sleep(min(POLL_INTERVAL, remaining))
+                stat = self._stat()
+                if stat != self._lastStat:
+                    self._lastStat = stat
+                    return True
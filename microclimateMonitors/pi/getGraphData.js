@@ -1,26 +1,169 @@
-getGraphData = function() {
+// Readings are published by ProbeLogger.py as an append-only feed of JSON lines
+// ([ID, timestamp, temperature, humidity]). The whole feed is fetched once;
+// after that only the bytes appended since the last request are fetched. The
+// request starts one byte early: that byte must be the newline ending the last
+// reading we have, otherwise the feed was rewritten and is reloaded.
+//
+// If the logger serves its data itself (PROBE_SERVER_PORT, set by Monitor.py),
+// it pushes each reading and status change over an event stream instead
+// (/events): the window is sent when the stream opens, then each reading as it
+// is logged. The browser reconnects by itself, with the ID of the last reading
+// it got, and is only sent what it missed. Without EventSource, or while the
+// stream is down, only the readings after the last ID we have are requested,
+// with the ETag of the last response, so an unchanged window costs a 304.
+
+var LIVE_WINDOW = 1000; // readings kept for the plot, as in ProbeLogger.py
+var readings = [];
+var feedOffset = 0; // bytes of the feed read so far
+var liveETag = null;
+
+parseFeed = function(text) {
+	var rows = [];
+	var lines = text.split('\n');
+	for (var i=0; i < lines.length; i++) {
+		if (lines[i].length > 0) {
+			rows.push(JSON.parse(lines[i]));
+		}
+	}
+	return rows;
+}
+
+loadFeed = function(text) {
+	var end = text.lastIndexOf('\n') + 1; // ignore a reading still being written
+	readings = parseFeed(text.substring(0, end)).slice(-LIVE_WINDOW);
+	feedOffset = end;
+}
+
+// Return false if the appended bytes do not follow what we have.
+appendFeed = function(text) {
+	if (text.charAt(0) !== '\n') {
+		return false;
+	}
+	var end = text.lastIndexOf('\n');
+	var rows = parseFeed(text.substring(1, end));
+	if (rows.length > 0 && readings.length > 0 && rows[0][0] !== readings[readings.length-1][0] + 1) {
+		return false;
+	}
+	readings = readings.concat(rows).slice(-LIVE_WINDOW);
+	feedOffset += end;
+	return true;
+}
+
+getServerGraphData = function() {
 
 	var xhr = new XMLHttpRequest();
-	var data;
-	
-	xhr.open('GET', 'data.html');
+	var path = '/live';
+	if (readings.length > 0) {
+		path += '?since=' + readings[readings.length-1][0];
+	}
+
+	xhr.open('GET', probeServerURL(path));
+	if (liveETag !== null) {
+		xhr.setRequestHeader('If-None-Match', liveETag);
+	}
 	xhr.send(null);
 
 	xhr.onreadystatechange = function () {
 		var DONE = 4; // readyState 4 means the request is done.
 		var OK = 200; // status 200 is a successful return.
+		var NOT_MODIFIED = 304; // no new readings.
 		if (xhr.readyState === DONE) {
-			if (xhr.status === OK) {
-				//console.log(xhr.responseText);
-				data = JSON.parse(xhr.responseText);
-				plotData(data);
+			if (xhr.status === NOT_MODIFIED) {
+				return;
+			} else if (xhr.status !== OK) {
+				console.log('Error: ' + xhr.status); // e.g. the logger is down
+				liveETag = null;
+				return;
+			}
+			var rows = JSON.parse(xhr.responseText);
+			liveETag = xhr.getResponseHeader('ETag');
+			if (rows.length > 0 && readings.length > 0 && rows[0][0] !== readings[readings.length-1][0] + 1) {
+				readings = rows; // we fell behind the window: this is the whole window
 			} else {
-			    console.log('Error: ' + xhr.status); // An error occurred during the request.
+				readings = readings.concat(rows).slice(-LIVE_WINDOW);
+			}
+			plotData(readings);
+		}
+	};
+
+}
+
+openProbeStream = function() {
+	probeStream = new EventSource(probeServerURL('/events'));
+	probeStream.addEventListener('window', function(e) {
+		readings = JSON.parse(e.data);
+		schedulePlot(readings);
+	});
+	probeStream.addEventListener('reading', function(e) {
+		var row = JSON.parse(e.data);
+		readings.push(row);
+		if (readings.length > LIVE_WINDOW) {
+			readings.shift();
+		}
+		schedulePlot(readings);
+	});
+	probeStream.addEventListener('status', function(e) {
+		showServerStatus(JSON.parse(e.data));
+	});
+}
+
+getGraphData = function() {
+	if (probeStream !== null && probeStream.readyState !== EventSource.CLOSED) {
+		return; // readings are pushed, or the stream is reconnecting
+	}
+	if (typeof PROBE_SERVER_PORT !== 'undefined' && PROBE_SERVER_PORT !== null) {
+		if (probeStream === null && typeof EventSource !== 'undefined') {
+			openProbeStream();
+			return;
+		}
+		getServerGraphData(); // the stream was refused: poll
+	} else {
+		getFeedGraphData();
+	}
+}
+
+getFeedGraphData = function() {
+
+	var xhr = new XMLHttpRequest();
+
+	xhr.open('GET', 'feed.jsonl');
+	xhr.setRequestHeader('Cache-Control', 'no-cache');
+	if (feedOffset > 0) {
+		xhr.setRequestHeader('Range', 'bytes=' + (feedOffset - 1) + '-');
+	}
+	xhr.send(null);
+
+	xhr.onreadystatechange = function () {
+		var DONE = 4; // readyState 4 means the request is done.
+		var OK = 200; // status 200 is a successful return.
+		var PARTIAL = 206; // status 206 is a successful range request.
+		var NOT_SATISFIABLE = 416; // the feed is now shorter than our offset.
+		if (xhr.readyState === DONE) {
+			try {
+				if (xhr.status === PARTIAL) {
+					if (!appendFeed(xhr.responseText)) {
+						feedOffset = 0; // feed was rewritten; reload it next time
+						return;
+					}
+				} else if (xhr.status === OK) {
+					loadFeed(xhr.responseText);
+				} else if (xhr.status === NOT_SATISFIABLE) {
+					feedOffset = 0;
+					return;
+				} else {
+					console.log('Error: ' + xhr.status); // An error occurred during the request.
+					return;
+				}
+			} catch (e) {
+				console.log('Error: ' + e); // e.g. a reading cut by a rewrite
+				feedOffset = 0;
+				return;
 			}
+			plotData(readings);
 		}
 	};
 
 }
 
 setInterval(getGraphData, 5000)
-getGraphData()
\ No newline at end of file
+getGraphData()
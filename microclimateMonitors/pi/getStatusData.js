@@ -1,9 +1,76 @@
+// status.html holds [status, timeCode, since]: the up/downtime is counted here
+// from the UNIX time since, so the file only changes when the status does.
+// If the logger serves its data itself (PROBE_SERVER_PORT, set by Monitor.py),
+// its heartbeat is read from there; status.html is still read when the logger
+// does not answer, since Monitor.py keeps it up to date when the logger is down.
+var statusSince = null;
+var statusETag = null;
+var probeStream = null; // the logger's event stream, opened by getGraphData.js
+
+// URL of a path on the logger's own server; also used by getGraphData.js
+probeServerURL = function(path) {
+	return location.protocol + '//' + location.hostname + ':' + PROBE_SERVER_PORT + path;
+}
+
+getServerStatusData = function() {
+
+	var xhr = new XMLHttpRequest();
+
+	xhr.open('GET', probeServerURL('/status'));
+	if (statusETag !== null) {
+		xhr.setRequestHeader('If-None-Match', statusETag);
+	}
+	xhr.send(null);
+
+	xhr.onreadystatechange = function () {
+		var DONE = 4; // readyState 4 means the request is done.
+		var OK = 200; // status 200 is a successful return.
+		var NOT_MODIFIED = 304; // no heartbeat since the last request.
+		if (xhr.readyState === DONE) {
+			if (xhr.status === OK) {
+				statusETag = xhr.getResponseHeader('ETag');
+				showServerStatus(JSON.parse(xhr.responseText));
+			} else if (xhr.status !== NOT_MODIFIED) {
+				statusETag = null;
+				getFileStatusData(); // logger down, or not started yet
+			}
+		}
+	};
+
+}
+
+// Show a heartbeat from the logger's server, or a status event of its stream.
+showServerStatus = function(status) {
+	if (status.stopped) {
+		document.getElementById('status').innerHTML = 'DOWN';
+		document.getElementById('timeCode').innerHTML = 'Downtime';
+		statusSince = Math.floor(status.stopped);
+	} else {
+		document.getElementById('status').innerHTML = 'running';
+		document.getElementById('timeCode').innerHTML = 'Uptime';
+		statusSince = Math.floor(status.started);
+	}
+	showStatusTime();
+}
+
 getStatusData = function() {
+	if (probeStream !== null && probeStream.readyState === EventSource.OPEN) {
+		return; // status changes are pushed
+	}
+	if (typeof PROBE_SERVER_PORT !== 'undefined' && PROBE_SERVER_PORT !== null) {
+		getServerStatusData();
+	} else {
+		getFileStatusData();
+	}
+}
+
+getFileStatusData = function() {
 
 	var xhr = new XMLHttpRequest();
 	var data;
 	
 	xhr.open('GET', 'status.html');
+	xhr.setRequestHeader('Cache-Control', 'no-cache');
 	xhr.send(null);
 
 	xhr.onreadystatechange = function () {
@@ -15,9 +82,8 @@ getStatusData = function() {
 				data = JSON.parse(xhr.responseText);
 				document.getElementById('status').innerHTML = data[0].toString();
 				document.getElementById('timeCode').innerHTML = data[1].toString();
-				var time = data[2]
-				
-				document.getElementById('time').innerHTML = data[2].toString();
+				statusSince = data[2];
+				showStatusTime();
 			} else {
 			    console.log('Error: ' + xhr.status); // An error occurred during the request.
 			}
@@ -26,5 +92,13 @@ getStatusData = function() {
 
 }
 
-setInterval(getStatusData, 1000)
-getStatusData()
\ No newline at end of file
+showStatusTime = function() {
+	if (statusSince !== null) {
+		var time = Math.max(0, Math.floor(Date.now() / 1000) - statusSince);
+		document.getElementById('time').innerHTML = time.toString();
+	}
+}
+
+setInterval(getStatusData, 5000)
+setInterval(showStatusTime, 1000)
+getStatusData()
@@ -1,3 +1,18 @@
+// Readings can arrive in bursts (e.g. the readings missed while an event stream
+// was reconnecting): draw once per animation frame, with the latest data.
+var plotPending = null;
+
+function schedulePlot(data) {
+	if (plotPending === null) {
+		window.requestAnimationFrame(function() {
+			var pending = plotPending;
+			plotPending = null;
+			plotData(pending);
+		});
+	}
+	plotPending = data;
+}
+
 function plotData(data) {
 	
 	//data = data.slice(0,10);
@@ -1,36 +1,162 @@
 """Script called remotely by Pi's to render the HTML page listing all the IPs.
 
-Page should display on web at a known url. 
+Page should display on web at a known url.
+
+Each Pi calls this script when its IP changes (see IP_Tracker.py), with its
+unit number and new IP:
+
+    python3 render_ip_page.py 3 192.168.1.23
+
+The IP is recorded in ip<unit>.txt, and the page rendered, only if it differs
+from the one on record. The units listed are those with an ip<unit>.txt file,
+so any number of Pis can report. The script can instead run as a long-running
+watcher, which keeps the compiled template and the IPs in memory, and
+re-renders the page only when an ip<unit>.txt file actually changes (waiting
+on inotify if the optional inotify_simple package is installed, else checking
+the files' stat every few seconds):
+
+    python3 render_ip_page.py --watch
 
 Author: James Chamness
 Last modified: May 04, 2017
 """
 
+import argparse
 import jinja2
 import os
+import re
+import time
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+IP_DIRECTORY = "/share/MLC_2017/microclimateMonitors/pipeline/server"
+IP_FILENAME_PATTERN = re.compile(r"^ip(\d+)\.txt$")
+TEMPLATE_FILENAME = "IP_page.jinja"
+PAGE_FILENAME = "IP_page.html"
+POLL_INTERVAL = 5 # seconds between checks of the IP files, without inotify
+
+"""The recorded IPs of the Pis, and the page listing them.
+
+    The template is compiled once. IP files are only read again when their
+    stat changes, and the page is only written when its text changes.
+
+    Arguments:
+    directory -- directory of the ip<unit>.txt files, the template and the page
+"""
+class IPRegistry(object):
+
+    def __init__(self, directory=IP_DIRECTORY):
+        self.directory = directory
+        templateEnv = jinja2.Environment(loader=jinja2.FileSystemLoader(searchpath=directory))
+        self.template = templateEnv.get_template(TEMPLATE_FILENAME)
+        self.pageFilepath = os.path.join(directory, PAGE_FILENAME)
+        self.ips = {} # unit number -> IP
+        self._stats = {} # unit number -> (mtime, size) of its IP file when read
+        self._page = None
+
+    def _ipFilepath(self, unit):
+        return os.path.join(self.directory, "ip" + str(unit) + ".txt")
+
+    """Read the IP files that are new or changed since the last scan. Returns
+    True if any unit's IP changed, or a unit appeared or disappeared."""
+    def scan(self):
+        changed = False
+        units = set()
+        for filename in os.listdir(self.directory):
+            match = IP_FILENAME_PATTERN.match(filename)
+            if match is None:
+                continue
+            unit = int(match.group(1))
+            try:
+                st = os.stat(self._ipFilepath(unit))
+                units.add(unit)
+                if self._stats.get(unit) == (st.st_mtime_ns, st.st_size):
+                    continue
+                with open(self._ipFilepath(unit), 'r') as f:
+                    ip = f.readline().strip()
+            except OSError:
+                continue # replaced or removed while scanning
+            self._stats[unit] = (st.st_mtime_ns, st.st_size)
+            if self.ips.get(unit) != ip:
+                self.ips[unit] = ip
+                changed = True
+        for unit in set(self.ips).difference(units):
+            del self.ips[unit]
+            del self._stats[unit]
+            changed = True
+        return changed
+
+    """Record a unit's IP. Returns True if it changed.
 
-def loadIPs():
-    ips = []
-    for i in range(1,7):
-        ipFilename = "ip" + str(i) + ".txt"
-        ipFilename = "/share/MLC_2017/microclimateMonitors/pipeline/server/" + os.sep + ipFilename    
-        with open(ipFilename, 'r') as f:
-            ips.append(f.readlines()[0].strip())
-    return tuple(ips)
+        Arguments:
+        unit -- unit number of the Pi
+        ip -- its IP
+    """
+    def record(self, unit, ip):
+        if self.ips.get(unit) == ip:
+            return False
+        ipFilepath = self._ipFilepath(unit)
+        with open(ipFilepath + ".tmp", 'w') as f:
+            f.write(ip + "\n")
+        os.replace(ipFilepath + ".tmp", ipFilepath)
+        self.ips[unit] = ip
+        return True
+
+    """Render the page, and write it if its text changed. Returns True if it
+    was written."""
+    def render(self):
+        outputText = self.template.render(units=sorted(self.ips.items()))
+        if self._page is None and os.path.isfile(self.pageFilepath):
+            with open(self.pageFilepath, 'r') as f:
+                self._page = f.read()
+        if outputText == self._page:
+            return False
+        with open(self.pageFilepath + ".tmp", 'w') as outputFile:
+            outputFile.write(outputText)
+        os.replace(self.pageFilepath + ".tmp", self.pageFilepath)
+        self._page = outputText
+        return True
+
+    """Re-render the page whenever an IP file changes, until interrupted."""
+    def watch(self):
+        inotify = None
+        if inotify_simple is not None:
+            inotify = inotify_simple.INotify()
+            flags = inotify_simple.flags
+            inotify.add_watch(self.directory, flags.MOVED_TO | flags.CLOSE_WRITE | flags.DELETE)
+        while True:
+            if self.scan():
+                self.render()
+            if inotify is not None:
+                # wait for a change to an IP file; the page's own writes are not
+                while not any(IP_FILENAME_PATTERN.match(event.name) for event in inotify.read()):
+                    pass
+            else:
+                time.sleep(POLL_INTERVAL)
 
 """Executable"""
 if __name__ == "__main__":
-    
-    ipPageFilename = "/share/MLC_2017/microclimateMonitors/pipeline/server/IP_page.html"
-    templateLoader = jinja2.FileSystemLoader(searchpath="/share/MLC_2017/microclimateMonitors/pipeline/server")
-    templateEnv = jinja2.Environment(loader=templateLoader)
-    templateFilename = "IP_page.jinja"
-    template = templateEnv.get_template(templateFilename)
-    
-    ip1, ip2, ip3, ip4, ip5, ip6 = loadIPs()
-    templateVars = { "ip1":ip1, "ip2":ip2, "ip3":ip3, "ip4":ip4, "ip5":ip5, "ip6":ip6 }
-    
-    outputText = template.render(templateVars)
-    outputFile = open(ipPageFilename,'w')
-    outputFile.write(outputText)
-    outputFile.close()
\ No newline at end of file
+
+    parser = argparse.ArgumentParser(description="Record a Pi's IP and render the IP page.")
+    parser.add_argument("unit", nargs="?", type=int, help="unit number of the Pi reporting")
+    parser.add_argument("ip", nargs="?", help="its new IP")
+    parser.add_argument("--watch", action="store_true", help="re-render the page whenever an IP file changes, until interrupted")
+    parser.add_argument("--directory", default=IP_DIRECTORY, help="directory of the IP files, template and page")
+    args = parser.parse_args()
+
+    registry = IPRegistry(args.directory)
+    registry.scan()
+    if args.unit is not None:
+        if args.ip is None:
+            parser.error("a unit number needs an IP")
+        registry.record(args.unit, args.ip)
+    if args.watch:
+        try:
+            registry.watch()
+        except KeyboardInterrupt:
+            pass
+    else:
+        registry.render()